@@ -3,23 +3,54 @@ import io
 import numpy as np
 import cv2
 import onnxruntime as ort
-from flask import Flask, request, jsonify
+from onnxruntime.capi.onnxruntime_pybind11_state import Fail as OrtFail, InvalidArgument as OrtInvalidArgument
+import preprocessing
+import metrics
+import model_cache
+from flask import Flask, request, jsonify, Response, g
 import logging
 import base64
 import time
 import pymongo
 import threading
 import queue
-from datetime import datetime
+from concurrent.futures import Future
+from datetime import datetime, timedelta
 import uuid
+import atexit
+import tempfile
+import hashlib
+import math
+import json
+import struct
+import random
+import heapq
+import re
+from concurrent.futures import ThreadPoolExecutor
+from collections import OrderedDict, deque
+import gridfs
+from bson import Binary
 
-# MongoDB connection
-MONGO_URI = os.environ.get('MONGO_URI')
-mongo_client = pymongo.MongoClient(MONGO_URI)
+# Start of the boot, for the time-to-ready and time-to-first-request logs
+boot_started = time.perf_counter()
 
+# MongoDB connection, created on first use so the client setup (and the SRV lookup of a
+# mongodb+srv URI) stays off the boot path
+MONGO_URI = os.environ.get('MONGO_URI')
+mongo_client = None
+db = None
+mongo_lock = threading.Lock()
 
-db = mongo_client['deepfake_detector'] 
 
+def get_db():
+    """Return the deepfake_detector database, connecting on the first call."""
+    global mongo_client, db
+    if db is None:
+        with mongo_lock:
+            if db is None:
+                mongo_client = pymongo.MongoClient(MONGO_URI)
+                db = mongo_client['deepfake_detector']
+    return db
 
 
 # Tracking current model version
@@ -30,156 +61,1993 @@ logging.basicConfig(level=logging.INFO,
                     format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
-# Suppressing TensorFlow logs 
-os.environ['TF_CPP_MIN_LOG_LEVEL'] = '2'
+# Suppressing TensorFlow logs 
+os.environ['TF_CPP_MIN_LOG_LEVEL'] = '2'
+
+
+def parse_flag(value, default=False):
+    """Read a boolean option sent as JSON or as a form field."""
+    if value is None:
+        return default
+    if isinstance(value, bool):
+        return value
+    return str(value).strip().lower() in ('1', 'true', 'yes', 'on')
+
+
+# ONNX Runtime session profile, read from a JSON file named by ORT_SESSION_CONFIG
+# and overridden by individual environment variables
+GRAPH_OPTIMIZATION_LEVELS = {
+    "disable": ort.GraphOptimizationLevel.ORT_DISABLE_ALL,
+    "basic": ort.GraphOptimizationLevel.ORT_ENABLE_BASIC,
+    "extended": ort.GraphOptimizationLevel.ORT_ENABLE_EXTENDED,
+    "all": ort.GraphOptimizationLevel.ORT_ENABLE_ALL,
+}
+EXECUTION_MODES = {
+    "sequential": ort.ExecutionMode.ORT_SEQUENTIAL,
+    "parallel": ort.ExecutionMode.ORT_PARALLEL,
+}
+
+
+def load_session_profile():
+    """Build the session profile from the defaults, the config file and the environment."""
+    profile = {
+        "model_path": "FinalModel.onnx",
+        "int8_model_path": "FinalModel.int8.onnx",
+        "precision": "fp32",
+        # Batches from the scheduler run one at a time, so one inter-op thread is enough
+        "intra_op_threads": os.cpu_count() or 1,
+        "inter_op_threads": 1,
+        "graph_optimization": "all",
+        "execution_mode": "sequential",
+        # Spinning threads burn CPU that the request threads need between batches
+        "allow_spinning": False,
+        # Memory-map the weights from the optimized model cache, shared by all worker processes
+        "shared_weights": False,
+    }
+    
+    config_path = os.environ.get('ORT_SESSION_CONFIG')
+    if config_path:
+        with open(config_path) as f:
+            profile.update(json.load(f))
+    
+    env_overrides = {
+        "model_path": ('ONNX_MODEL_PATH', str),
+        "int8_model_path": ('ONNX_INT8_MODEL_PATH', str),
+        "precision": ('MODEL_PRECISION', str),
+        "intra_op_threads": ('ORT_INTRA_OP_THREADS', int),
+        "inter_op_threads": ('ORT_INTER_OP_THREADS', int),
+        "graph_optimization": ('ORT_GRAPH_OPTIMIZATION', str),
+        "execution_mode": ('ORT_EXECUTION_MODE', str),
+        "allow_spinning": ('ORT_ALLOW_SPINNING', parse_flag),
+        "shared_weights": ('MODEL_SHARED_WEIGHTS', parse_flag),
+    }
+    for key, (name, convert) in env_overrides.items():
+        if os.environ.get(name):
+            profile[key] = convert(os.environ[name])
+    
+    if profile["graph_optimization"] not in GRAPH_OPTIMIZATION_LEVELS:
+        raise ValueError(f"Unknown graph optimization level '{profile['graph_optimization']}'")
+    if profile["execution_mode"] not in EXECUTION_MODES:
+        raise ValueError(f"Unknown execution mode '{profile['execution_mode']}'")
+    if profile["precision"] not in ("fp32", "int8"):
+        raise ValueError(f"Unknown model precision '{profile['precision']}'")
+    return profile
+
+
+def build_session_options(profile):
+    """Translate a session profile into ONNX Runtime session options."""
+    options = ort.SessionOptions()
+    options.intra_op_num_threads = profile["intra_op_threads"]
+    options.inter_op_num_threads = profile["inter_op_threads"]
+    options.graph_optimization_level = GRAPH_OPTIMIZATION_LEVELS[profile["graph_optimization"]]
+    options.execution_mode = EXECUTION_MODES[profile["execution_mode"]]
+    options.add_session_config_entry("session.intra_op.allow_spinning", "1" if profile["allow_spinning"] else "0")
+    options.add_session_config_entry("session.inter_op.allow_spinning", "1" if profile["allow_spinning"] else "0")
+    # Prepacked weights are private copies per session, which would undo the sharing
+    if profile["shared_weights"]:
+        options.add_session_config_entry("session.disable_prepacking", "1")
+    return options
+
+
+def select_model_path(profile):
+    """Use the INT8 model when requested and available, otherwise the FP32 model."""
+    if profile["precision"] == "int8":
+        if os.path.exists(profile["int8_model_path"]):
+            return profile["int8_model_path"]
+        logger.warning(f"INT8 model {profile['int8_model_path']} not found, using {profile['model_path']}. "
+                       f"Create it with: python model_tools.py quantize")
+    return profile["model_path"]
+
+
+def cached_model_path(model_path, profile):
+    """Return the cached optimized graph of model_path, building it on the first boot that misses it.
+
+    The cache lives in ORT_OPTIMIZED_MODEL_DIR ("off" disables it). Any cache problem
+    falls back to model_path itself.
+    """
+    cache_dir = os.environ.get('ORT_OPTIMIZED_MODEL_DIR', 'ort_cache')
+    if not cache_dir or cache_dir.lower() == 'off':
+        return model_path
+    try:
+        cached_path = model_cache.optimized_model_filepath(model_path, cache_dir, profile["graph_optimization"],
+                                                           external_data=profile["shared_weights"])
+        if cached_path is None:
+            return model_path
+        if not os.path.exists(cached_path):
+            started = time.perf_counter()
+            model_cache.build_optimized_model(model_path, cache_dir, profile["graph_optimization"],
+                                              build_session_options(profile), external_data=profile["shared_weights"])
+            logger.info(f"Cached the optimized graph of {model_path} in {cached_path} "
+                        f"({time.perf_counter() - started:.2f}s)")
+        return cached_path
+    except Exception as e:
+        logger.warning(f"Optimized model cache unavailable ({e}), loading {model_path} directly")
+        return model_path
+
+
+def create_inference_session(model_path, profile):
+    """Create the session, from the cached optimized graph when there is one."""
+    loaded_path = cached_model_path(model_path, profile)
+    session = ort.InferenceSession(loaded_path, sess_options=build_session_options(profile),
+                                   providers=["CPUExecutionProvider"])
+    return session, loaded_path
+
+
+session_profile = load_session_profile()
+onnx_model_path = select_model_path(session_profile)
+
+
+def model_file_fingerprint(model_path):
+    """Digest of the model file's name, size and mtime, or None if it is missing.
+
+    Like model_cache's file names it never reads the model, so it adds nothing to the cold start.
+    """
+    try:
+        stat = os.stat(model_path)
+    except OSError as e:
+        logger.warning(f"Cannot stat {model_path} ({e}), verdicts are cached for this process only")
+        return None
+    identity = f"{os.path.basename(model_path)}:{stat.st_size}:{stat.st_mtime_ns}"
+    return hashlib.sha256(identity.encode()).hexdigest()
+
+
+# Verdict cache entries are keyed on the model file's identity, so every instance and restart
+# serving the same file shares them. Without the file they fall back to the boot version
+verdict_model_version = (model_file_fingerprint(onnx_model_path) or current_model_version)[:16]
+
+# Batched inference settings, frames are stacked into N x 3 x 224 x 224 tensors
+INFERENCE_BATCH_SIZE = max(1, int(os.environ.get('INFERENCE_BATCH_SIZE', 32)))
+
+# Model state, filled in by load_model. The session loads on a background thread so the
+# server answers /healthz straight away; model endpoints wait for it up to MODEL_READY_WAIT
+# seconds and answer 503 after that
+MODEL_LOAD_BACKGROUND = os.environ.get('MODEL_LOAD_BACKGROUND', '1') == '1'
+MODEL_WARMUP = os.environ.get('MODEL_WARMUP', '1') == '1'
+MODEL_READY_WAIT = float(os.environ.get('MODEL_READY_WAIT', 30))
+
+# Set by gunicorn.conf.py: the master imports the app once and forks the workers. Threads,
+# ONNX Runtime sessions and Mongo clients do not survive a fork, so the master only prepares
+# the model cache and each worker starts them in start_worker()
+APP_PRELOAD = os.environ.get('APP_PRELOAD', '0') == '1'
+
+ort_session = None
+model_input_name = None
+model_batch_dim = None
+model_input_dtype = np.float32
+preprocess_engine = None
+fixed_batch_size = None
+inference_batch_size = INFERENCE_BATCH_SIZE
+model_loaded = threading.Event()
+model_load_error = None
+startup_timings = {}
+
+app = Flask(__name__)
+
+# Adding CORS headers for API access from browser extension
+@app.after_request
+def after_request(response):
+    response.headers.add('Access-Control-Allow-Origin', '*')
+    response.headers.add('Access-Control-Allow-Headers', 'Content-Type,X-Request-ID,Cache-Control,Pragma')
+    response.headers.add('Access-Control-Allow-Methods', 'GET,POST,OPTIONS')
+    
+    # Request latency and status by endpoint
+    started = g.pop('request_started', None)
+    if started is not None:
+        endpoint = request.endpoint or 'unknown'
+        request_latency.observe(time.perf_counter() - started, endpoint=endpoint)
+        requests_total.inc(endpoint=endpoint, status=response.status_code)
+    return response
+
+
+# Endpoints that need the model, answered with 503 while it is loading
+MODEL_ENDPOINTS = {'index', 'analyze_frames', 'create_job'}
+first_request_logged = threading.Event()
+
+
+def log_first_request(method, path, started):
+    if not first_request_logged.is_set():
+        first_request_logged.set()
+        startup_timings["first_request_seconds"] = round(started - boot_started, 3)
+        logger.info(f"First request {startup_timings['first_request_seconds']:.2f}s after boot "
+                    f"({method} {path}, model {'ready' if model_ready() else 'not ready'})")
+
+
+@app.before_request
+def before_request():
+    g.request_started = time.perf_counter()
+    log_first_request(request.method, request.path, g.request_started)
+    
+    if request.method == 'POST' and request.endpoint in MODEL_ENDPOINTS and not model_ready():
+        model_loaded.wait(MODEL_READY_WAIT)
+        if not model_ready():
+            response = jsonify({"error": "Model is not ready", "status": "failed" if model_load_error else "loading"})
+            response.status_code = 503
+            response.headers['Retry-After'] = str(max(1, int(MODEL_READY_WAIT)))
+            return response
+
+
+# Prometheus metrics, served on /metrics. Every sample carries the model version label
+metrics_registry = metrics.Registry(const_labels={"model_version": current_model_version})
+stage_latency = metrics.Histogram(
+    "deepfake_stage_seconds", "Time per call of each pipeline stage (per frame for decodes, per batch for inference)",
+    ["stage"], registry=metrics_registry)
+request_latency = metrics.Histogram(
+    "deepfake_request_seconds", "Request latency by endpoint", ["endpoint"], registry=metrics_registry)
+requests_total = metrics.Counter(
+    "deepfake_requests_total", "Requests by endpoint and status code", ["endpoint", "status"], registry=metrics_registry)
+frames_processed = metrics.Counter(
+    "deepfake_frames_processed_total", "Frames run through the model", registry=metrics_registry)
+frames_stored = metrics.Counter(
+    "deepfake_frames_stored_total", "Frame documents written to the database", registry=metrics_registry)
+frame_bytes_stored = metrics.Counter(
+    "deepfake_frame_bytes_stored_total", "JPEG bytes of the frame documents written to the database",
+    registry=metrics_registry)
+frame_retention_decisions = metrics.Counter(
+    "deepfake_frame_retention_total", "Frames offered for storage by retention decision", ["decision"],
+    registry=metrics_registry)
+frames_removed = metrics.Counter(
+    "deepfake_frames_removed_total", "Frame documents removed by the retention sweeper", ["reason"],
+    registry=metrics_registry)
+failures = metrics.Counter(
+    "deepfake_failures_total", "Failures by pipeline stage", ["stage"], registry=metrics_registry)
+inference_queue_depth = metrics.Gauge(
+    "deepfake_inference_queue_depth", "Requests waiting in the inference scheduler", registry=metrics_registry)
+inference_queue_depth.set_function(lambda: inference_scheduler.requests.qsize() if inference_scheduler is not None else 0)
+frame_write_queue_depth = metrics.Gauge(
+    "deepfake_frame_write_queue_depth", "Frame documents waiting for the background writer", registry=metrics_registry)
+frame_write_queue_depth.set_function(lambda: frame_writer.documents.qsize())
+model_info = metrics.Gauge(
+    "deepfake_model_info", "Loaded model file and precision", ["model_path", "precision"], registry=metrics_registry)
+model_info.set(1, model_path=os.path.basename(onnx_model_path), precision=session_profile["precision"])
+
+# Fraction of received /frames frames logged at debug level
+FRAME_LOG_SAMPLE_RATE = float(os.environ.get('FRAME_LOG_SAMPLE_RATE', 0.04))
+
+
+
+
+# Background persistence of frames, so Mongo latency stays off the request path
+class FrameWriter:
+    """Writes frame documents to MongoDB from background threads in insert_many batches.
+
+    Documents wait in a bounded queue. When it is full, the "drop" policy discards
+    the new document and the "block" policy waits up to block_timeout for space.
+    failed_fn, if given, is called with the IDs of documents whose write failed.
+    """
+
+    def __init__(self, collection_fn, queue_size=2000, flush_size=100, flush_interval=0.5,
+                 policy="drop", block_timeout=5.0, writers=1, prepare_fn=None, failed_fn=None):
+        self.collection_fn = collection_fn
+        self.prepare_fn = prepare_fn
+        self.failed_fn = failed_fn
+        self.flush_size = flush_size
+        self.flush_interval = flush_interval
+        self.policy = policy
+        self.block_timeout = block_timeout
+        self.writers = writers
+        self.documents = queue.Queue(maxsize=queue_size)
+        self.pending = {}  # _id -> document, from put until its write finishes
+        self.writing = set()  # _ids of pending documents whose batch is being inserted
+        self.deferred = {}  # _id -> updates to apply once its insert is done
+        self.threads = []
+        self.lock = threading.Lock()
+
+        self.enqueued = 0
+        self.written = 0
+        self.dropped = 0
+        self.duplicates = 0
+        self.failed = 0
+
+    def start(self):
+        for n in range(self.writers):
+            thread = threading.Thread(target=self._loop, name=f"frame-writer-{n}", daemon=True)
+            thread.start()
+            self.threads.append(thread)
+
+    def put(self, document):
+        """Queue a document for writing, returning False if it was dropped."""
+        with self.lock:
+            self.pending[document["_id"]] = document
+        try:
+            if self.policy == "block":
+                self.documents.put(document, timeout=self.block_timeout)
+            else:
+                self.documents.put_nowait(document)
+        except queue.Full:
+            with self.lock:
+                self.dropped += 1
+                self.pending.pop(document["_id"], None)
+            failures.inc(stage="frame_queue_full")
+            logger.warning(f"Frame write queue full, dropping frame {document.get('_id')}")
+            return False
+        with self.lock:
+            self.enqueued += 1
+        return True
+
+    def _loop(self):
+        stopping = False
+        while not stopping:
+            document = self.documents.get()
+            if document is None:
+                break
+            batch = [document]
+            deadline = time.monotonic() + self.flush_interval
+
+            # Group documents until the batch is full or the flush interval has passed
+            while len(batch) < self.flush_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    document = self.documents.get(timeout=remaining)
+                except queue.Empty:
+                    break
+                if document is None:
+                    stopping = True
+                    break
+                batch.append(document)
+
+            self._write(batch)
+
+    def pending_document(self, document_id):
+        """Return a queued document that has not been written yet, or None."""
+        with self.lock:
+            return self.pending.get(document_id)
+
+    def update_pending(self, document_id, update):
+        """Apply a $set/$unset update to a document that is not written yet, returning False if there is none.
+
+        A queued document is changed in place. One whose batch is already being inserted
+        gets the update on the collection once the insert is done.
+        """
+        with self.lock:
+            document = self.pending.get(document_id)
+            if document is None:
+                return False
+            if document_id in self.writing:
+                self.deferred.setdefault(document_id, []).append(update)
+                return True
+            document.update(update.get("$set", {}))
+            for field in update.get("$unset", {}):
+                document.pop(field, None)
+            return True
+
+    def _write(self, batch):
+        document_ids = [document["_id"] for document in batch]
+        failed_ids = []
+        with self.lock:
+            self.writing.update(document_ids)
+        try:
+            if self.prepare_fn is not None:
+                batch = self.prepare_fn(batch)
+            with stage_latency.time(stage="frame_write"):
+                self.collection_fn().insert_many(batch, ordered=False)
+            with self.lock:
+                self.written += len(batch)
+            frames_stored.inc(len(batch))
+            frame_bytes_stored.inc(sum(document.get("size", 0) for document in batch))
+        except pymongo.errors.BulkWriteError as e:
+            # Documents that already exist are duplicates, anything else is a real failure
+            write_errors = e.details.get("writeErrors", [])
+            duplicates = sum(1 for error in write_errors if error.get("code") == 11000)
+            with self.lock:
+                self.written += e.details.get("nInserted", 0)
+                self.duplicates += duplicates
+                self.failed += len(write_errors) - duplicates
+            frames_stored.inc(e.details.get("nInserted", 0))
+            failed_ids = [document_ids[error["index"]] for error in write_errors if error.get("code") != 11000]
+            if len(write_errors) > duplicates:
+                failures.inc(len(write_errors) - duplicates, stage="frame_write")
+                logger.error(f"Error writing {len(write_errors) - duplicates} of {len(batch)} frames: {e}")
+        except Exception as e:
+            with self.lock:
+                self.failed += len(batch)
+            failed_ids = document_ids
+            failures.inc(len(batch), stage="frame_write")
+            logger.exception(f"Error writing {len(batch)} frames: {e}")
+        finally:
+            with self.lock:
+                for document_id in document_ids:
+                    self.pending.pop(document_id, None)
+                self.writing.difference_update(document_ids)
+                deferred = [(document_id, self.deferred.pop(document_id)) for document_id in document_ids
+                            if document_id in self.deferred]
+            self._apply_deferred(deferred)
+            if failed_ids and self.failed_fn is not None:
+                self.failed_fn(failed_ids)
+
+    def _apply_deferred(self, deferred):
+        for document_id, updates in deferred:
+            for update in updates:
+                try:
+                    self.collection_fn().update_one({"_id": document_id}, update)
+                except Exception as e:
+                    failures.inc(stage="frame_write")
+                    logger.warning(f"Could not update frame {document_id} after its write: {e}")
+
+    def shutdown(self, timeout=10.0):
+        """Drain queued documents and stop the writer threads."""
+        if not self.threads:
+            return
+        logger.info(f"Draining frame write queue ({self.documents.qsize()} pending)")
+        for _ in self.threads:
+            self.documents.put(None)
+        for thread in self.threads:
+            thread.join(timeout)
+        self.threads = []
+
+    def stats(self):
+        """Return a snapshot of the writer counters."""
+        with self.lock:
+            return {
+                "enqueued": self.enqueued,
+                "written": self.written,
+                "dropped": self.dropped,
+                "duplicates": self.duplicates,
+                "failed": self.failed,
+                "queue_depth": self.documents.qsize(),
+            }
+
+
+
+
+# Frames larger than this go to GridFS instead of being embedded in the frame document
+FRAME_GRIDFS_THRESHOLD = int(os.environ.get('FRAME_GRIDFS_THRESHOLD', 1024 * 1024))
+
+# Recently queued frame hashes, so repeated frames are not written twice. Each maps to the
+# frame's expires_at (None if it never expires), an expired entry no longer counts
+recent_frame_hashes = OrderedDict()
+recent_frame_hashes_lock = threading.Lock()
+RECENT_FRAME_HASHES_SIZE = 10000
+
+
+def forget_frame_hashes(frame_ids):
+    """Drop frames that failed to write or were removed, so they are written again when seen."""
+    with recent_frame_hashes_lock:
+        for frame_id in frame_ids:
+            recent_frame_hashes.pop(frame_id, None)
+
+# Frame payloads in / responses: "full" inlines every kept frame as a full-size base64 JPEG,
+# "thumbnails" as a small base64 JPEG, "ref" only lists IDs to fetch from GET /frames/<id>,
+# and "none" leaves frames_data out. Requests choose with the "frames" form field
+FRAMES_RESPONSE_MODES = ("full", "thumbnails", "ref", "none")
+FRAMES_RESPONSE_DEFAULT = os.environ.get('FRAMES_RESPONSE', 'full')
+FRAME_THUMBNAIL_SIZE = int(os.environ.get('FRAME_THUMBNAIL_SIZE', 160))
+FRAME_THUMBNAIL_QUALITY = int(os.environ.get('FRAME_THUMBNAIL_QUALITY', 70))
+
+
+def frames_response_mode(form):
+    """Read the frames response mode from the request's form fields."""
+    mode = form.get('frames') or FRAMES_RESPONSE_DEFAULT
+    if mode not in FRAMES_RESPONSE_MODES:
+        raise ValueError(f"'{mode}' is not one of {', '.join(FRAMES_RESPONSE_MODES)}")
+    return mode
+
+
+def encode_frame(frame, quality=80):
+    """Encode a frame as JPEG once, returning the raw bytes or None on failure."""
+    with stage_latency.time(stage="image_encode"):
+        success, img_encoded = cv2.imencode('.jpg', frame, [cv2.IMWRITE_JPEG_QUALITY, quality])
+    if not success:
+        failures.inc(stage="image_encode")
+        logger.warning("Failed to encode frame")
+        return None
+    return img_encoded.tobytes()
+
+
+def encode_thumbnail(frame, size=FRAME_THUMBNAIL_SIZE, quality=FRAME_THUMBNAIL_QUALITY):
+    """Encode a frame as a JPEG whose longest side is at most size pixels."""
+    height, width = frame.shape[:2]
+    scale = size / max(height, width)
+    if scale < 1:
+        frame = cv2.resize(frame, (max(1, round(width * scale)), max(1, round(height * scale))),
+                           interpolation=cv2.INTER_AREA)
+    return encode_frame(frame, quality)
+
+
+def stored_frame_bytes(document):
+    """Return the JPEG bytes of a frames document, embedded, in GridFS or (older documents) base64."""
+    if document.get("gridfs_id") is not None:
+        try:
+            return gridfs.GridFS(get_db()).get(document["gridfs_id"]).read()
+        except gridfs.errors.NoFile:
+            return None
+    data = document.get("data")
+    if data is None:
+        return None
+    if isinstance(data, str):
+        return base64.b64decode(data)
+    return bytes(data)
+
+
+def offload_large_frames(batch):
+    """Move frame payloads over FRAME_GRIDFS_THRESHOLD into GridFS before the batch is inserted."""
+    fs = None
+    for document in batch:
+        if len(document["data"]) <= FRAME_GRIDFS_THRESHOLD:
+            continue
+        if fs is None:
+            fs = gridfs.GridFS(get_db())
+        try:
+            fs.put(bytes(document["data"]), _id=document["_id"], content_type="image/jpeg")
+        except gridfs.errors.FileExists:
+            pass
+        del document["data"]
+        document["gridfs_id"] = document["_id"]
+        # The TTL index would leave the GridFS payload behind, the retention sweeper expires these
+        if "expires_at" in document:
+            document["gridfs_expires_at"] = document.pop("expires_at")
+    return batch
+
+
+# Frame retention: a request stores only the frames most useful for retraining, the ones whose
+# prediction is closest to FRAME_THRESHOLD plus a small random sample of the rest. Stored frames
+# expire after FRAME_TTL_DAYS unless a /feedback pins them, and once the frames outgrow
+# FRAME_STORAGE_BUDGET_MB the oldest unpinned ones are evicted. FRAME_RETENTION=0 stores every
+# kept frame forever, as before
+RETENTION_BORDERLINE_BAND = float(os.environ.get('RETENTION_BORDERLINE_BAND', 0.1))
+RETENTION_MAX_BORDERLINE = int(os.environ.get('RETENTION_MAX_BORDERLINE', 8))
+RETENTION_SAMPLE_SIZE = int(os.environ.get('RETENTION_SAMPLE_SIZE', 2))
+FRAME_TTL_DAYS = float(os.environ.get('FRAME_TTL_DAYS', 30))
+FRAME_STORAGE_BUDGET_MB = float(os.environ.get('FRAME_STORAGE_BUDGET_MB', 0))
+FRAME_RETENTION_SWEEP_INTERVAL = float(os.environ.get('FRAME_RETENTION_SWEEP_INTERVAL', 300))
+
+
+class FrameSelector:
+    """Picks the frames of one request worth storing from a stream of (item, prediction) offers.
+
+    Up to max_borderline frames within band of the threshold are kept, closest first, and
+    a reservoir sample of sample_size is kept from all the others.
+    """
+
+    def __init__(self, threshold, band, max_borderline, sample_size):
+        self.threshold = threshold
+        self.band = band
+        self.max_borderline = max_borderline
+        self.sample_size = sample_size
+        self.borderline = []  # Heap of (-distance, order, item, prediction), farthest on top
+        self.sample = []
+        self.offered = 0
+        self.rest = 0
+
+    def offer(self, item, prediction):
+        self.offered += 1
+        distance = abs(float(prediction) - self.threshold)
+        if distance <= self.band and self.max_borderline > 0:
+            entry = (-distance, self.offered, item, prediction)
+            if len(self.borderline) < self.max_borderline:
+                heapq.heappush(self.borderline, entry)
+                return
+            if entry[0] > self.borderline[0][0]:
+                entry = heapq.heapreplace(self.borderline, entry)
+            _, _, item, prediction = entry
+        self._sample(item, prediction)
+
+    def _sample(self, item, prediction):
+        self.rest += 1
+        if len(self.sample) < self.sample_size:
+            self.sample.append((item, prediction))
+            return
+        slot = random.randrange(self.rest)
+        if slot < self.sample_size:
+            self.sample[slot] = (item, prediction)
+
+    def selected(self):
+        """Return the kept (item, prediction, reason) tuples, borderline frames in offer order."""
+        borderline = [(item, prediction, "borderline") for _, _, item, prediction in sorted(self.borderline, key=lambda e: e[1])]
+        kept = borderline + [(item, prediction, "sample") for item, prediction in self.sample]
+        frame_retention_decisions.inc(len(borderline), decision="borderline")
+        frame_retention_decisions.inc(len(self.sample), decision="sample")
+        frame_retention_decisions.inc(self.offered - len(kept), decision="skipped")
+        return kept
+
+
+class FrameRetention:
+    """Retention policy of the frames collection: selection, expiry, pinning and a size budget.
+
+    Frames get an expires_at date served by a TTL index, pinning removes it. The sweeper
+    thread expires GridFS-backed frames, which the TTL index cannot clean up, and evicts the
+    oldest unpinned frames while the collection is over budget_bytes.
+    """
+
+    def __init__(self, db_fn, ttl_days=30, budget_bytes=0, sweep_interval=300.0, evict_batch=500):
+        self.db_fn = db_fn
+        self.ttl = timedelta(days=ttl_days) if ttl_days > 0 else None
+        self.budget_bytes = budget_bytes
+        self.sweep_interval = sweep_interval
+        self.evict_batch = evict_batch
+        self.indexes_ready = False
+        self.thread = None
+        self.lock = threading.Lock()
+
+        self.pinned = 0
+        self.expired = 0
+        self.evicted = 0
+        self.sweeps = 0
+        self.storage_bytes = None
+
+    def selector(self):
+        return FrameSelector(FRAME_THRESHOLD, RETENTION_BORDERLINE_BAND, RETENTION_MAX_BORDERLINE, RETENTION_SAMPLE_SIZE)
+
+    def expires_at(self):
+        return datetime.utcnow() + self.ttl if self.ttl is not None else None
+
+    def ensure_indexes(self, collection):
+        if self.indexes_ready:
+            return
+        collection.create_index("expires_at", expireAfterSeconds=0)
+        collection.create_index("gridfs_expires_at", sparse=True)
+        collection.create_index("timestamp")
+        self.indexes_ready = True
+
+    @staticmethod
+    def pin_update(frame_ids):
+        """Filter and update that pin the given frames, for a sync or an async collection."""
+        return ({"_id": {"$in": frame_ids}},
+                {"$set": {"pinned": True}, "$unset": {"expires_at": "", "gridfs_expires_at": ""}})
+
+    def pin_pending(self, frame_ids):
+        """Pin the frames the writer has not stored yet, returning (pinned, IDs left for the update).
+
+        The writer pins a frame whose insert is in flight once it completes, an update on the
+        collection could miss it.
+        """
+        _, update = self.pin_update(frame_ids)
+        remaining = [frame_id for frame_id in frame_ids if not frame_writer.update_pending(frame_id, update)]
+        return len(frame_ids) - len(remaining), remaining
+
+    def pin(self, frame_ids):
+        """Pin frames referenced by feedback, so neither expiry nor the size budget removes them."""
+        frame_ids = [frame_id for frame_id in frame_ids if isinstance(frame_id, str)]
+        if not frame_ids:
+            return 0
+        pinned, frame_ids = self.pin_pending(frame_ids)
+        if frame_ids:
+            pinned += self.db_fn().frames.update_many(*self.pin_update(frame_ids)).modified_count
+        self.record_pinned(pinned)
+        return pinned
+
+    def record_pinned(self, count):
+        with self.lock:
+            self.pinned += count
+
+    def start(self):
+        if self.thread is None:
+            self.thread = threading.Thread(target=self._loop, name="frame-retention", daemon=True)
+            self.thread.start()
+
+    def _loop(self):
+        while True:
+            time.sleep(self.sweep_interval)
+            try:
+                self.sweep()
+            except Exception as e:
+                failures.inc(stage="frame_retention")
+                logger.warning(f"Frame retention sweep failed: {e}")
+
+    def collection_bytes(self, db):
+        """Data size of the frames collection and the GridFS chunks, from $collStats."""
+        total = 0
+        for name in ("frames", "fs.chunks"):
+            try:
+                for stats in db[name].aggregate([{"$collStats": {"storageStats": {}}}]):
+                    total += stats["storageStats"]["size"]
+            except pymongo.errors.OperationFailure:
+                continue
+        return total
+
+    def _remove(self, db, documents, reason):
+        """Delete frame documents, GridFS payloads first so no document points at a missing file."""
+        fs = None
+        for document in documents:
+            if document.get("gridfs_id") is not None:
+                fs = fs or gridfs.GridFS(db)
+                fs.delete(document["gridfs_id"])
+        frame_ids = [document["_id"] for document in documents]
+        removed = db.frames.delete_many({"_id": {"$in": frame_ids}}).deleted_count
+        forget_frame_hashes(frame_ids)
+        frames_removed.inc(removed, reason=reason)
+        return removed
+
+    def sweep(self):
+        """Expire GridFS-backed frames and enforce the size budget, returning what was removed."""
+        db = self.db_fn()
+        expired = 0
+        while True:
+            documents = list(db.frames.find({"gridfs_expires_at": {"$lte": datetime.utcnow()}},
+                                            {"_id": 1, "gridfs_id": 1}, limit=self.evict_batch))
+            if not documents:
+                break
+            expired += self._remove(db, documents, "expired")
+
+        evicted = 0
+        used = self.collection_bytes(db) if self.budget_bytes else None
+        if used is not None and used > self.budget_bytes:
+            # Evict down to 90% of the budget, so the next few requests do not trigger another sweep
+            target = self.budget_bytes * 0.9
+            while used > target:
+                documents = list(db.frames.find({"pinned": {"$ne": True}}, {"_id": 1, "gridfs_id": 1},
+                                                sort=[("timestamp", 1)], limit=self.evict_batch))
+                if not documents:
+                    logger.warning(f"Frames use {used} bytes, over the {self.budget_bytes} byte budget, but all are pinned")
+                    break
+                evicted += self._remove(db, documents, "budget")
+                used = self.collection_bytes(db)
+            logger.info(f"Evicted {evicted} frames to keep the frames collection under {self.budget_bytes} bytes")
+
+        with self.lock:
+            self.expired += expired
+            self.evicted += evicted
+            self.sweeps += 1
+            self.storage_bytes = used
+        return {"expired": expired, "evicted": evicted, "storage_bytes": used}
+
+    def stats(self):
+        with self.lock:
+            return {
+                "pinned": self.pinned,
+                "expired": self.expired,
+                "evicted": self.evicted,
+                "sweeps": self.sweeps,
+                "storage_bytes": self.storage_bytes,
+                "budget_bytes": self.budget_bytes,
+            }
+
+
+if os.environ.get('FRAME_RETENTION', '1') == '1':
+    frame_retention = FrameRetention(
+        get_db,
+        ttl_days=FRAME_TTL_DAYS,
+        budget_bytes=int(FRAME_STORAGE_BUDGET_MB * 1024 * 1024),
+        sweep_interval=FRAME_RETENTION_SWEEP_INTERVAL,
+    )
+    if not APP_PRELOAD:
+        frame_retention.start()
+else:
+    frame_retention = None
+
+
+def prepare_frame_batch(batch):
+    """Make sure the retention indexes exist, then offload large payloads to GridFS."""
+    if frame_retention is not None:
+        frame_retention.ensure_indexes(get_db().frames)
+    return offload_large_frames(batch)
+
+
+frame_writer = FrameWriter(
+    lambda: get_db().frames,
+    queue_size=int(os.environ.get('FRAME_WRITER_QUEUE_SIZE', 2000)),
+    flush_size=int(os.environ.get('FRAME_WRITER_FLUSH_SIZE', 100)),
+    flush_interval=float(os.environ.get('FRAME_WRITER_FLUSH_INTERVAL', 0.5)),
+    policy=os.environ.get('FRAME_WRITER_POLICY', 'drop'),
+    block_timeout=float(os.environ.get('FRAME_WRITER_BLOCK_TIMEOUT', 5.0)),
+    writers=max(1, int(os.environ.get('FRAME_WRITER_THREADS', 1))),
+    prepare_fn=prepare_frame_batch,
+    failed_fn=forget_frame_hashes,
+)
+if not APP_PRELOAD:
+    frame_writer.start()
+atexit.register(frame_writer.shutdown)
+
+
+# Function to store frames for later training
+def store_frame(jpeg_bytes, prediction, retention=None):
+    """Queue an encoded JPEG frame for storage in the database for potential retraining
+
+    retention records why the retention policy kept the frame ("borderline" or "sample").
+    """
+    started = time.perf_counter()
+    try:
+        # The content hash is the frame ID, so identical frames share one document
+        frame_id = hashlib.sha256(jpeg_bytes).hexdigest()
+        expires_at = frame_retention.expires_at() if frame_retention is not None else None
+        
+        with recent_frame_hashes_lock:
+            if frame_id in recent_frame_hashes:
+                known_expiry = recent_frame_hashes[frame_id]
+                if known_expiry is None or known_expiry > datetime.utcnow():
+                    recent_frame_hashes.move_to_end(frame_id)
+                    return frame_id
+            recent_frame_hashes[frame_id] = expires_at
+            recent_frame_hashes.move_to_end(frame_id)
+            if len(recent_frame_hashes) > RECENT_FRAME_HASHES_SIZE:
+                recent_frame_hashes.popitem(last=False)
+        
+        document = {
+            "_id": frame_id,
+            "data": Binary(jpeg_bytes),
+            "encoding": "jpeg",
+            "size": len(jpeg_bytes),
+            "prediction": float(prediction),
+            "timestamp": datetime.now().isoformat(),
+            "model_version": current_model_version
+        }
+        if frame_retention is not None:
+            document["retention"] = retention
+            if expires_at is not None:
+                document["expires_at"] = expires_at
+        
+        # Hand the document to the background writer, the ID is usable right away
+        queued = frame_writer.put(document)
+        
+        if not queued:
+            with recent_frame_hashes_lock:
+                recent_frame_hashes.pop(frame_id, None)
+            return None
+        return frame_id
+    except Exception as e:
+        failures.inc(stage="store_frame")
+        logger.exception(f"Error storing frame: {e}")
+        return None
+    finally:
+        stage_latency.observe(time.perf_counter() - started, stage="store_frame")
+
+
+
+
+def preprocess_frame(frame):
+    """Preprocess a single frame for model inference."""
+    if not model_loaded.is_set():
+        wait_for_model()
+    return preprocessing.preprocess_frame(frame, dtype=model_input_dtype)
+
+
+def preprocess_frames(frames):
+    """Preprocess a list of frames into the calling thread's reusable N x 3 x 224 x 224 batch buffer.
+
+    The returned view is overwritten by the thread's next call, so it must be consumed first.
+    """
+    if not model_loaded.is_set():
+        wait_for_model()
+    with stage_latency.time(stage="preprocess"):
+        return preprocess_engine.preprocess_batch(frames)
+
+
+def is_batch_shape_error(error):
+    """Whether a batched run failed on the batch dimension, rather than on the frames or the hardware."""
+    if isinstance(error, OrtInvalidArgument):
+        return True
+    return isinstance(error, OrtFail) and "shape" in str(error).lower()
+
+
+def run_batch(input_tensor):
+    """Run a single model call over up to inference_batch_size preprocessed frames."""
+    global inference_batch_size
+
+    frame_total = len(input_tensor)
+
+    # Pad with blank frames when the exported model expects a fixed batch size
+    if fixed_batch_size and frame_total < fixed_batch_size:
+        padding = np.zeros((fixed_batch_size - frame_total,) + input_tensor.shape[1:], dtype=input_tensor.dtype)
+        model_input = np.concatenate([input_tensor, padding], axis=0)
+    else:
+        model_input = input_tensor
+
+    try:
+        with stage_latency.time(stage="inference"):
+            output = ort_session.run(None, {model_input_name: model_input})
+    except Exception as e:
+        failures.inc(stage="inference")
+        if len(model_input) == 1 or not is_batch_shape_error(e):
+            raise
+        # Some exports declare a dynamic batch but only run with one frame, fall back to single frames
+        logger.warning(f"Batched inference failed ({e}), falling back to one frame per run")
+        inference_batch_size = 1
+        return [prediction for i in range(frame_total) for prediction in run_batch(input_tensor[i:i + 1])]
+
+    # Mapping outputs back to one prediction per input frame
+    predictions = np.asarray(output[0]).reshape(len(model_input), -1)[:frame_total, 0]
+    return [float(prediction) for prediction in predictions]
+
+
+def run_model(input_tensor):
+    """Run the model over a preprocessed batch tensor in chunks of inference_batch_size."""
+    predictions = []
+    start = 0
+    while start < len(input_tensor):
+        chunk_size = inference_batch_size
+        predictions.extend(run_batch(input_tensor[start:start + chunk_size]))
+        start += chunk_size
+    return predictions
+
+
+def load_model():
+    """Create the ONNX Runtime session, derive the input settings from it and run a warm-up batch."""
+    global ort_session, model_input_name, model_batch_dim, model_input_dtype, preprocess_engine
+    global fixed_batch_size, inference_batch_size, model_load_error
+    try:
+        started = time.perf_counter()
+        ort_session, loaded_path = create_inference_session(onnx_model_path, session_profile)
+        startup_timings["model_load_seconds"] = round(time.perf_counter() - started, 3)
+        logger.info(f"Loaded {loaded_path} with session profile {session_profile}")
+
+        model_input = ort_session.get_inputs()[0]
+        model_input_name = model_input.name
+        model_batch_dim = model_input.shape[0]
+
+        # Models exported with a uint8 input do the 0-1 scaling inside the graph
+        model_input_dtype = np.uint8 if model_input.type == 'tensor(uint8)' else np.float32
+
+        # A model exported with a fixed batch dimension only accepts exactly that many frames per run
+        if isinstance(model_batch_dim, int) and model_batch_dim > 0:
+            fixed_batch_size = model_batch_dim
+            inference_batch_size = model_batch_dim
+        else:
+            fixed_batch_size = None
+            inference_batch_size = INFERENCE_BATCH_SIZE
+        logger.info(f"Model input {model_input_name} batch dimension: {model_batch_dim}, "
+                    f"dtype {np.dtype(model_input_dtype).name}, using inference batch size {inference_batch_size}")
+        # run_inference preprocesses inference_batch_size frames at a time, so that is all a thread's buffer holds
+        preprocess_engine = preprocessing.PreprocessEngine(dtype=model_input_dtype, max_batch=inference_batch_size)
+
+        # The first run allocates the session's buffers, so it is paid here instead of by the first request
+        if MODEL_WARMUP:
+            started = time.perf_counter()
+            size = preprocessing.INPUT_SIZE
+            run_batch(np.zeros((inference_batch_size, 3, size, size), dtype=model_input_dtype))
+            startup_timings["warmup_seconds"] = round(time.perf_counter() - started, 3)
+
+        startup_timings["ready_seconds"] = round(time.perf_counter() - boot_started, 3)
+        logger.info(f"Model ready {startup_timings['ready_seconds']:.2f}s after boot ({startup_timings})")
+    except Exception as e:
+        model_load_error = str(e)
+        failures.inc(stage="model_load")
+        logger.exception(f"Loading {onnx_model_path} failed")
+    finally:
+        model_loaded.set()
+
+
+def model_ready():
+    return model_loaded.is_set() and model_load_error is None
+
+
+def wait_for_model(timeout=None):
+    """Block until the model has loaded, raising RuntimeError if loading failed or timed out."""
+    if not model_loaded.wait(timeout):
+        raise RuntimeError("Model is still loading")
+    if model_load_error is not None:
+        raise RuntimeError(f"Model failed to load: {model_load_error}")
+
+
+def start_model_load():
+    if MODEL_LOAD_BACKGROUND:
+        threading.Thread(target=load_model, name="model-loader", daemon=True).start()
+    else:
+        load_model()
+
+
+if APP_PRELOAD:
+    cached_model_path(onnx_model_path, session_profile)
+else:
+    start_model_load()
+
+
+class InferenceScheduler:
+    """Gathers frames from concurrent requests and runs them through the shared session together.
+
+    A batch is flushed once it holds max_batch_size frames or the oldest waiting
+    request has been queued for max_wait seconds, whichever comes first. A request
+    that would overflow the batch waits for the next one, so the combined batch
+    buffer never holds more than max_batch_size frames.
+    """
+
+    # Upper bounds of the batch size and queue wait (ms) histogram buckets
+    BATCH_SIZE_BUCKETS = (1, 2, 4, 8, 16, 32, 64, 128, 256)
+    WAIT_MS_BUCKETS = (0.5, 1, 2, 5, 10, 25, 50, 100, 250)
+
+    def __init__(self, run_fn, max_batch_size, max_wait):
+        self.run_fn = run_fn
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait
+        self.requests = queue.Queue()
+        self.lock = threading.Lock()
+        self.thread = None
+        self.buffer = None
+
+        # Counters for batch size distribution and queue wait time
+        self.batches = 0
+        self.frames = 0
+        self.batch_size_counts = [0] * (len(self.BATCH_SIZE_BUCKETS) + 1)
+        self.wait_ms_counts = [0] * (len(self.WAIT_MS_BUCKETS) + 1)
+        self.wait_ms_total = 0.0
+        self.wait_ms_max = 0.0
+        self.waits = 0
+
+    def start(self):
+        self.thread = threading.Thread(target=self._loop, name="inference-scheduler", daemon=True)
+        self.thread.start()
+
+    def submit(self, input_tensor):
+        """Queue a preprocessed batch tensor, returning a future for its list of predictions."""
+        future = Future()
+        self.requests.put((input_tensor, future, time.perf_counter()))
+        return future
+
+    def _loop(self):
+        carry = None
+        while True:
+            first = carry if carry is not None else self.requests.get()
+            carry = None
+            pending = [first]
+            frame_total = len(first[0])
+            deadline = first[2] + self.max_wait
+
+            # Keep collecting requests until the batch is full or the oldest one hits its deadline
+            while frame_total < self.max_batch_size:
+                remaining = deadline - time.perf_counter()
+                if remaining <= 0:
+                    break
+                try:
+                    item = self.requests.get(timeout=remaining)
+                except queue.Empty:
+                    break
+                if frame_total + len(item[0]) > self.max_batch_size:
+                    carry = item
+                    break
+                pending.append(item)
+                frame_total += len(item[0])
+
+            self._flush(pending, frame_total)
+
+    def _flush(self, pending, frame_total):
+        flush_time = time.perf_counter()
+        self._record(frame_total, [(flush_time - enqueued) * 1000 for _, _, enqueued in pending])
+
+        try:
+            if len(pending) == 1:
+                input_tensor = pending[0][0]
+            else:
+                input_tensor = self._batch_buffer(pending, frame_total)
+            predictions = self.run_fn(input_tensor)
+        except Exception as e:
+            logger.exception(f"Scheduled inference failed for {frame_total} frames: {e}")
+            for _, future, _ in pending:
+                future.set_exception(e)
+            return
+
+        # Handing each request back its own slice of the predictions
+        start = 0
+        for tensor, future, _ in pending:
+            future.set_result(predictions[start:start + len(tensor)])
+            start += len(tensor)
+
+    def _batch_buffer(self, pending, frame_total):
+        """Copy the pending tensors into the scheduler's reusable batch buffer."""
+        first = pending[0][0]
+        if self.buffer is None or len(self.buffer) < frame_total or self.buffer.dtype != first.dtype:
+            self.buffer = np.empty((self.max_batch_size,) + first.shape[1:], dtype=first.dtype)
+        return np.concatenate([tensor for tensor, _, _ in pending], axis=0, out=self.buffer[:frame_total])
+
+    def _record(self, frame_total, waits_ms):
+        with self.lock:
+            self.batches += 1
+            self.frames += frame_total
+            self.batch_size_counts[_bucket_index(self.BATCH_SIZE_BUCKETS, frame_total)] += 1
+            for wait_ms in waits_ms:
+                stage_latency.observe(wait_ms / 1000.0, stage="inference_queue_wait")
+                self.wait_ms_counts[_bucket_index(self.WAIT_MS_BUCKETS, wait_ms)] += 1
+                self.wait_ms_total += wait_ms
+                self.wait_ms_max = max(self.wait_ms_max, wait_ms)
+                self.waits += 1
+
+    def stats(self):
+        """Return a snapshot of the scheduler counters."""
+        with self.lock:
+            return {
+                "batches": self.batches,
+                "frames": self.frames,
+                "avg_batch_size": self.frames / self.batches if self.batches else 0.0,
+                "batch_size_distribution": _bucket_labels(self.BATCH_SIZE_BUCKETS, self.batch_size_counts),
+                "queue_wait_ms": {
+                    "avg": self.wait_ms_total / self.waits if self.waits else 0.0,
+                    "max": self.wait_ms_max,
+                    "distribution": _bucket_labels(self.WAIT_MS_BUCKETS, self.wait_ms_counts),
+                },
+                "queue_depth": self.requests.qsize(),
+            }
+
+
+def _bucket_index(bounds, value):
+    """Return the index of the first histogram bucket whose upper bound holds value."""
+    for index, bound in enumerate(bounds):
+        if value <= bound:
+            return index
+    return len(bounds)
+
+
+def _bucket_labels(bounds, counts):
+    """Label histogram counts by their upper bounds, with a final overflow bucket."""
+    labels = {f"<={bound}": count for bound, count in zip(bounds, counts)}
+    labels[f">{bounds[-1]}"] = counts[-1]
+    return labels
+
+
+# Cross-request micro-batching, set INFERENCE_SCHEDULER=0 to run each request's frames directly
+if os.environ.get('INFERENCE_SCHEDULER', '1') == '1':
+    inference_scheduler = InferenceScheduler(
+        run_model,
+        max_batch_size=max(1, int(os.environ.get('SCHEDULER_MAX_BATCH_SIZE', INFERENCE_BATCH_SIZE))),
+        max_wait=float(os.environ.get('SCHEDULER_MAX_WAIT_MS', 5)) / 1000.0,
+    )
+    if not APP_PRELOAD:
+        inference_scheduler.start()
+else:
+    inference_scheduler = None
+
+
+def start_worker():
+    """Start the per-process parts of the app in a worker forked from a preloading master.
+
+    Each worker gets its own ONNX Runtime session (over the weights shared through the
+    model cache), background threads and, on first use, its own Mongo client.
+    """
+    global mongo_client, db
+    if mongo_client is not None:
+        mongo_client = None
+        db = None
+    frame_writer.start()
+    if frame_retention is not None:
+        frame_retention.start()
+    if inference_scheduler is not None:
+        inference_scheduler.start()
+    start_model_load()
+
+
+def run_inference(frames):
+    """Run the model over a list of frames in batches, returning one prediction per frame.
+
+    Frames are preprocessed and submitted inference_batch_size at a time, so the thread's
+    batch buffer stays that size however many frames a request brings.
+    """
+    if not frames:
+        return []
+    if not model_loaded.is_set():
+        wait_for_model()
+    predictions = []
+    start = 0
+    while start < len(frames):
+        chunk = frames[start:start + inference_batch_size]
+        input_tensor = preprocess_frames(chunk)
+        if inference_scheduler is not None:
+            predictions.extend(inference_scheduler.submit(input_tensor).result())
+        else:
+            predictions.extend(run_model(input_tensor))
+        start += len(chunk)
+    frames_processed.inc(len(predictions))
+    return predictions
+
+
+# Admission control, so overload turns into fast 429s (or fewer frames) instead of slow requests for everyone
+class AdmissionTicket:
+    """Frames admitted for one request, released when the request finishes."""
+
+    def __init__(self, source, frames, requested):
+        self.source = source
+        self.frames = frames
+        self.requested = requested
+        self.started = time.monotonic()
+
+    @property
+    def degraded(self):
+        return self.frames < self.requested
+
+
+class AdmissionController:
+    """Admits requests against a budget of in-flight frames, shared fairly between sources.
+
+    A source may use the whole budget while it is the only one with work in flight.
+    Once several sources are active each gets an equal share, but never less than
+    min_share frames. A request larger than the budget is admitted when nothing
+    else is in flight, so it cannot starve.
+
+    Requests that do not fit are rejected, or with degrade admitted with whatever
+    room is left (at least min_degraded_frames) so the caller can subsample. The
+    Retry-After hint is the time the current in-flight frames take to drain at the
+    recently measured throughput.
+    """
+
+    THROUGHPUT_WINDOW = 10.0  # seconds of completed requests used to measure throughput
+
+    def __init__(self, max_frames=1600, min_share=64, degrade=False, min_degraded_frames=16, max_retry_after=30):
+        self.max_frames = max_frames
+        self.min_share = min(min_share, max_frames)
+        self.degrade = degrade
+        self.min_degraded_frames = min_degraded_frames
+        self.max_retry_after = max_retry_after
+        self.lock = threading.Lock()
+        self.in_flight = 0
+        self.source_frames = {}
+        self.completions = deque()  # (finished_at, frames)
+        self.first_completion = None
+
+        self.admitted = 0
+        self.degraded = 0
+        self.rejected = 0
+
+    def _source_limit(self, source):
+        active = len(self.source_frames) + (source not in self.source_frames)
+        return max(self.max_frames // active, self.min_share)
+
+    def try_acquire(self, source, frames):
+        """Return a ticket for up to frames frames, or None if the request has to be rejected."""
+        frames = max(1, int(frames))
+        with self.lock:
+            held = self.source_frames.get(source, 0)
+            room = min(self.max_frames - self.in_flight, self._source_limit(source) - held)
+            # An idle server takes any request whole, however large, so it cannot starve
+            if self.in_flight == 0:
+                room = max(room, frames)
+            if frames <= room:
+                granted = frames
+            elif self.degrade and room >= min(self.min_degraded_frames, frames):
+                granted = room
+            else:
+                self.rejected += 1
+                return None
+
+            self.in_flight += granted
+            self.source_frames[source] = held + granted
+            if granted < frames:
+                self.degraded += 1
+            else:
+                self.admitted += 1
+            return AdmissionTicket(source, granted, frames)
+
+    def saturated(self):
+        """Check whether no frames at all can be admitted, counting the rejection if so."""
+        with self.lock:
+            if self.in_flight < self.max_frames:
+                return False
+            self.rejected += 1
+            return True
+
+    def release(self, ticket):
+        now = time.monotonic()
+        with self.lock:
+            self.in_flight -= ticket.frames
+            remaining = self.source_frames.get(ticket.source, 0) - ticket.frames
+            if remaining > 0:
+                self.source_frames[ticket.source] = remaining
+            else:
+                self.source_frames.pop(ticket.source, None)
+            self.completions.append((now, ticket.frames))
+            if self.first_completion is None:
+                self.first_completion = now
+            self._trim_completions(now)
+
+    def _trim_completions(self, now):
+        while self.completions and self.completions[0][0] < now - self.THROUGHPUT_WINDOW:
+            self.completions.popleft()
+
+    def retry_after(self):
+        """Seconds a rejected client should wait, from the in-flight frames and the recent throughput."""
+        now = time.monotonic()
+        with self.lock:
+            self._trim_completions(now)
+            if self.first_completion is None:
+                return 1
+            # Right after startup the window is only as long as the server has been completing requests
+            window = min(self.THROUGHPUT_WINDOW, max(1.0, now - self.first_completion))
+            throughput = sum(frames for _, frames in self.completions) / window
+            in_flight = self.in_flight
+        if throughput <= 0:
+            return 1
+        return int(min(self.max_retry_after, max(1, math.ceil(in_flight / throughput))))
+
+    def stats(self):
+        """Return the in-flight frames per source and the admission counters."""
+        with self.lock:
+            return {
+                "max_frames": self.max_frames,
+                "in_flight_frames": self.in_flight,
+                "sources": dict(self.source_frames),
+                "admitted": self.admitted,
+                "degraded": self.degraded,
+                "rejected": self.rejected,
+            }
+
+
+# Set ADMISSION_CONTROL=0 to accept every request
+if os.environ.get('ADMISSION_CONTROL', '1') == '1':
+    admission_controller = AdmissionController(
+        max_frames=max(1, int(os.environ.get('ADMISSION_MAX_FRAMES', 1600))),
+        min_share=max(1, int(os.environ.get('ADMISSION_MIN_SHARE', 64))),
+        degrade=os.environ.get('ADMISSION_DEGRADE', '0') == '1',
+        min_degraded_frames=max(1, int(os.environ.get('ADMISSION_MIN_DEGRADED_FRAMES', 16))),
+        max_retry_after=int(os.environ.get('ADMISSION_MAX_RETRY_AFTER', 30)),
+    )
+else:
+    admission_controller = None
+# Frames assumed for a video whose frame count the container does not give
+ADMISSION_UNKNOWN_FRAMES = int(os.environ.get('ADMISSION_UNKNOWN_FRAMES', 200))
+
+admission_decisions = metrics.Counter(
+    "deepfake_admission_total", "Admission decisions by outcome", ["outcome"], registry=metrics_registry)
+admission_in_flight = metrics.Gauge(
+    "deepfake_admission_in_flight_frames", "Frames admitted and not yet finished", registry=metrics_registry)
+admission_in_flight.set_function(lambda: admission_controller.in_flight if admission_controller is not None else 0)
+
+
+def saturated_response():
+    retry_after = admission_controller.retry_after()
+    response = jsonify({"error": "Server is busy, try again later", "retry_after": retry_after})
+    response.headers['Retry-After'] = str(retry_after)
+    return response, 429
+
+
+def admission_saturated():
+    """Return True, counting a rejection, when no frames at all can be admitted."""
+    if admission_controller is None or not admission_controller.saturated():
+        return False
+    admission_decisions.inc(outcome="rejected")
+    return True
+
+
+def reject_if_saturated():
+    """Return a 429 response when no frames at all can be admitted, before any of the request is read."""
+    return saturated_response() if admission_saturated() else None
+
+
+def acquire_admission(source, frames):
+    """Try to admit a request's frames, returning (admitted, ticket). The ticket is None without admission control."""
+    if admission_controller is None:
+        return True, None
+    ticket = admission_controller.try_acquire(source, frames)
+    if ticket is None:
+        admission_decisions.inc(outcome="rejected")
+        logger.warning(f"Rejected {frames} frames from {source}, server saturated")
+        return False, None
+    admission_decisions.inc(outcome="degraded" if ticket.degraded else "admitted")
+    if ticket.degraded:
+        logger.info(f"Degraded request from {source}: {ticket.frames} of {ticket.requested} frames admitted")
+    return True, ticket
+
+
+def admit(source, frames):
+    """Admit a request's frames, returning (ticket, rejection response). Both are None without admission control."""
+    admitted, ticket = acquire_admission(source, frames)
+    return ticket, (None if admitted else saturated_response())
+
+
+def release_admission(ticket):
+    if ticket is not None:
+        admission_controller.release(ticket)
+
+
+def subsample_indices(total, limit):
+    """Pick limit indices spread evenly over range(total)."""
+    if limit is None or limit >= total:
+        return None
+    return set(np.linspace(0, total - 1, num=limit).round().astype(int).tolist())
+
+
+# Content-addressed verdict cache, so the same video is not analyzed again for every user
+class VerdictCache:
+    """Caches analysis results by content digest for the current model version.
+
+    The first tier is an in-process LRU bounded by entry count, approximate size
+    in bytes and TTL. The optional second tier is a Mongo collection shared by
+    all instances, with a TTL index on created_at. Entries are keyed on the model
+    file's name, size and mtime (verdict_model_version), so entries from another
+    model are never returned, while instances and restarts serving the same model
+    file share them.
+    """
+
+    # Results bigger than this are kept out of the shared tier, BSON documents are capped at 16MB
+    SHARED_MAX_BYTES = 8 * 1024 * 1024
+
+    def __init__(self, max_entries=256, max_bytes=256 * 1024 * 1024, ttl=3600.0, collection_fn=None):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.collection_fn = collection_fn
+        self.entries = OrderedDict()  # key -> (model_version, expires_at, size, result)
+        self.total_bytes = 0
+        self.lock = threading.Lock()
+        self.shared_writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix="verdict-cache") if collection_fn else None
+        self.shared_index_ready = False
+
+        self.memory_hits = 0
+        self.shared_hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def make_key(kind, digest, options=None):
+        """Build a cache key from the payload digest and the options that change the result."""
+        return f"{kind}:{digest}:{json.dumps(options or {}, sort_keys=True)}"
+
+    def get(self, key):
+        """Return the cached result for key under the current model version, or None."""
+        model_version = verdict_model_version
+        now = time.monotonic()
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None:
+                if entry[0] == model_version and entry[1] > now:
+                    self.entries.move_to_end(key)
+                    self.memory_hits += 1
+                    return entry[3]
+                self._evict(key)
+
+        result = self._get_shared(key, model_version)
+        with self.lock:
+            if result is None:
+                self.misses += 1
+            else:
+                self.shared_hits += 1
+        if result is not None:
+            self._put_memory(key, model_version, result, len(json.dumps(result)))
+        return result
+
+    def put(self, key, result):
+        """Cache a successful analysis result."""
+        model_version = verdict_model_version
+        size = len(json.dumps(result))
+        self._put_memory(key, model_version, result, size)
+        if self.shared_writer is not None and size <= self.SHARED_MAX_BYTES:
+            self.shared_writer.submit(self._put_shared, key, model_version, result)
+
+    def _put_memory(self, key, model_version, result, size):
+        if size > self.max_bytes:
+            return
+        with self.lock:
+            if key in self.entries:
+                self._evict(key)
+            self.entries[key] = (model_version, time.monotonic() + self.ttl, size, result)
+            self.total_bytes += size
+            while len(self.entries) > self.max_entries or self.total_bytes > self.max_bytes:
+                self._evict(next(iter(self.entries)))
+
+    def _evict(self, key):
+        entry = self.entries.pop(key)
+        self.total_bytes -= entry[2]
+
+    def _get_shared(self, key, model_version):
+        if self.collection_fn is None:
+            return None
+        try:
+            document = self.collection_fn().find_one({"_id": f"{model_version}:{key}"})
+        except Exception as e:
+            logger.warning(f"Verdict cache lookup failed: {e}")
+            return None
+        return document["result"] if document else None
+
+    def _put_shared(self, key, model_version, result):
+        try:
+            collection = self.collection_fn()
+            if not self.shared_index_ready:
+                collection.create_index("created_at", expireAfterSeconds=int(self.ttl))
+                self.shared_index_ready = True
+            collection.replace_one(
+                {"_id": f"{model_version}:{key}"},
+                {"model_version": model_version, "result": result, "created_at": datetime.utcnow()},
+                upsert=True,
+            )
+        except Exception as e:
+            logger.warning(f"Verdict cache write failed: {e}")
+
+    def stats(self):
+        """Return hit counters and the overall hit rate."""
+        with self.lock:
+            lookups = self.memory_hits + self.shared_hits + self.misses
+            return {
+                "entries": len(self.entries),
+                "bytes": self.total_bytes,
+                "memory_hits": self.memory_hits,
+                "shared_hits": self.shared_hits,
+                "misses": self.misses,
+                "hit_rate": (self.memory_hits + self.shared_hits) / lookups if lookups else 0.0,
+            }
+
+
+if os.environ.get('VERDICT_CACHE', '1') == '1':
+    verdict_cache = VerdictCache(
+        max_entries=int(os.environ.get('VERDICT_CACHE_MAX_ENTRIES', 256)),
+        max_bytes=int(os.environ.get('VERDICT_CACHE_MAX_BYTES', 256 * 1024 * 1024)),
+        ttl=float(os.environ.get('VERDICT_CACHE_TTL', 3600)),
+        collection_fn=(lambda: get_db().verdict_cache) if os.environ.get('VERDICT_CACHE_MONGO', '0') == '1' else None,
+    )
+else:
+    verdict_cache = None
+
+
+def frames_digest(frame_hashes):
+    """Order-insensitive digest of a batch of frames from their individual SHA-256 digests."""
+    return hashlib.sha256(b"".join(sorted(frame_hashes))).hexdigest()
+
+
+# Frames scoring below this are counted as deepfake frames
+FRAME_THRESHOLD = 0.8
+
+# Early-exit settings, inference stops once the verdict is settled. The statistical stop, at
+# error tolerance EARLY_EXIT_ALPHA, needs the frames seen so far to be a random sample, so it
+# only applies to /frames batches (walked in random order). Video frames arrive in time order,
+# so a video stops early only on the exact rule, when the frame count in its header is known
+EARLY_EXIT_DEFAULT = os.environ.get('EARLY_EXIT', '0') == '1'
+EARLY_EXIT_ALPHA = float(os.environ.get('EARLY_EXIT_ALPHA', 0.01))
+EARLY_EXIT_MIN_FRAMES = int(os.environ.get('EARLY_EXIT_MIN_FRAMES', 30))
+
+
+def deepfake_ratio_bounds(deepfake_frames, frames_used, total_frames=None, sampled=False):
+    """Return (low, high) bounds on the deepfake ratio over every frame, from the frames used so far.
+
+    When the total number of frames is known the bounds are exact: the remaining
+    frames are all authentic or all deepfakes. With sampled, meaning the frames used
+    so far are a uniform random sample, a Hoeffding bound on the running ratio narrows
+    them after EARLY_EXIT_MIN_FRAMES frames. The bound spends EARLY_EXIT_ALPHA across
+    every possible look (alpha / (n (n + 1)) at n frames), so checking after each
+    batch keeps the overall error tolerance.
+    """
+    low, high = 0.0, 1.0
+    if total_frames:
+        low = deepfake_frames / total_frames
+        high = (deepfake_frames + total_frames - frames_used) / total_frames
+    if sampled and frames_used >= EARLY_EXIT_MIN_FRAMES:
+        deepfake_ratio = deepfake_frames / frames_used
+        alpha = EARLY_EXIT_ALPHA / (frames_used * (frames_used + 1))
+        margin = math.sqrt(math.log(2 / alpha) / (2 * frames_used))
+        low, high = max(low, deepfake_ratio - margin), min(high, deepfake_ratio + margin)
+    return low, high
+
+
+def verdict_settled(deepfake_frames, frames_used, total_frames=None, sampled=False):
+    """Return True once analyzing more frames cannot flip the deepfake verdict (see deepfake_ratio_bounds)."""
+    if frames_used == 0:
+        return False
+    low, high = deepfake_ratio_bounds(deepfake_frames, frames_used, total_frames, sampled)
+    return low > 0.5 or high <= 0.5
+
+
+def early_exit_confidence(confidence, deepfake_frames, frames_used, total_frames=None, sampled=False):
+    """Confidence fields of a verdict reached before every frame was analyzed.
+
+    confidence becomes the low end of the interval the full confidence lies in, from
+    the ratio bounds the early exit stopped on, and sample_confidence keeps the
+    estimate from the frames used.
+    """
+    low, high = deepfake_ratio_bounds(deepfake_frames, frames_used, total_frames, sampled)
+    if low > 0.5:
+        interval = (2 * (low - 0.5), 2 * (high - 0.5))
+    elif high <= 0.5:
+        interval = (2 * (0.5 - high), 2 * (0.5 - low))
+    else:
+        interval = (0.0, 2 * max(0.5 - low, high - 0.5))
+    interval = [float(min(1.0, max(0.0, bound))) for bound in interval]
+    return {"confidence": interval[0], "confidence_interval": interval, "sample_confidence": float(confidence)}
+
+
+# Near-duplicate frame detection within a /frames batch
+FRAME_DEDUP_DEFAULT = os.environ.get('FRAME_DEDUP', '1') == '1'
+FRAME_DEDUP_DISTANCE = int(os.environ.get('FRAME_DEDUP_DISTANCE', 4))
+# Side of the difference hash grid, 16 gives 256 bits (an 8x8 hash cannot tell talking-head frames apart)
+FRAME_DEDUP_HASH_SIZE = int(os.environ.get('FRAME_DEDUP_HASH_SIZE', 16))
+
+
+def dhash(frame, hash_size=FRAME_DEDUP_HASH_SIZE):
+    """Difference hash of a frame packed into uint8 bytes, near-identical frames differ in only a few bits.
+
+    Any hash_size works, the last byte is zero-padded when hash_size squared is not a multiple of 8.
+    """
+    small = cv2.resize(frame, (hash_size + 1, hash_size), interpolation=cv2.INTER_AREA)
+    small = cv2.cvtColor(small, cv2.COLOR_BGR2GRAY)
+    bits = (small[:, 1:] > small[:, :-1]).flatten()
+    return np.packbits(bits)
+
+
+def cluster_frames(hashes, max_distance):
+    """Greedily group frames whose hashes are within max_distance bits of a cluster representative.
+
+    Returns the frame index of each representative and the cluster index of every frame.
+    """
+    representative_hashes = np.empty((len(hashes), len(hashes[0])), dtype=np.uint8)
+    representatives = []
+    cluster_of = []
+    for i, frame_hash in enumerate(hashes):
+        if representatives:
+            distances = np.bitwise_count(representative_hashes[:len(representatives)] ^ frame_hash).sum(axis=1)
+            nearest = int(np.argmin(distances))
+            if distances[nearest] <= max_distance:
+                cluster_of.append(nearest)
+                continue
+        representative_hashes[len(representatives)] = frame_hash
+        cluster_of.append(len(representatives))
+        representatives.append(i)
+    return representatives, cluster_of
+
+
+# Columns of a prediction statistics row: frame count, frames below the threshold,
+# mean, M2 (sum of squared deviations from the mean), min and max
+STAT_COUNT, STAT_BELOW, STAT_MEAN, STAT_M2, STAT_MIN, STAT_MAX = range(6)
+
+
+def prediction_statistics(prediction_values, threshold=FRAME_THRESHOLD):
+    """Compute the statistics row of a batch of predictions in a few vectorized passes."""
+    predictions = np.asarray(prediction_values, dtype=np.float64)
+    mean = predictions.mean()
+    return np.array([predictions.size, np.count_nonzero(predictions < threshold), mean,
+                     np.square(predictions - mean).sum(), predictions.min(), predictions.max()])
+
+
+def merge_statistics(rows):
+    """Combine statistics rows into one, with the parallel (batch) form of Welford's update."""
+    rows = np.asarray(rows, dtype=np.float64).reshape(-1, 6)
+    counts = rows[:, STAT_COUNT]
+    total = counts.sum()
+    mean = (counts * rows[:, STAT_MEAN]).sum() / total
+    m2 = rows[:, STAT_M2].sum() + (counts * np.square(rows[:, STAT_MEAN] - mean)).sum()
+    return np.array([total, rows[:, STAT_BELOW].sum(), mean, m2, rows[:, STAT_MIN].min(), rows[:, STAT_MAX].max()])
+
+
+def summarize_statistics(stats):
+    """Turn a statistics row into the verdict and summary statistics.
+
+    Frames below the threshold count as deepfakes. The video is a deepfake when
+    more than half of its frames are, and the confidence is the distance of the
+    deepfake ratio from 0.5, scaled to 0-1.
+    """
+    total_frames = int(stats[STAT_COUNT])
+    deepfake_frames = int(stats[STAT_BELOW])
+    deepfake_ratio = deepfake_frames / total_frames
+    return {
+        "avg_prediction": float(stats[STAT_MEAN]),
+        "min_prediction": float(stats[STAT_MIN]),
+        "max_prediction": float(stats[STAT_MAX]),
+        "variance": float(stats[STAT_M2] / total_frames),
+        "deepfake_frames": deepfake_frames,
+        "total_frames": total_frames,
+        "deepfake_ratio": deepfake_ratio,
+        "is_deepfake": deepfake_ratio > 0.5,
+        "confidence": min(1.0, abs(deepfake_ratio - 0.5) * 2),
+    }
+
+
+def aggregate_predictions(prediction_values, threshold=FRAME_THRESHOLD):
+    """Aggregate per-frame predictions into the verdict and summary statistics."""
+    started = time.perf_counter()
+    summary = summarize_statistics(prediction_statistics(prediction_values, threshold))
+    stage_latency.observe(time.perf_counter() - started, stage="aggregate")
+    return summary
+
+
+# Number of decoded frames allowed to wait for inference, keeps memory flat for long videos
+VIDEO_DECODE_QUEUE_SIZE = max(1, int(os.environ.get('VIDEO_DECODE_QUEUE_SIZE', 2 * INFERENCE_BATCH_SIZE)))
+
+
+def spool_upload(stream, filename, chunk_size=1024 * 1024):
+    """Copy an uploaded file stream in chunks to a per-request temporary file.
+
+    Returns the temp file path and the SHA-256 of the uploaded bytes.
+    """
+    suffix = os.path.splitext(filename or "")[1] or ".mp4"
+    digest = hashlib.sha256()
+    with tempfile.NamedTemporaryFile(prefix="upload_", suffix=suffix, delete=False) as temp_file:
+        for chunk in iter(lambda: stream.read(chunk_size), b""):
+            digest.update(chunk)
+            temp_file.write(chunk)
+        return temp_file.name, digest.hexdigest()
+
+
+def put_until_stopped(frame_queue, item, stop_event):
+    """Put an item on a bounded queue, giving up if the consumer has stopped."""
+    while not stop_event.is_set():
+        try:
+            frame_queue.put(item, timeout=0.1)
+            return True
+        except queue.Full:
+            continue
+    return False
+
+
+class FrameSampler:
+    """Chooses which frames of a video are retrieved and analyzed.
+
+    Modes:
+      all      - every frame (the default)
+      stride   - every stride-th frame
+      uniform  - frame_budget frames spread evenly across the video
+      keyframe - only the container's keyframes
+
+    Skipped frames are only grabbed, never retrieved, so they skip the colour
+    conversion and copy. frame_budget caps the number of frames analyzed in
+    every mode, and in stride mode the stride is widened so the budget spans
+    the whole video.
+    """
+
+    MODES = ("all", "stride", "uniform", "keyframe")
+    DEFAULT_UNIFORM_FRAMES = 32
+
+    def __init__(self, mode="all", stride=1, frame_budget=None):
+        if mode not in self.MODES:
+            raise ValueError(f"Unknown sampling mode '{mode}', expected one of {', '.join(self.MODES)}")
+        if stride < 1:
+            raise ValueError("stride must be at least 1")
+        if frame_budget is not None and frame_budget < 1:
+            raise ValueError("frame_budget must be at least 1")
+        self.mode = mode
+        self.applied_mode = mode
+        self.stride = stride
+        self.frame_budget = frame_budget
+        self.total_frames = 0
+        self.frames_decoded = 0
+        self.frames_sampled = 0
+
+    @classmethod
+    def from_form(cls, form):
+        """Build a sampler from the request's form fields."""
+        frame_budget = form.get('frame_budget')
+        return cls(
+            mode=form.get('sampling', 'all'),
+            stride=int(form.get('stride', 1)),
+            frame_budget=int(frame_budget) if frame_budget else None,
+        )
+
+    def frames(self, cap):
+        """Yield the sampled frames from an open capture."""
+        self.total_frames = max(0, int(cap.get(cv2.CAP_PROP_FRAME_COUNT) or 0))
+        fps = cap.get(cv2.CAP_PROP_FPS) or 0
+        keep, last_index = self._selector(fps)
+
+        index = 0
+        while self.frame_budget is None or self.frames_sampled < self.frame_budget:
+            if last_index is not None and index > last_index:
+                break
+            if not cap.grab():
+                break
+            self.frames_decoded += 1
+            if keep(index, cap):
+                ret, frame = cap.retrieve()
+                if ret:
+                    self.frames_sampled += 1
+                    yield frame
+            index += 1
+
+    def _selector(self, fps):
+        """Return the keep(index, cap) predicate and the last frame index worth grabbing."""
+        if self.mode == "stride":
+            if self.frame_budget and self.total_frames:
+                self.stride = max(self.stride, -(-self.total_frames // self.frame_budget))
+            return (lambda index, cap: index % self.stride == 0), None
 
-# Loading the ONNX model
-onnx_model_path = "FinalModel.onnx"
-ort_session = ort.InferenceSession(onnx_model_path)
+        if self.mode == "uniform":
+            budget = self.frame_budget or self.DEFAULT_UNIFORM_FRAMES
+            if not self.total_frames:
+                # Without a frame count the spread is unknown, analyze the first frames instead
+                self.applied_mode = "all"
+                self.frame_budget = budget
+                return (lambda index, cap: True), None
+            targets = set(np.linspace(0, self.total_frames - 1, num=min(budget, self.total_frames)).round().astype(int).tolist())
+            return (lambda index, cap: index in targets), max(targets)
 
-app = Flask(__name__)
+        if self.mode == "keyframe":
+            fallback_stride = max(1, int(round(fps))) if fps else 30
 
-# Adding CORS headers for API access from browser extension
-@app.after_request
-def after_request(response):
-    response.headers.add('Access-Control-Allow-Origin', '*')
-    response.headers.add('Access-Control-Allow-Headers', 'Content-Type,X-Request-ID,Cache-Control,Pragma')
-    response.headers.add('Access-Control-Allow-Methods', 'GET,POST,OPTIONS')
-    return response
+            def keep(index, cap):
+                # The first frame is always a keyframe, if it is not flagged the backend cannot report them
+                if index == 0 and cap.get(cv2.CAP_PROP_LRF_HAS_KEY_FRAME) <= 0:
+                    self.applied_mode = "stride"
+                    self.stride = fallback_stride
+                if self.applied_mode == "stride":
+                    return index % self.stride == 0
+                return cap.get(cv2.CAP_PROP_LRF_HAS_KEY_FRAME) > 0
+            return keep, None
 
+        return (lambda index, cap: True), None
 
+    def limit(self, frame_budget):
+        """Cap the frames analyzed, spreading them across the video when every frame was asked for."""
+        if self.mode == "all":
+            self.mode = self.applied_mode = "uniform"
+        self.frame_budget = min(self.frame_budget or frame_budget, frame_budget)
 
+    def expected_frames(self, total_frames=None):
+        """Estimate how many frames will be analyzed, or None if it cannot be known up front.
 
-# Function to store frames for later training
-def store_frame(frame, prediction):
-    """Store a frame in the database for potential retraining"""
-    try:
-        # Compress image to JPEG
-        success, img_encoded = cv2.imencode('.jpg', frame, [cv2.IMWRITE_JPEG_QUALITY, 80])
-        if not success:
-            logger.warning("Failed to encode frame")
+        total_frames defaults to the frame count read when sampling started.
+        """
+        total_frames = total_frames or self.total_frames
+        if not total_frames:
             return None
-        
-        # Convert to base64 for storage
-        img_bytes = img_encoded.tobytes()
-        img_base64 = base64.b64encode(img_bytes).decode('utf-8')
-        
-        # Generate a unique ID
-        frame_id = str(uuid.uuid4())
-        
-        # Store in database
-        db.frames.insert_one({
-            "_id": frame_id,
-            "data": img_base64,
-            "prediction": float(prediction),
-            "timestamp": datetime.now().isoformat(),
-            "model_version": current_model_version
-        })
-        
-        return frame_id
-    except Exception as e:
-        logger.exception(f"Error storing frame: {e}")
-        return None
+        if self.applied_mode == "stride":
+            expected = -(-total_frames // self.stride)
+        elif self.applied_mode == "uniform":
+            expected = min(self.frame_budget or self.DEFAULT_UNIFORM_FRAMES, total_frames)
+        elif self.applied_mode == "keyframe":
+            return None
+        else:
+            expected = total_frames
+        return min(expected, self.frame_budget) if self.frame_budget else expected
 
+    def summary(self):
+        """Describe the sampling that was applied, for the response."""
+        return {
+            "mode": self.mode,
+            "applied_mode": self.applied_mode,
+            "stride": self.stride,
+            "frame_budget": self.frame_budget,
+            "total_frames": self.total_frames,
+            "frames_decoded": self.frames_decoded,
+            "frames_sampled": self.frames_sampled,
+        }
 
 
+def estimate_video_frames(video_path, sampler):
+    """Estimate how many frames the sampler will take from a video, from its container frame count."""
+    cap = cv2.VideoCapture(video_path)
+    try:
+        total_frames = max(0, int(cap.get(cv2.CAP_PROP_FRAME_COUNT) or 0))
+        fps = cap.get(cv2.CAP_PROP_FPS) or 0
+    finally:
+        cap.release()
+    expected = sampler.expected_frames(total_frames)
+    if expected is None and sampler.mode == "keyframe" and total_frames:
+        # Assume about one keyframe per second, the fallback stride
+        expected = -(-total_frames // max(1, int(round(fps)) if fps else 30))
+    return expected or ADMISSION_UNKNOWN_FRAMES
 
-def preprocess_frame(frame):
-    """Preprocess a single frame for model inference."""
-    frame = cv2.resize(frame, (224, 224))  # Resize to match model input
-    frame = frame.transpose(2, 0, 1)  # Convert to (3,224,224)
-    frame = frame.astype(np.float32) / 255.0  # Normalize
-    return np.expand_dims(frame, axis=0)
+
+def decode_video_frames(cap, frame_queue, stop_event, sampler):
+    """Decode the sampled frames from an open capture into a bounded queue, ending with None."""
+    try:
+        frames = sampler.frames(cap)
+        while True:
+            # Time per sampled frame, including the grabs of any skipped frames before it
+            started = time.perf_counter()
+            frame = next(frames, None)
+            if frame is None:
+                break
+            stage_latency.observe(time.perf_counter() - started, stage="video_decode")
+            if not put_until_stopped(frame_queue, frame, stop_event):
+                return
+    except Exception as e:
+        failures.inc(stage="video_decode")
+        # Hand decoder failures to the consumer so the request reports them
+        put_until_stopped(frame_queue, e, stop_event)
+    put_until_stopped(frame_queue, None, stop_event)
 
 
-def detect_deepfake(video_bytes, filename="unknown"):
-    """Process a video and detect deepfake frames."""
+def detect_deepfake(video_path, filename="unknown", sampler=None, early_exit=False, progress=None,
+                    frames_response="full"):
+    """Process a video file and detect deepfake frames, optionally stopping once the verdict is settled.
+
+    progress, if given, is called with (frames_done, frames_total) after every batch,
+    with frames_total None when the sampler cannot tell in advance. frames_response
+    is one of FRAMES_RESPONSE_MODES and shapes the frames_data of the result.
+    """
     logger.info(f"Processing video: {filename}")
-    
-    # Save video to a temporary file
-    temp_path = "temp_video.mp4"
-    with open(temp_path, "wb") as f:
-        f.write(video_bytes)
+    sampler = sampler or FrameSampler()
     
     # Open the video file
-    cap = cv2.VideoCapture(temp_path)
+    cap = cv2.VideoCapture(video_path)
     if not cap.isOpened():
-        # Clean up and return error
-        os.remove(temp_path)
         logger.error(f"Cannot read video file: {filename}")
         return {"error": "Cannot read video file"}
     
+    # Decoding runs in its own thread so it overlaps with inference
+    frame_queue = queue.Queue(maxsize=VIDEO_DECODE_QUEUE_SIZE)
+    stop_event = threading.Event()
+    decoder = threading.Thread(target=decode_video_frames, args=(cap, frame_queue, stop_event, sampler),
+                               name="video-decoder", daemon=True)
+    
     # For debugging, track all prediction values
     prediction_values = []
-    frames_data = []  # To collect frame data
+    kept_frames = []  # Index, encoded JPEG bytes, prediction and thumbnail of each kept frame
+    selector = frame_retention.selector() if frame_retention is not None else None
+    keep_frames = frames_response in ("full", "thumbnails") or selector is None
+    encode_kept = frames_response == "full" or selector is None  # Full-size JPEGs are returned or stored
     
     try:
-        # First pass - collect all predictions
+        decoder.start()
+
+        # First pass - collect all predictions, running the model on batches of frames
         frame_count = 0
+        pending_frames = []
+        deepfake_count = 0
+        stopped_early = False
+
+        def flush_pending():
+            nonlocal deepfake_count
+            predictions = run_inference(pending_frames)
+            for offset, prediction in enumerate(predictions):
+                index = frame_count - len(pending_frames) + offset
+                prediction_values.append(prediction)
+                if prediction < FRAME_THRESHOLD:
+                    deepfake_count += 1
+
+                # Only keep some frames (e.g., every 10th frame or up to 20 total) for the response, or
+                # for storage without a retention policy. In "ref" and "none" mode the retention policy
+                # alone decides, and only the frames it selects are ever encoded
+                if keep_frames and (index % 10 == 0 or len(kept_frames) < 20):
+                    # Encode to JPEG once, the same bytes are returned and stored
+                    img_bytes = encode_frame(pending_frames[offset]) if encode_kept else None
+                    thumbnail = encode_thumbnail(pending_frames[offset]) if frames_response == "thumbnails" else None
+                    if img_bytes is not None or thumbnail is not None:
+                        kept_frames.append((index, img_bytes, prediction, thumbnail))
+                # The retention policy picks the stored frames from all of them
+                if selector is not None:
+                    selector.offer((index, pending_frames[offset]), prediction)
+            pending_frames.clear()
+            if progress is not None:
+                progress(len(prediction_values), sampler.expected_frames())
+
         while True:
-            ret, frame = cap.read()
-            if not ret:
+            frame = frame_queue.get()
+            if frame is None:
                 break
-                
-            input_tensor = preprocess_frame(frame)
-            output = ort_session.run(None, {'input.1': input_tensor})
-            prediction = float(output[0][0])
-            prediction_values.append(prediction)
-            
-            # Only keep some frames (e.g., every 10th frame or up to 20 total)
-            if frame_count % 10 == 0 or len(frames_data) < 20:
-                # Convert to JPEG and base64 for storage
-                success, img_encoded = cv2.imencode('.jpg', frame, [cv2.IMWRITE_JPEG_QUALITY, 80])
-                if success:
-                    img_bytes = img_encoded.tobytes()
-                    img_base64 = base64.b64encode(img_bytes).decode('utf-8')
-                    frames_data.append({
-                        "data": img_base64,
-                        "prediction": float(prediction)
-                    })
-            
+            if isinstance(frame, Exception):
+                raise frame
+
+            pending_frames.append(frame)
             frame_count += 1
+            if len(pending_frames) >= INFERENCE_BATCH_SIZE:
+                flush_pending()
+                if early_exit and verdict_settled(deepfake_count, len(prediction_values), sampler.expected_frames()):
+                    stopped_early = True
+                    break
+
+        if pending_frames:
+            flush_pending()
         
         # If no frames were processed, return error
         if not prediction_values:
             return {"error": "No frames could be analyzed in the video"}
         
-        # Calculate statistics on all predictions
-        avg_prediction = np.mean(prediction_values)
-        min_prediction = np.min(prediction_values)
-        max_prediction = np.max(prediction_values)
-        
-        # Set a fixed threshold based on observed patterns
-        threshold = 0.8
-        
-        # Count frames with predictions below threshold as deepfakes
-        deepfake_frames = sum(1 for p in prediction_values if p < threshold)
-        total_frames = len(prediction_values)
-        
-        # Calculate the deepfake ratio
-        deepfake_ratio = deepfake_frames / total_frames
-        
-        # Video is considered a deepfake if more than 50% of frames are classified as deepfakes
-        is_deepfake = deepfake_ratio > 0.5
-        
-        # For confidence: distance from decision boundary (0.5) normalized to 0-1
-        confidence = abs(deepfake_ratio - 0.5) * 2
-        confidence = min(1.0, confidence)  # Cap at 1.0
+        # Calculate statistics and the verdict on all predictions
+        summary = aggregate_predictions(prediction_values)
+        avg_prediction = summary["avg_prediction"]
+        min_prediction = summary["min_prediction"]
+        max_prediction = summary["max_prediction"]
+        threshold = FRAME_THRESHOLD
+        deepfake_frames = summary["deepfake_frames"]
+        total_frames = summary["total_frames"]
+        deepfake_ratio = summary["deepfake_ratio"]
+        is_deepfake = summary["is_deepfake"]
+        confidence = summary["confidence"]
 
-        # After all your processing, before returning result, add this:
+        # Store the frames the retention policy selected (without one, the kept frames), reusing JPEG bytes
+        if selector is not None:
+            kept_bytes = {index: img_bytes for index, img_bytes, _, _ in kept_frames}
+            to_store = [(index, kept_bytes.get(index) or encode_frame(frame), prediction, reason)
+                        for (index, frame), prediction, reason in selector.selected()]
+        else:
+            to_store = [(index, img_bytes, prediction, None) for index, img_bytes, prediction, _ in kept_frames]
         stored_frame_ids = []
-        for frame_data in frames_data:
-            try:
-            # Decode the frame
-                img_bytes = base64.b64decode(frame_data["data"])
-                frame = cv2.imdecode(np.frombuffer(img_bytes, np.uint8), cv2.IMREAD_COLOR)
-            
-            # Store the frame and get its ID
-                frame_id = store_frame(frame, frame_data["prediction"])
-                if frame_id:
-                    stored_frame_ids.append(frame_id)
-            except Exception as e:
-                logger.error(f"Error storing frame for feedback: {e}")
+        frame_ids = {}
+        frames_data = []
+        for index, img_bytes, prediction, reason in to_store:
+            frame_id = store_frame(img_bytes, prediction, reason) if img_bytes is not None else None
+            if frame_id:
+                stored_frame_ids.append(frame_id)
+                frame_ids[index] = frame_id
+                # Only stored frames can be fetched, so they are the ones referenced
+                if frames_response == "ref":
+                    frames_data.append({"id": frame_id, "prediction": float(prediction), "url": f"/frames/{frame_id}"})
+        
+        for index, img_bytes, prediction, thumbnail in kept_frames:
+            if frames_response == "full":
+                frames_data.append({"data": base64.b64encode(img_bytes).decode('utf-8'), "prediction": float(prediction)})
+            elif frames_response == "thumbnails" and thumbnail is not None:
+                frames_data.append({"data": base64.b64encode(thumbnail).decode('utf-8'), "prediction": float(prediction),
+                                    "id": frame_ids.get(index)})
     
         logger.info(f"Stored {len(stored_frame_ids)} frames for potential feedback")
         
@@ -191,6 +2059,9 @@ def detect_deepfake(video_bytes, filename="unknown"):
         logger.info(f"  Is deepfake: {is_deepfake}")
         logger.info(f"  Confidence: {confidence:.4f}")
         logger.info(f"  Fixed threshold used: {threshold}")
+        logger.info(f"  Sampling: {sampler.summary()}")
+        if stopped_early:
+            logger.info(f"  Stopped early after {total_frames} frames")
         logger.info(f"  Prediction stats - Avg: {avg_prediction:.4f}, Min: {min_prediction:.4f}, Max: {max_prediction:.4f}")
         
         # Return the result
@@ -199,40 +2070,178 @@ def detect_deepfake(video_bytes, filename="unknown"):
             "confidence": float(confidence),
             "deepfake_frames": deepfake_frames,
             "frames_analyzed": total_frames,
-            "frames_data": frames_data,
-             "frameIds": stored_frame_ids  # Include frames data for potential feedback use
+             "frameIds": stored_frame_ids,  # Include frames data for potential feedback use
+            "sampling": sampler.summary(),
+            "stopped_early": stopped_early,
+            "frames_used": total_frames
         }
+        # The ratio over the frames used is only an estimate of the whole video's
+        if stopped_early:
+            result.update(early_exit_confidence(confidence, deepfake_frames, total_frames, sampler.expected_frames()))
+        if frames_response != "none":
+            result["frames_data"] = frames_data
         
         return result
         
     except Exception as e:
+        failures.inc(stage="request")
         logger.exception(f"Error processing frame: {e}")
         return {"error": str(e)}
     finally:
-        # Make sure to release the video capture
+        # Stop the decoder before releasing the video capture it reads from
+        stop_event.set()
+        if decoder.is_alive():
+            decoder.join()
         cap.release()
-        # Clean up temp file
-        if os.path.exists(temp_path):
-            os.remove(temp_path)
+
+
+def analyze_video(video_path, video_digest, filename, sampler, early_exit=False, progress=None,
+                  frames_response="full"):
+    """Analyze a spooled video, serving repeat uploads of the same video from the verdict cache."""
+    cache_key = VerdictCache.make_key("video", video_digest, {
+        "sampling": sampler.mode, "stride": sampler.stride,
+        "frame_budget": sampler.frame_budget, "early_exit": early_exit,
+        "frames_response": frames_response,
+    })
+    if verdict_cache is not None:
+        cached = verdict_cache.get(cache_key)
+        if cached is not None:
+            logger.info(f"Verdict cache hit for {filename}")
+            return dict(cached, cached=True)
+    
+    result = detect_deepfake(video_path, filename=filename, sampler=sampler, early_exit=early_exit, progress=progress,
+                             frames_response=frames_response)
+    if verdict_cache is not None and "error" not in result:
+        verdict_cache.put(cache_key, result)
+    return dict(result, cached=False)
+
 
 @app.route("/", methods=["GET", "POST"])
 def index():
     if request.method == "POST":
+        # Saturated servers answer before the body is read, request.files and request.form
+        # parse (and spool) the whole multipart upload
+        rejection = reject_if_saturated()
+        if rejection is not None:
+            return rejection
+        
         file = request.files.get('file')
         if file is None or file.filename == "":
             return jsonify({"error": "No file uploaded"})
         
         try:
-            video_bytes = file.read()
-            result = detect_deepfake(video_bytes, filename=file.filename)
+            sampler = FrameSampler.from_form(request.form)
+        except ValueError as e:
+            return jsonify({"error": f"Invalid sampling options: {e}"})
+        try:
+            frames_response = frames_response_mode(request.form)
+        except ValueError as e:
+            return jsonify({"error": f"Invalid frames option: {e}"})
+        
+        temp_path = None
+        ticket = None
+        try:
+            with stage_latency.time(stage="upload"):
+                temp_path, video_digest = spool_upload(file.stream, file.filename)
+            early_exit = parse_flag(request.form.get('early_exit'), EARLY_EXIT_DEFAULT)
+            
+            # Admission is counted in the frames the video will put through the model
+            source = request.form.get('source') or request.remote_addr or 'unknown'
+            ticket, rejection = admit(source, estimate_video_frames(temp_path, sampler))
+            if rejection is not None:
+                return rejection
+            if ticket is not None and ticket.degraded:
+                sampler.limit(ticket.frames)
+            
+            result = analyze_video(temp_path, video_digest, file.filename, sampler, early_exit,
+                                   frames_response=frames_response)
+            if ticket is not None and ticket.degraded:
+                result["admission"] = {"degraded": True, "frames_requested": ticket.requested,
+                                       "frames_admitted": ticket.frames}
             return jsonify(result)
         except Exception as e:
+            failures.inc(stage="request")
             logger.exception("Error processing request")
             return jsonify({"error": str(e)})
+        finally:
+            release_admission(ticket)
+            # Clean up the per-request temp file
+            if temp_path and os.path.exists(temp_path):
+                os.remove(temp_path)
     
     return "Deepfake Detection API is running. Send a POST request with a video file to analyze."
 
 
+# Liveness: the process is serving. A failed model load needs a restart, so it fails liveness too
+@app.route("/healthz", methods=["GET"])
+def healthz():
+    if model_load_error is not None:
+        return jsonify({"status": "failed", "error": model_load_error}), 500
+    return jsonify({"status": "ok"})
+
+
+# Readiness: the model is loaded and warmed up
+@app.route("/readyz", methods=["GET"])
+def readyz():
+    if not model_ready():
+        return jsonify({"status": "failed" if model_load_error else "loading", "startup": startup_timings}), 503
+    return jsonify({"status": "ready", "model": os.path.basename(onnx_model_path), "startup": startup_timings})
+
+
+# Inference scheduler, frame writer, verdict cache, job, admission, session and frame retention counters
+@app.route("/stats", methods=["GET"])
+def stats():
+    return jsonify({
+        "inference_scheduler": inference_scheduler.stats() if inference_scheduler is not None else None,
+        "frame_writer": frame_writer.stats(),
+        "verdict_cache": verdict_cache.stats() if verdict_cache is not None else None,
+        "jobs": job_manager.stats(),
+        "admission": admission_controller.stats() if admission_controller is not None else None,
+        "sessions": session_store.stats(),
+        "frame_retention": frame_retention.stats() if frame_retention is not None else None,
+    })
+
+
+# Prometheus text exposition of the metrics registry
+@app.route("/metrics", methods=["GET"])
+def metrics_endpoint():
+    return Response(metrics_registry.render(), mimetype="text/plain; version=0.0.4")
+
+
+def feedback_document(feedback_data):
+    """Build the feedbacks collection document from a /feedback request body."""
+    # Extract result from feedback data - handle both direct format and nested format
+    if 'result' in feedback_data and isinstance(feedback_data['result'], dict):
+        result = feedback_data['result']
+        deepfake = result.get('deepfake', False)
+        confidence = result.get('confidence', 0.0)
+    else:
+        # If result is not a nested object, look for direct fields
+        deepfake = feedback_data.get('deepfake', False)
+        confidence = feedback_data.get('confidence', 0.0)
+
+    # Extract other fields with fallbacks for safety
+    was_correct = feedback_data.get('wasCorrect', True)
+    user_correction = feedback_data.get('userCorrection', None)
+
+    # Handle frameIds which might be missing or named differently
+    frame_ids = []
+    if 'frameIds' in feedback_data:
+        frame_ids = feedback_data['frameIds']
+    elif 'frame_ids' in feedback_data:
+        frame_ids = feedback_data['frame_ids']
+
+    return {
+        'timestamp': feedback_data.get('timestamp', datetime.now().isoformat()),
+        'prediction': deepfake,
+        'confidence': confidence,
+        'was_correct': was_correct,
+        'user_correction': user_correction,
+        'frame_ids': frame_ids,
+        'source': feedback_data.get('source', 'unknown')
+    }
+
+
 # Feedback endpoint 
 @app.route('/feedback', methods=['POST'])
 def receive_feedback():
@@ -240,42 +2249,19 @@ def receive_feedback():
         feedback_data = request.json
         logger.info(f"Received feedback: {feedback_data}")
         
-        # Extract result from feedback data - handle both direct format and nested format
-        if 'result' in feedback_data and isinstance(feedback_data['result'], dict):
-            result = feedback_data['result']
-            deepfake = result.get('deepfake', False)
-            confidence = result.get('confidence', 0.0)
-        else:
-            # If result is not a nested object, look for direct fields
-            deepfake = feedback_data.get('deepfake', False)
-            confidence = feedback_data.get('confidence', 0.0)
-        
-        # Extract other fields with fallbacks for safety
-        was_correct = feedback_data.get('wasCorrect', True)
-        user_correction = feedback_data.get('userCorrection', None)
-        
-        # Handle frameIds which might be missing or named differently
-        frame_ids = []
-        if 'frameIds' in feedback_data:
-            frame_ids = feedback_data['frameIds']
-        elif 'frame_ids' in feedback_data:
-            frame_ids = feedback_data['frame_ids']
-            
-        # Store in database with more robust error handling
-        feedback_doc = {
-            'timestamp': feedback_data.get('timestamp', datetime.now().isoformat()),
-            'prediction': deepfake,
-            'confidence': confidence,
-            'was_correct': was_correct,
-            'user_correction': user_correction,
-            'frame_ids': frame_ids,
-            'source': feedback_data.get('source', 'unknown')
-        }
+        feedback_doc = feedback_document(feedback_data)
+        feedback_id = get_db().feedbacks.insert_one(feedback_doc).inserted_id
         
-        feedback_id = db.feedbacks.insert_one(feedback_doc).inserted_id
+        # Frames with feedback are kept for retraining
+        if frame_retention is not None and isinstance(feedback_doc['frame_ids'], list):
+            try:
+                frame_retention.pin(feedback_doc['frame_ids'])
+            except Exception as e:
+                failures.inc(stage="frame_pin")
+                logger.warning(f"Could not pin the frames of feedback {feedback_id}: {e}")
         
         # Queue for retraining if incorrect and user provided a correction
-        if not was_correct and user_correction is not None:
+        if not feedback_doc['was_correct'] and feedback_doc['user_correction'] is not None:
             logger.info(f"Stored feedback {feedback_id} with corrections for future training")
         
         return jsonify({'success': True, 'feedback_id': str(feedback_id)})
@@ -284,6 +2270,508 @@ def receive_feedback():
         return jsonify({'success': False, 'error': str(e)}), 500
 
 
+# Frame upload transports for /frames, besides the original JSON list of base64 data URIs
+FRAME_STREAM_CONTENT_TYPES = ('application/x-frame-stream', 'application/octet-stream')
+MAX_FRAME_BYTES = int(os.environ.get('MAX_FRAME_BYTES', 16 * 1024 * 1024))
+
+# Frames are decoded on a small pool as they are read, cv2.imdecode releases the GIL
+frame_decode_pool = ThreadPoolExecutor(
+    max_workers=max(1, int(os.environ.get('FRAME_DECODE_THREADS', min(4, os.cpu_count() or 1)))),
+    thread_name_prefix="frame-decoder",
+)
+
+
+def read_exact(stream, size):
+    """Read exactly size bytes from a stream, raising ValueError if it ends early."""
+    chunks = []
+    remaining = size
+    while remaining > 0:
+        chunk = stream.read(remaining)
+        if not chunk:
+            raise ValueError(f"Frame stream ended {remaining} bytes early")
+        chunks.append(chunk)
+        remaining -= len(chunk)
+    return b"".join(chunks)
+
+
+def iter_stream_frames(stream, max_frames=None):
+    """Yield frame blobs from a length-prefixed stream as they arrive.
+
+    Each frame is a 4-byte big-endian length followed by the JPEG/WebP bytes. A stream
+    holding more than max_frames frames raises ValueError.
+    """
+    count = 0
+    while True:
+        prefix = stream.read(4)
+        if not prefix:
+            return
+        count += 1
+        if max_frames is not None and count > max_frames:
+            raise ValueError(f"Frame stream holds more than its frame_count of {max_frames} frames")
+        if len(prefix) < 4:
+            prefix += read_exact(stream, 4 - len(prefix))
+        size = struct.unpack('>I', prefix)[0]
+        if size > MAX_FRAME_BYTES:
+            raise ValueError(f"Frame of {size} bytes exceeds the {MAX_FRAME_BYTES} byte limit")
+        yield read_exact(stream, size)
+
+
+def iter_base64_frames(frames_data):
+    """Yield the encoded bytes of base64 frames, with or without a data URI prefix, or None if invalid."""
+    for frame_data in frames_data:
+        try:
+            if ',' in frame_data:  # Handle data URI format
+                encoded_data = frame_data.split(',')[1]
+            else:  # Already base64 without prefix
+                encoded_data = frame_data
+            with stage_latency.time(stage="base64_decode"):
+                img_bytes = base64.b64decode(encoded_data)
+            yield img_bytes
+        except Exception as e:
+            failures.inc(stage="base64_decode")
+            logger.error(f"Invalid base64 frame: {e}")
+            yield None
+
+
+def parse_frames_request():
+    """Read the /frames metadata and an iterator of encoded frame bytes from any supported transport.
+
+    Supported request bodies:
+      application/json           - {"frames": [base64 data URIs], ...metadata}
+      multipart/form-data        - a "metadata" JSON field and one "frames" file part per frame
+      application/x-frame-stream - a 4-byte big-endian length and JSON metadata with a
+                                   frame_count, then up to that many length-prefixed
+                                   frames (see iter_stream_frames)
+
+    Only the frame stream is read incrementally, so its frames start decoding while
+    the rest of the body is still arriving. Werkzeug spools a whole multipart body
+    before the first part is returned, and a JSON body is parsed in one go.
+
+    Returns (metadata, frames, transport), with metadata None when the body is empty
+    and None in place of any frame that could not be read.
+    """
+    if request.mimetype == 'multipart/form-data':
+        metadata = json.loads(request.form.get('metadata') or '{}')
+        return metadata, (part.read() for part in request.files.getlist('frames')), 'multipart'
+    
+    if request.mimetype in FRAME_STREAM_CONTENT_TYPES:
+        metadata, frames = parse_frame_stream(request.stream)
+        return metadata, frames, 'stream'
+    
+    data = request.json
+    if not data:
+        return None, iter(()), 'json'
+    return data, iter_base64_frames(data.get('frames', [])), 'json'
+
+
+def parse_frame_stream(stream):
+    """Read the JSON metadata header of a frame stream, returning (metadata, frame iterator).
+
+    The header is a 4-byte big-endian length and the JSON, metadata is None for an empty body.
+    The metadata must declare a positive frame_count, admission is charged for that many
+    frames and the stream may not hold more.
+    """
+    prefix = stream.read(4)
+    if not prefix:
+        return None, iter(())
+    if len(prefix) < 4:
+        prefix += read_exact(stream, 4 - len(prefix))
+    header_size = struct.unpack('>I', prefix)[0]
+    metadata = json.loads(read_exact(stream, header_size) or b'{}') if header_size else {}
+    try:
+        frame_count = int(metadata.get('frame_count'))
+    except (TypeError, ValueError):
+        frame_count = 0
+    if frame_count <= 0:
+        raise ValueError("A frame stream must declare a positive frame_count in its metadata")
+    metadata['frame_count'] = frame_count
+    return metadata, iter_stream_frames(stream, max_frames=frame_count)
+
+
+def declared_frame_count(data, transport, part_count=0):
+    """Number of frames a /frames request holds, known before any of them is decoded.
+
+    Multipart requests pass their number of frame parts as part_count. Streams use the
+    frame_count their metadata must declare (see parse_frame_stream).
+    """
+    if transport == 'json':
+        return len(data.get('frames') or [])
+    if transport == 'multipart':
+        return part_count
+    return data['frame_count']
+
+
+def decode_frame_payload(img_bytes):
+    """Decode encoded frame bytes, returning the image and the bytes to store (None unless JPEG)."""
+    with stage_latency.time(stage="image_decode"):
+        frame = cv2.imdecode(np.frombuffer(img_bytes, np.uint8), cv2.IMREAD_COLOR)
+    # Canvas captures are already JPEG, those bytes are stored as they are
+    if not img_bytes.startswith(b'\xff\xd8'):
+        img_bytes = None
+    return frame, img_bytes
+
+
+# Server-side sessions for captures the extension sends as several /frames batches
+class AnalysisSession:
+    """Per-batch statistics rows of one capture, merged into its cumulative verdict.
+
+    Rows are kept by batch number in a small NumPy array, so a retried batch
+    replaces its earlier row instead of being counted twice.
+    """
+
+    def __init__(self, session_id, total_batches=None):
+        self.session_id = session_id
+        self.total_batches = total_batches
+        self.batch_numbers = np.zeros(0, dtype=np.int64)
+        self.rows = np.zeros((0, 6), dtype=np.float64)
+        self.updated = time.monotonic()
+
+    def add_batch(self, batch, stats):
+        slot = np.flatnonzero(self.batch_numbers == batch)
+        if slot.size:
+            self.rows[slot[0]] = stats
+        else:
+            self.batch_numbers = np.append(self.batch_numbers, batch)
+            self.rows = np.vstack([self.rows, stats])
+        self.updated = time.monotonic()
+
+
+class SessionStore:
+    """Keeps analysis sessions for ttl seconds after their last batch.
+
+    Sessions live in memory, at most max_sessions of them. With a collection_fn
+    each batch's row is $set into a shared Mongo document instead, so batches
+    handled by different workers or instances still add up. That collection has
+    a TTL index on updated_at.
+    """
+
+    def __init__(self, ttl=600.0, max_sessions=10000, collection_fn=None):
+        self.ttl = ttl
+        self.max_sessions = max_sessions
+        self.collection_fn = collection_fn
+        self.sessions = OrderedDict()
+        self.lock = threading.Lock()
+        self.index_ready = False
+
+    def record(self, session_id, batch, total_batches, stats):
+        """Record a batch's statistics row and return (batch numbers, rows, total batches) of the session."""
+        if self.collection_fn is not None:
+            return self._record_shared(session_id, batch, total_batches, stats)
+
+        now = time.monotonic()
+        with self.lock:
+            # Sessions are ordered by last update, so expired ones are at the front
+            while self.sessions:
+                oldest = next(iter(self.sessions.values()))
+                if oldest.updated > now - self.ttl and len(self.sessions) < self.max_sessions:
+                    break
+                self.sessions.popitem(last=False)
+
+            session = self.sessions.pop(session_id, None) or AnalysisSession(session_id, total_batches)
+            session.total_batches = total_batches or session.total_batches
+            session.add_batch(batch, stats)
+            self.sessions[session_id] = session
+            return session.batch_numbers.copy(), session.rows.copy(), session.total_batches
+
+    def _record_shared(self, session_id, batch, total_batches, stats):
+        collection = self.collection_fn()
+        if not self.index_ready:
+            collection.create_index("updated_at", expireAfterSeconds=int(self.ttl))
+            self.index_ready = True
+        update = {f"batches.{batch}": [float(value) for value in stats], "updated_at": datetime.utcnow()}
+        if total_batches:
+            update["total_batches"] = total_batches
+        collection.update_one({"_id": session_id}, {"$set": update}, upsert=True)
+        document = collection.find_one({"_id": session_id})
+        batches = document.get("batches", {})
+        return (np.array([int(number) for number in batches], dtype=np.int64),
+                np.array(list(batches.values()), dtype=np.float64), document.get("total_batches"))
+
+    def stats(self):
+        with self.lock:
+            return {"sessions": len(self.sessions), "shared": self.collection_fn is not None}
+
+
+session_store = SessionStore(
+    ttl=float(os.environ.get('SESSION_TTL', 600)),
+    max_sessions=int(os.environ.get('SESSION_MAX', 10000)),
+    collection_fn=(lambda: get_db().analysis_sessions) if os.environ.get('SESSIONS_MONGO', '0') == '1' else None,
+)
+
+# X-Request-ID of one batch of a multi-batch capture, as sent by background.js
+BATCH_REQUEST_ID = re.compile(r'^(?P<base>.+)-batch-(?P<batch>\d+)$')
+
+
+def session_identity(data, request_id):
+    """Return (session_id, batch, total_batches) when the request is one batch of a larger capture, else None."""
+    match = BATCH_REQUEST_ID.match(request_id or '')
+    total_batches = data.get('totalBatches')
+    session_id = data.get('session_id')
+    if match is None and not total_batches and not session_id:
+        return None
+    try:
+        batch = int(match.group('batch')) if match else int(data.get('batch') or 1)
+        total_batches = int(total_batches) if total_batches else None
+    except (TypeError, ValueError):
+        return None
+    session_id = session_id or (match.group('base') if match else data.get('id'))
+    if not session_id or session_id == 'unknown':
+        return None
+    return str(session_id), batch, total_batches
+
+
+def attach_session(result, data, request_id):
+    """Add this batch to its capture's session and attach the cumulative verdict to the result."""
+    identity = session_identity(data, request_id)
+    prediction_stats = result.get("prediction_stats")
+    if identity is None or prediction_stats is None:
+        return result
+    session_id, batch, total_batches = identity
+
+    frames = result["frames_analyzed"]
+    stats = np.array([frames, result["deepfake_frames"], prediction_stats["mean"],
+                      prediction_stats["variance"] * frames, prediction_stats["min"], prediction_stats["max"]])
+    try:
+        batch_numbers, rows, total_batches = session_store.record(session_id, batch, total_batches, stats)
+    except Exception as e:
+        logger.warning(f"[{request_id}] Could not update session {session_id}: {e}")
+        return result
+
+    summary = summarize_statistics(merge_statistics(rows))
+    logger.info(f"[{request_id}] Session {session_id}: {len(batch_numbers)} batches, "
+                f"{summary['deepfake_frames']}/{summary['total_frames']} deepfake frames so far")
+    return dict(result, session={
+        "id": session_id,
+        "batches": len(batch_numbers),
+        "total_batches": total_batches,
+        "complete": bool(total_batches) and len(batch_numbers) >= total_batches,
+        "deepfake": bool(summary["is_deepfake"]),
+        "confidence": float(summary["confidence"]),
+        "deepfake_frames": summary["deepfake_frames"],
+        "frames_analyzed": summary["total_frames"],
+        "deepfake_ratio": summary["deepfake_ratio"],
+        "prediction_stats": {
+            "mean": summary["avg_prediction"],
+            "variance": summary["variance"],
+            "min": summary["min_prediction"],
+            "max": summary["max_prediction"],
+        },
+    })
+
+
+def analyze_frame_batch(data, frame_payloads, transport, request_id="unknown", start_time=None, progress=None,
+                        frame_limit=None, expected_frames=None):
+    """Analyze a batch of encoded frames and its /frames metadata, returning the result or an error dict.
+
+    progress, if given, is called with (frames_done, frames_total) after every inference batch.
+    frame_limit caps the frames decoded and analyzed, spread evenly over the
+    expected_frames the request is expected to hold (degraded admission).
+    """
+    start_time = start_time or time.time()
+    selected = subsample_indices(expected_frames, frame_limit) if frame_limit and expected_frames else None
+    skipped_frames = 0
+    
+    # Extract batch information if available
+    batch_info = data.get('batch_info', 'N/A')
+    source = data.get('source', 'unknown')
+    dimensions = data.get('dimensions', 'unknown')
+    face_data = data.get('facial_frames', 0)
+    early_exit = parse_flag(data.get('early_exit'), EARLY_EXIT_DEFAULT)
+    dedup = parse_flag(data.get('dedup'), FRAME_DEDUP_DEFAULT)
+    
+    # Hash each frame and start decoding it as soon as it is read, for a frame
+    # stream that overlaps decoding with the upload itself
+    frame_hashes = []
+    decode_futures = []
+    for i, img_bytes in enumerate(frame_payloads):
+        # Only a sample of frames is logged, to keep the noise and the cost down
+        if FRAME_LOG_SAMPLE_RATE and random.random() < FRAME_LOG_SAMPLE_RATE and logger.isEnabledFor(logging.DEBUG):
+            logger.debug(f"[{request_id}] Received frame {i+1}")
+        if not img_bytes:
+            decode_futures.append(None)
+            continue
+        frame_hashes.append(hashlib.sha256(img_bytes).digest())
+        if selected is not None and i not in selected:
+            # Left out by degraded admission, only hashed so the cache can still serve the full verdict
+            skipped_frames += 1
+            continue
+        decode_futures.append(frame_decode_pool.submit(decode_frame_payload, img_bytes))
+    
+    total_frames = len(decode_futures) + skipped_frames
+    if not total_frames:
+        logger.error(f"[{request_id}] No frames provided in request")
+        return {"error": "No frames provided"}
+    
+    logger.info(f"[{request_id}] Received analysis request from {source}: "
+               f"{total_frames} frames ({transport}), batch {batch_info}, dimensions {dimensions}, "
+               f"with {face_data} facial frames")
+    
+    # The same frames in any order give the same verdict, serve them from the cache
+    cache_key = VerdictCache.make_key("frames", frames_digest(frame_hashes), {"early_exit": early_exit, "dedup": dedup})
+    if verdict_cache is not None:
+        cached = verdict_cache.get(cache_key)
+        if cached is not None:
+            for future in decode_futures:
+                if future is not None:
+                    future.cancel()
+            processing_time = time.time() - start_time
+            logger.info(f"[{request_id}] Verdict cache hit, returned in {processing_time:.3f} seconds")
+            return attach_session(dict(cached, request_id=request_id, processing_time=f"{processing_time:.2f}s", cached=True),
+                                  data, request_id)
+    
+    prediction_values = []
+    successful_frames = 0
+    stored_frame_ids = []  # To track stored frame IDs for feedback
+    
+    # Collect every decoded frame first so inference can run on whole batches
+    decoded_frames = []
+    for i, future in enumerate(decode_futures):
+        try:
+            frame, img_bytes = future.result() if future is not None else (None, None)
+            if frame is None:
+                if future is not None:
+                    failures.inc(stage="image_decode")
+                logger.warning(f"[{request_id}] Failed to decode frame {i+1}")
+                continue
+            decoded_frames.append((frame, img_bytes))
+        except Exception as e:
+            logger.error(f"[{request_id}] Error processing frame {i+1}: {str(e)}")
+            # Continue processing other frames instead of failing
+    
+    # Grouping near-identical frames so inference runs once per cluster
+    if dedup and decoded_frames:
+        with stage_latency.time(stage="dedup"):
+            representatives, cluster_of = cluster_frames([dhash(frame) for frame, _ in decoded_frames],
+                                                         FRAME_DEDUP_DISTANCE)
+    else:
+        representatives, cluster_of = list(range(len(decoded_frames))), list(range(len(decoded_frames)))
+    
+    # Processing the representative frames with batched inference
+    # With early exit or progress reporting, batches run one at a time (until the verdict is settled)
+    stopped_early = False
+    cluster_predictions = {}  # Cluster index -> prediction of its representative
+    if early_exit or progress is not None:
+        # With early exit the frames are walked in random order, so the frames covered so far are
+        # a uniform random sample of the batch and verdict_settled may stop on its statistical bound
+        order = np.random.permutation(len(decoded_frames)) if early_exit else np.arange(len(decoded_frames))
+        frames_covered = 0
+        deepfake_count = 0
+        while frames_covered < len(order):
+            # Walk the order until it reaches a batch worth of clusters without a prediction yet
+            batch_clusters = []
+            end = frames_covered
+            while end < len(order):
+                cluster = cluster_of[order[end]]
+                if cluster not in cluster_predictions and cluster not in batch_clusters:
+                    if len(batch_clusters) == INFERENCE_BATCH_SIZE:
+                        break
+                    batch_clusters.append(cluster)
+                end += 1
+            predictions = run_inference([decoded_frames[representatives[cluster]][0] for cluster in batch_clusters])
+            cluster_predictions.update(zip(batch_clusters, predictions))
+            # Each frame counts with the prediction of its cluster
+            for position in range(frames_covered, end):
+                if cluster_predictions[cluster_of[order[position]]] < FRAME_THRESHOLD:
+                    deepfake_count += 1
+            frames_covered = end
+            if progress is not None:
+                progress(frames_covered, len(decoded_frames))
+            if early_exit and frames_covered < len(order) and \
+                    verdict_settled(deepfake_count, frames_covered, len(decoded_frames), sampled=True):
+                stopped_early = True
+                break
+        covered = np.sort(order[:frames_covered])
+    else:
+        representative_images = [decoded_frames[i][0] for i in representatives]
+        cluster_predictions = dict(enumerate(run_inference(representative_images)))
+        covered = np.arange(len(decoded_frames))
+    
+    # Every frame takes the prediction of its cluster, so the deepfake ratio stays weighted correctly
+    prediction_values = np.asarray([cluster_predictions[cluster_of[i]] for i in covered], dtype=np.float64)
+    representative_predictions = [(representatives[cluster], prediction)
+                                  for cluster, prediction in sorted(cluster_predictions.items())]
+    successful_frames = len(prediction_values)
+    
+    # Only one representative per cluster is stored, and of those the ones the retention policy selects
+    to_store = [(i, prediction, None) for i, prediction in representative_predictions]
+    if frame_retention is not None:
+        selector = frame_retention.selector()
+        for i, prediction in representative_predictions:
+            selector.offer(i, prediction)
+        to_store = selector.selected()
+    for i, prediction, reason in to_store:
+        frame, img_bytes = decoded_frames[i]
+        # Store frame in database for potential feedback
+        if img_bytes is None:
+            img_bytes = encode_frame(frame)
+        frame_id = store_frame(img_bytes, prediction, reason) if img_bytes is not None else None
+        if frame_id:
+            stored_frame_ids.append(frame_id)
+    
+    # If no frames were successfully processed, return error
+    if not successful_frames:
+        logger.error(f"[{request_id}] No frames could be analyzed out of {total_frames} received")
+        return {"error": "No frames could be analyzed"}
+    
+    processing_time = time.time() - start_time
+    logger.info(f"[{request_id}] Processed {successful_frames}/{total_frames} frames in {processing_time:.2f} seconds")
+    
+    # Use the same logic as your video analysis for consistency
+    summary = aggregate_predictions(prediction_values)
+    avg_prediction = summary["avg_prediction"]
+    min_prediction = summary["min_prediction"]
+    max_prediction = summary["max_prediction"]
+    deepfake_frames = summary["deepfake_frames"]
+    total_processed = summary["total_frames"]
+    deepfake_ratio = summary["deepfake_ratio"]
+    is_deepfake = summary["is_deepfake"]
+    confidence = summary["confidence"]
+    
+    logger.info(f"[{request_id}] Analysis complete:")
+    logger.info(f"  Total frames processed: {total_processed}/{total_frames}")
+    logger.info(f"  Deepfake frames: {deepfake_frames}")
+    logger.info(f"  Deepfake ratio: {deepfake_ratio:.4f}")
+    logger.info(f"  Is deepfake: {is_deepfake}")
+    logger.info(f"  Confidence: {confidence:.4f}")
+    logger.info(f"  Prediction stats - Avg: {avg_prediction:.4f}, Min: {min_prediction:.4f}, Max: {max_prediction:.4f}")
+    logger.info(f"  Stored {len(stored_frame_ids)} frames for potential feedback")
+    
+    # Return enhanced response for batch processing, now including frameIds
+    result = {
+        "deepfake": bool(is_deepfake),
+        "confidence": float(confidence),
+        "deepfake_frames": deepfake_frames,
+        "frames_analyzed": total_processed,
+        "request_id": request_id,
+        "processing_time": f"{processing_time:.2f}s",
+        "frameIds": stored_frame_ids,  # Return the frame IDs for feedback
+        "stopped_early": stopped_early,
+        "frames_used": total_processed,
+        "dedup": {
+            "enabled": dedup,
+            "clusters": len(representatives),
+            "frames_saved": len(decoded_frames) - len(representatives),
+        },
+        "prediction_stats": {
+            "mean": avg_prediction,
+            "variance": summary["variance"],
+            "min": min_prediction,
+            "max": max_prediction,
+        },
+        "status": "success"
+    }
+    # The ratio over the frames used is only an estimate of the whole batch's
+    if stopped_early:
+        result.update(early_exit_confidence(confidence, deepfake_frames, total_processed, len(decoded_frames),
+                                            sampled=True))
+    if skipped_frames:
+        result["admission"] = {"degraded": True, "frames_received": total_frames,
+                               "frames_admitted": total_frames - skipped_frames}
+    # A degraded verdict only covers part of the frames, so it is not cached
+    if verdict_cache is not None and not skipped_frames:
+        verdict_cache.put(cache_key, result)
+    return attach_session(dict(result, cached=False), data, request_id)
+
 # Modifying the analyze_frames endpoint to store frames and return frameIds
 @app.route("/frames", methods=["POST"])
 def analyze_frames():
@@ -292,121 +2780,32 @@ def analyze_frames():
     start_time = time.time()
     
     try:
-        data = request.json
+        # Saturated servers answer before reading the body
+        rejection = reject_if_saturated()
+        if rejection is not None:
+            return rejection
+        
+        try:
+            data, frame_payloads, transport = parse_frames_request()
+        except ValueError as e:
+            return jsonify({"error": f"Invalid frames request: {e}"}), 400
         if not data:
-            logger.error(f"[{request_id}] No JSON data provided")
+            logger.error(f"[{request_id}] No data provided")
             return jsonify({"error": "No data provided"})
         
-        frames_data = data.get('frames', [])
-        if not frames_data:
-            logger.error(f"[{request_id}] No frames provided in request")
-            return jsonify({"error": "No frames provided"})
-        
-        # Extract batch information if available
-        batch_info = data.get('batch_info', 'N/A')
-        source = data.get('source', 'unknown')
-        dimensions = data.get('dimensions', 'unknown')
-        face_data = data.get('facial_frames', 0)
-        
-        logger.info(f"[{request_id}] Received analysis request from {source}: "
-                   f"{len(frames_data)} frames, batch {batch_info}, dimensions {dimensions}, "
-                   f"with {face_data} facial frames")
-        
-        total_frames = len(frames_data)
-        prediction_values = []
-        successful_frames = 0
-        stored_frame_ids = []  # To track stored frame IDs for feedback
-        
-        # Track frames with faces separately if provided with facial frame information
-        facial_prediction_values = []
-        
-        for i, frame_data in enumerate(frames_data):
-            try:
-                # Skip logging for each frame to reduce noise, but log progress every 25 frames
-                if i % 25 == 0:
-                    logger.debug(f"[{request_id}] Processing frame {i+1}/{total_frames}")
-                
-                # Converting base64 to image
-                if ',' in frame_data:  # Handle data URI format
-                    encoded_data = frame_data.split(',')[1]
-                else:  # Already base64 without prefix
-                    encoded_data = frame_data
-                
-                img_bytes = base64.b64decode(encoded_data)
-                frame = cv2.imdecode(np.frombuffer(img_bytes, np.uint8), cv2.IMREAD_COLOR)
-                
-                if frame is None:
-                    logger.warning(f"[{request_id}] Failed to decode frame {i+1}")
-                    continue
-                
-                # Processing frame using existing preprocessing function
-                input_tensor = preprocess_frame(frame)
-                output = ort_session.run(None, {'input.1': input_tensor})
-                prediction = float(output[0][0].item())
-                prediction_values.append(prediction)
-                
-                # Store frame in database for potential feedback
-                frame_metadata = {
-                    'source': source,
-                    'dimensions': dimensions,
-                    'request_id': request_id,
-                    'has_face': i < face_data if face_data else False
-                }
-                
-                frame_id = store_frame(frame, prediction)
-                if frame_id:
-                    stored_frame_ids.append(frame_id)
-                
-                successful_frames += 1
-                
-            except Exception as e:
-                logger.error(f"[{request_id}] Error processing frame {i+1}: {str(e)}")
-                # Continue processing other frames instead of failing
-        
-        # If no frames were successfully processed, return error
-        if not prediction_values:
-            logger.error(f"[{request_id}] No frames could be analyzed out of {total_frames} received")
-            return jsonify({"error": "No frames could be analyzed"})
-        
-        processing_time = time.time() - start_time
-        logger.info(f"[{request_id}] Processed {successful_frames}/{total_frames} frames in {processing_time:.2f} seconds")
-        
-        # Use the same logic as your video analysis for consistency
-        avg_prediction = np.mean(prediction_values)
-        min_prediction = np.min(prediction_values)
-        max_prediction = np.max(prediction_values)
-        
-        # Same threshold and logic as your video function
-        threshold = 0.8
-        deepfake_frames = sum(1 for p in prediction_values if p < threshold)
-        total_processed = len(prediction_values)
-        deepfake_ratio = deepfake_frames / total_processed
-        is_deepfake = deepfake_ratio > 0.5
-        confidence = abs(deepfake_ratio - 0.5) * 2
-        confidence = min(1.0, confidence)
-        
-        logger.info(f"[{request_id}] Analysis complete:")
-        logger.info(f"  Total frames processed: {total_processed}/{total_frames}")
-        logger.info(f"  Deepfake frames: {deepfake_frames}")
-        logger.info(f"  Deepfake ratio: {deepfake_ratio:.4f}")
-        logger.info(f"  Is deepfake: {is_deepfake}")
-        logger.info(f"  Confidence: {confidence:.4f}")
-        logger.info(f"  Prediction stats - Avg: {avg_prediction:.4f}, Min: {min_prediction:.4f}, Max: {max_prediction:.4f}")
-        logger.info(f"  Stored {len(stored_frame_ids)} frames for potential feedback")
-        
-        # Return enhanced response for batch processing, now including frameIds
-        return jsonify({
-            "deepfake": bool(is_deepfake),
-            "confidence": float(confidence),
-            "deepfake_frames": deepfake_frames,
-            "frames_analyzed": total_processed,
-            "request_id": request_id,
-            "processing_time": f"{processing_time:.2f}s",
-            "frameIds": stored_frame_ids,  # Return the frame IDs for feedback
-            "status": "success"
-        })
+        expected_frames = declared_frame_count(data, transport, len(request.files.getlist('frames')))
+        ticket, rejection = admit(data.get('source', 'unknown'), expected_frames)
+        if rejection is not None:
+            return rejection
+        try:
+            frame_limit = ticket.frames if ticket is not None and ticket.degraded else None
+            return jsonify(analyze_frame_batch(data, frame_payloads, transport, request_id, start_time,
+                                               frame_limit=frame_limit, expected_frames=expected_frames))
+        finally:
+            release_admission(ticket)
     except Exception as e:
         processing_time = time.time() - start_time
+        failures.inc(stage="request")
         logger.exception(f"[{request_id}] Error in frames analysis: {e}")
         return jsonify({
             "error": str(e),
@@ -415,6 +2814,280 @@ def analyze_frames():
             "status": "error"
         })
 
+
+# Stored frames by ID, as listed in frameIds and in "ref" and "thumbnails" frames_data entries.
+# ?size=N returns a copy scaled down to at most N pixels on the longest side
+@app.route("/frames/<frame_id>", methods=["GET"])
+def get_frame(frame_id):
+    try:
+        # Frames still waiting for the background writer are served from its queue
+        document = frame_writer.pending_document(frame_id) or get_db().frames.find_one({"_id": frame_id})
+        jpeg = stored_frame_bytes(document) if document is not None else None
+        size = request.args.get('size', type=int)
+        if jpeg is not None and size:
+            jpeg = encode_thumbnail(decode_frame_payload(jpeg)[0], size=size, quality=80)
+    except Exception as e:
+        failures.inc(stage="frame_fetch")
+        logger.exception(f"Error fetching frame {frame_id}: {e}")
+        return jsonify({"error": str(e)}), 500
+    if jpeg is None:
+        return jsonify({"error": "Unknown frame"}), 404
+
+    # A frame ID always names the same image, so clients may cache it indefinitely
+    response = Response(jpeg, mimetype="image/jpeg")
+    response.headers['Cache-Control'] = 'public, max-age=31536000, immutable'
+    response.set_etag(f"{frame_id}-{size or 'full'}")
+    return response.make_conditional(request)
+
+
+# Asynchronous jobs, so long uploads run on their own worker pool instead of holding a request thread
+class JobManager:
+    """Runs analysis jobs on a bounded worker pool and tracks their state and progress.
+
+    Job state lives in memory, finished jobs are forgotten after ttl seconds. With a
+    collection_fn, state changes (and progress, at most every persist_interval
+    seconds) are also written to Mongo, so other instances can answer status
+    requests and results outlive a restart until the TTL index removes them.
+    """
+
+    # Results bigger than this are not persisted, BSON documents are capped at 16MB
+    PERSIST_MAX_RESULT_BYTES = 8 * 1024 * 1024
+
+    def __init__(self, workers=2, max_pending=32, ttl=3600.0, collection_fn=None, persist_interval=2.0):
+        self.workers = workers
+        self.max_pending = max_pending
+        self.ttl = ttl
+        self.collection_fn = collection_fn
+        self.persist_interval = persist_interval
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="job-worker")
+        self.jobs = OrderedDict()  # job_id -> job state
+        self.lock = threading.Lock()
+        self.index_ready = False
+
+        self.submitted = 0
+        self.completed = 0
+        self.failed = 0
+        self.rejected = 0
+
+    def submit(self, kind, run_fn, cleanup_fn=None, **details):
+        """Queue run_fn(progress) as a job, returning its state or None when too many jobs are pending.
+
+        cleanup_fn, if given, runs once the job has finished, whatever the outcome.
+        """
+        now = time.time()
+        job_id = uuid.uuid4().hex
+        job = {
+            "job_id": job_id,
+            "kind": kind,
+            "status": "queued",
+            "progress": {"frames_done": 0, "frames_total": None},
+            "result": None,
+            "error": None,
+            "created_at": datetime.fromtimestamp(now).isoformat(),
+            "started_at": None,
+            "finished_at": None,
+            "details": details,
+            "finished_monotonic": None,
+            "persisted_monotonic": 0.0,
+        }
+        with self.lock:
+            self._prune()
+            pending = sum(1 for state in self.jobs.values() if state["status"] in ("queued", "running"))
+            if pending >= self.max_pending:
+                self.rejected += 1
+                return None
+            self.jobs[job_id] = job
+            self.submitted += 1
+        self._persist(job_id, force=True)
+        self.executor.submit(self._run, job_id, run_fn, cleanup_fn)
+        return self.get(job_id)
+
+    def _run(self, job_id, run_fn, cleanup_fn):
+        self._update(job_id, status="running", started_at=datetime.now().isoformat())
+
+        def progress(frames_done, frames_total=None):
+            self._update(job_id, progress={"frames_done": frames_done, "frames_total": frames_total})
+
+        try:
+            result = run_fn(progress)
+            if "error" in result:
+                self._finish(job_id, "failed", error=result["error"])
+            else:
+                self._finish(job_id, "done", result=result)
+        except Exception as e:
+            logger.exception(f"Job {job_id} failed: {e}")
+            self._finish(job_id, "failed", error=str(e))
+        finally:
+            if cleanup_fn is not None:
+                cleanup_fn()
+
+    def _finish(self, job_id, status, result=None, error=None):
+        with self.lock:
+            job = self.jobs[job_id]
+            if status == "done":
+                self.completed += 1
+                # A verdict cache hit never reports progress, so take the
+                # final count from the result itself.
+                done = result.get("frames_analyzed", job["progress"]["frames_done"])
+                job["progress"] = {"frames_done": done, "frames_total": done}
+            else:
+                self.failed += 1
+            job["finished_monotonic"] = time.monotonic()
+        self._update(job_id, status=status, result=result, error=error, finished_at=datetime.now().isoformat())
+
+    def _update(self, job_id, **fields):
+        with self.lock:
+            job = self.jobs.get(job_id)
+            if job is None:
+                return
+            job.update(fields)
+        self._persist(job_id, force="status" in fields)
+
+    def _prune(self):
+        """Forget finished jobs older than the TTL, the caller holds the lock."""
+        cutoff = time.monotonic() - self.ttl
+        for job_id in [job_id for job_id, job in self.jobs.items()
+                       if job["finished_monotonic"] is not None and job["finished_monotonic"] < cutoff]:
+            del self.jobs[job_id]
+
+    def _persist(self, job_id, force=False):
+        if self.collection_fn is None:
+            return
+        with self.lock:
+            job = self.jobs.get(job_id)
+            if job is None or (not force and time.monotonic() - job["persisted_monotonic"] < self.persist_interval):
+                return
+            job["persisted_monotonic"] = time.monotonic()
+            document = self._public(job)
+        if document["result"] is not None and len(json.dumps(document["result"])) > self.PERSIST_MAX_RESULT_BYTES:
+            document["result"] = None
+            document["result_persisted"] = False
+        document["updated_at"] = datetime.utcnow()
+        try:
+            collection = self.collection_fn()
+            if not self.index_ready:
+                collection.create_index("updated_at", expireAfterSeconds=int(self.ttl))
+                self.index_ready = True
+            collection.replace_one({"_id": job_id}, document, upsert=True)
+        except Exception as e:
+            logger.warning(f"Persisting job {job_id} failed: {e}")
+
+    @staticmethod
+    def _public(job):
+        return {key: value for key, value in job.items() if not key.endswith("_monotonic")}
+
+    def get(self, job_id):
+        """Return the state of a job, looking in Mongo for jobs this instance does not know."""
+        with self.lock:
+            job = self.jobs.get(job_id)
+            if job is not None:
+                return self._public(job)
+        if self.collection_fn is None:
+            return None
+        try:
+            document = self.collection_fn().find_one({"_id": job_id})
+        except Exception as e:
+            logger.warning(f"Job lookup for {job_id} failed: {e}")
+            return None
+        if document is None:
+            return None
+        document.pop("_id", None)
+        document.pop("updated_at", None)
+        return document
+
+    def stats(self):
+        """Return job counters and the number of queued and running jobs."""
+        with self.lock:
+            statuses = [job["status"] for job in self.jobs.values()]
+            return {
+                "workers": self.workers,
+                "queued": statuses.count("queued"),
+                "running": statuses.count("running"),
+                "submitted": self.submitted,
+                "completed": self.completed,
+                "failed": self.failed,
+                "rejected": self.rejected,
+            }
+
+
+job_manager = JobManager(
+    workers=max(1, int(os.environ.get('JOB_WORKERS', 2))),
+    max_pending=max(1, int(os.environ.get('JOB_MAX_PENDING', 32))),
+    ttl=float(os.environ.get('JOB_TTL', 3600)),
+    collection_fn=(lambda: get_db().jobs) if os.environ.get('JOBS_MONGO', '0') == '1' else None,
+)
+jobs_pending = metrics.Gauge(
+    "deepfake_jobs_pending", "Jobs queued or running on the job worker pool", registry=metrics_registry)
+jobs_pending.set_function(lambda: sum(job_manager.stats()[status] for status in ("queued", "running")))
+
+
+def remove_file(path):
+    if path and os.path.exists(path):
+        os.remove(path)
+
+
+@app.route("/jobs", methods=["POST"])
+def create_job():
+    """Accept a video upload (a "file" form field) or a /frames style frame batch and queue it as a job."""
+    request_id = request.headers.get('X-Request-ID', 'unknown')
+    temp_path = None
+    try:
+        file = request.files.get('file')
+        if file is not None and file.filename:
+            try:
+                sampler = FrameSampler.from_form(request.form)
+            except ValueError as e:
+                return jsonify({"error": f"Invalid sampling options: {e}"}), 400
+            try:
+                frames_response = frames_response_mode(request.form)
+            except ValueError as e:
+                return jsonify({"error": f"Invalid frames option: {e}"}), 400
+            with stage_latency.time(stage="upload"):
+                temp_path, video_digest = spool_upload(file.stream, file.filename)
+            early_exit = parse_flag(request.form.get('early_exit'), EARLY_EXIT_DEFAULT)
+            filename = file.filename
+            job = job_manager.submit(
+                "video",
+                lambda progress: analyze_video(temp_path, video_digest, filename, sampler, early_exit, progress,
+                                               frames_response),
+                cleanup_fn=lambda: remove_file(temp_path),
+                filename=filename, request_id=request_id,
+            )
+        else:
+            data, frame_payloads, transport = parse_frames_request()
+            if not data:
+                return jsonify({"error": "No data provided"}), 400
+            # The request body is gone once the response is sent, so the frames are read now
+            frame_payloads = list(frame_payloads)
+            start_time = time.time()
+            job = job_manager.submit(
+                "frames",
+                lambda progress: analyze_frame_batch(data, iter(frame_payloads), transport, request_id, start_time, progress),
+                frames=len(frame_payloads), request_id=request_id,
+            )
+    except Exception as e:
+        failures.inc(stage="request")
+        logger.exception(f"[{request_id}] Error creating job: {e}")
+        remove_file(temp_path)
+        return jsonify({"error": str(e)}), 500
+
+    if job is None:
+        remove_file(temp_path)
+        response = jsonify({"error": "Too many pending jobs, try again later"})
+        response.headers['Retry-After'] = '5'
+        return response, 429
+    logger.info(f"[{request_id}] Queued {job['kind']} job {job['job_id']}")
+    return jsonify({"job_id": job["job_id"], "status": job["status"], "status_url": f"/jobs/{job['job_id']}"}), 202
+
+
+@app.route("/jobs/<job_id>", methods=["GET"])
+def get_job(job_id):
+    job = job_manager.get(job_id)
+    if job is None:
+        return jsonify({"error": "Unknown job"}), 404
+    return jsonify(job)
+
+
 if __name__ == "__main__":
 
  
@@ -0,0 +1,306 @@
+import os
+import io
+import json
+import time
+import asyncio
+import anyio
+import gridfs
+from fastapi import FastAPI, Request
+from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import Response, HTMLResponse
+from motor.motor_asyncio import AsyncIOMotorClient, AsyncIOMotorGridFSBucket
+import app as service
+
+# ASGI version of the /, /frames and /feedback endpoints, with the same request and response
+# contracts as the Flask app in app.py and the same pipeline underneath:
+#
+#   uvicorn asgi_app:app --host 0.0.0.0 --port 8080
+#
+# Request bodies are read on the event loop, so a slow upload holds no thread. Decoding and
+# inference run on a bounded pool of ASGI_WORKER_THREADS threads, and feedback is written
+# through the async Motor client.
+
+ASGI_WORKER_THREADS = max(1, int(os.environ.get('ASGI_WORKER_THREADS', 8)))
+# Most frame parts a multipart /frames request may hold
+MAX_FRAME_PARTS = int(os.environ.get('ASGI_MAX_FRAME_PARTS', 5000))
+
+logger = service.logger
+worker_limiter = anyio.CapacityLimiter(ASGI_WORKER_THREADS)
+
+app = FastAPI(title="Deepfake Detection API")
+app.add_middleware(
+    CORSMiddleware,
+    allow_origins=["*"],
+    allow_headers=["Content-Type", "X-Request-ID", "Cache-Control", "Pragma"],
+    allow_methods=["GET", "POST", "OPTIONS"],
+)
+
+# Motor client, created on first use inside the event loop
+mongo_client = None
+
+
+def get_async_db():
+    global mongo_client
+    if mongo_client is None:
+        mongo_client = AsyncIOMotorClient(service.MONGO_URI)
+    return mongo_client['deepfake_detector']
+
+
+async def run_blocking(fn, *args):
+    """Run fn on the bounded worker pool."""
+    return await anyio.to_thread.run_sync(fn, *args, limiter=worker_limiter)
+
+
+def json_response(content, status_code=200, headers=None):
+    """JSON encoded the way Flask's jsonify encodes it, so both apps send identical bodies."""
+    body = service.app.json.dumps(content, separators=(",", ":")) + "\n"
+    return Response(body, status_code=status_code, headers=headers, media_type="application/json")
+
+
+def saturated_response():
+    retry_after = service.admission_controller.retry_after()
+    return json_response({"error": "Server is busy, try again later", "retry_after": retry_after}, 429,
+                         headers={"Retry-After": str(retry_after)})
+
+
+def admit(source, frames):
+    """Admit a request's frames, returning (ticket, rejection response) like app.admit."""
+    admitted, ticket = service.acquire_admission(source, frames)
+    return ticket, (None if admitted else saturated_response())
+
+
+async def model_unavailable():
+    """Wait up to MODEL_READY_WAIT seconds for the model, returning a 503 response if it is not ready."""
+    deadline = time.monotonic() + service.MODEL_READY_WAIT
+    while not service.model_loaded.is_set() and time.monotonic() < deadline:
+        await asyncio.sleep(0.05)
+    if service.model_ready():
+        return None
+    return json_response({"error": "Model is not ready", "status": "failed" if service.model_load_error else "loading"},
+                         503, headers={"Retry-After": str(max(1, int(service.MODEL_READY_WAIT)))})
+
+
+@app.middleware("http")
+async def record_request(request: Request, call_next):
+    started = time.perf_counter()
+    service.log_first_request(request.method, request.url.path, started)
+    response = await call_next(request)
+    endpoint = getattr(request.scope.get("endpoint"), "__name__", "unknown")
+    service.request_latency.observe(time.perf_counter() - started, endpoint=endpoint)
+    service.requests_total.inc(endpoint=endpoint, status=response.status_code)
+    return response
+
+
+async def read_frames_request(request):
+    """Async counterpart of app.parse_frames_request, the body is fully read before any decoding.
+
+    Returns (metadata, frames, transport, frame part count).
+    """
+    content_type = request.headers.get("content-type", "").split(";")[0].strip().lower()
+    if content_type == "multipart/form-data":
+        form = await request.form(max_files=MAX_FRAME_PARTS)
+        metadata = json.loads(form.get("metadata") or "{}")
+        parts = [await part.read() for part in form.getlist("frames")]
+        return metadata, iter(parts), "multipart", len(parts)
+
+    if content_type in service.FRAME_STREAM_CONTENT_TYPES:
+        metadata, frames = service.parse_frame_stream(io.BytesIO(await request.body()))
+        return metadata, frames, "stream", 0
+
+    data = await request.json()
+    if not data:
+        return None, iter(()), "json", 0
+    return data, service.iter_base64_frames(data.get("frames", [])), "json", 0
+
+
+@app.get("/")
+async def index_page():
+    return HTMLResponse("Deepfake Detection API is running. Send a POST request with a video file to analyze.")
+
+
+@app.post("/")
+async def index(request: Request):
+    unavailable = await model_unavailable()
+    if unavailable is not None:
+        return unavailable
+
+    # Saturated servers answer before the upload is read
+    if service.admission_saturated():
+        return saturated_response()
+
+    form = await request.form()
+    file = form.get("file")
+    if file is None or isinstance(file, str) or not file.filename:
+        return json_response({"error": "No file uploaded"})
+
+    try:
+        sampler = service.FrameSampler.from_form(form)
+    except ValueError as e:
+        return json_response({"error": f"Invalid sampling options: {e}"})
+    try:
+        frames_response = service.frames_response_mode(form)
+    except ValueError as e:
+        return json_response({"error": f"Invalid frames option: {e}"})
+
+    temp_path = None
+    ticket = None
+    try:
+        with service.stage_latency.time(stage="upload"):
+            temp_path, video_digest = await run_blocking(service.spool_upload, file.file, file.filename)
+        early_exit = service.parse_flag(form.get('early_exit'), service.EARLY_EXIT_DEFAULT)
+
+        source = form.get('source') or (request.client.host if request.client else None) or 'unknown'
+        frames = await run_blocking(service.estimate_video_frames, temp_path, sampler)
+        ticket, rejection = admit(source, frames)
+        if rejection is not None:
+            return rejection
+        if ticket is not None and ticket.degraded:
+            sampler.limit(ticket.frames)
+
+        result = await run_blocking(service.analyze_video, temp_path, video_digest, file.filename, sampler, early_exit,
+                                    None, frames_response)
+        if ticket is not None and ticket.degraded:
+            result["admission"] = {"degraded": True, "frames_requested": ticket.requested,
+                                   "frames_admitted": ticket.frames}
+        return json_response(result)
+    except Exception as e:
+        service.failures.inc(stage="request")
+        logger.exception("Error processing request")
+        return json_response({"error": str(e)})
+    finally:
+        service.release_admission(ticket)
+        await file.close()
+        # Clean up the per-request temp file
+        service.remove_file(temp_path)
+
+
+@app.post("/frames")
+async def analyze_frames(request: Request):
+    request_id = request.headers.get('X-Request-ID', 'unknown')
+    start_time = time.time()
+
+    unavailable = await model_unavailable()
+    if unavailable is not None:
+        return unavailable
+
+    try:
+        # Saturated servers answer before reading the body
+        if service.admission_saturated():
+            return saturated_response()
+
+        try:
+            data, frame_payloads, transport, part_count = await read_frames_request(request)
+        except ValueError as e:
+            return json_response({"error": f"Invalid frames request: {e}"}, 400)
+        if not data:
+            logger.error(f"[{request_id}] No data provided")
+            return json_response({"error": "No data provided"})
+
+        expected_frames = service.declared_frame_count(data, transport, part_count)
+        ticket, rejection = admit(data.get('source', 'unknown'), expected_frames)
+        if rejection is not None:
+            return rejection
+        try:
+            frame_limit = ticket.frames if ticket is not None and ticket.degraded else None
+            result = await run_blocking(
+                lambda: service.analyze_frame_batch(data, frame_payloads, transport, request_id, start_time,
+                                                    frame_limit=frame_limit, expected_frames=expected_frames))
+            return json_response(result)
+        finally:
+            service.release_admission(ticket)
+    except Exception as e:
+        processing_time = time.time() - start_time
+        service.failures.inc(stage="request")
+        logger.exception(f"[{request_id}] Error in frames analysis: {e}")
+        return json_response({
+            "error": str(e),
+            "request_id": request_id,
+            "processing_time": f"{processing_time:.2f}s",
+            "status": "error"
+        })
+
+
+@app.get("/frames/{frame_id}")
+async def get_frame(request: Request, frame_id: str):
+    size = request.query_params.get("size")
+    try:
+        size = int(size) if size else None
+        db = get_async_db()
+        document = service.frame_writer.pending_document(frame_id) or await db.frames.find_one({"_id": frame_id})
+        if document is not None and document.get("gridfs_id") is not None:
+            try:
+                stream = await AsyncIOMotorGridFSBucket(db).open_download_stream(document["gridfs_id"])
+                jpeg = await stream.read()
+            except gridfs.errors.NoFile:
+                jpeg = None
+        else:
+            jpeg = service.stored_frame_bytes(document) if document is not None else None
+        if jpeg is not None and size:
+            jpeg = await run_blocking(
+                lambda: service.encode_thumbnail(service.decode_frame_payload(jpeg)[0], size=size, quality=80))
+    except Exception as e:
+        service.failures.inc(stage="frame_fetch")
+        logger.exception(f"Error fetching frame {frame_id}: {e}")
+        return json_response({"error": str(e)}, 500)
+    if jpeg is None:
+        return json_response({"error": "Unknown frame"}, 404)
+
+    etag = f'"{frame_id}-{size or "full"}"'
+    headers = {"Cache-Control": "public, max-age=31536000, immutable", "ETag": etag}
+    if request.headers.get("if-none-match") == etag:
+        return Response(status_code=304, headers=headers)
+    return Response(jpeg, media_type="image/jpeg", headers=headers)
+
+
+@app.post("/feedback")
+async def receive_feedback(request: Request):
+    try:
+        feedback_data = await request.json()
+        logger.info(f"Received feedback: {feedback_data}")
+
+        feedback_doc = service.feedback_document(feedback_data)
+        db = get_async_db()
+        feedback_id = (await db.feedbacks.insert_one(feedback_doc)).inserted_id
+
+        # Frames with feedback are kept for retraining
+        frame_ids = feedback_doc['frame_ids']
+        if service.frame_retention is not None and isinstance(frame_ids, list):
+            frame_ids = [frame_id for frame_id in frame_ids if isinstance(frame_id, str)]
+            try:
+                pinned, frame_ids = service.frame_retention.pin_pending(frame_ids)
+                if frame_ids:
+                    result = await db.frames.update_many(*service.frame_retention.pin_update(frame_ids))
+                    pinned += result.modified_count
+                service.frame_retention.record_pinned(pinned)
+            except Exception as e:
+                service.failures.inc(stage="frame_pin")
+                logger.warning(f"Could not pin the frames of feedback {feedback_id}: {e}")
+
+        if not feedback_doc['was_correct'] and feedback_doc['user_correction'] is not None:
+            logger.info(f"Stored feedback {feedback_id} with corrections for future training")
+
+        return json_response({'success': True, 'feedback_id': str(feedback_id)})
+    except Exception as e:
+        logger.exception(f"Error processing feedback: {e}")
+        return json_response({'success': False, 'error': str(e)}, 500)
+
+
+@app.get("/healthz")
+async def healthz():
+    if service.model_load_error is not None:
+        return json_response({"status": "failed", "error": service.model_load_error}, 500)
+    return json_response({"status": "ok"})
+
+
+@app.get("/readyz")
+async def readyz():
+    if not service.model_ready():
+        return json_response({"status": "failed" if service.model_load_error else "loading",
+                              "startup": service.startup_timings}, 503)
+    return json_response({"status": "ready", "model": os.path.basename(service.onnx_model_path),
+                          "startup": service.startup_timings})
+
+
+@app.get("/metrics")
+async def metrics_endpoint():
+    return Response(service.metrics_registry.render(), media_type="text/plain; version=0.0.4")
@@ -0,0 +1,256 @@
+import os
+import io
+import sys
+import json
+import time
+import base64
+import argparse
+import platform
+import statistics
+import subprocess
+from datetime import datetime
+import numpy as np
+import cv2
+import onnxruntime as ort
+import offline_env
+
+# Stage-level benchmark of the detection pipeline. Runs offline against the bundled sample
+# videos with the stub model and the in-memory database from offline_env, and saves the
+# timings as JSON so runs from different commits can be compared:
+#
+#   python benchmark.py --output before.json
+#   python benchmark.py --compare before.json --tolerance 0.2
+
+BATCH_SIZES = [1, 8, 32, 64]
+
+
+def median_time(fn, repeat):
+    """Run fn repeat times after one warm-up run and return the median wall time in seconds."""
+    fn()
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        timings.append(time.perf_counter() - start)
+    return statistics.median(timings)
+
+
+def stage_result(seconds, items, unit="frame"):
+    return {
+        "median_ms": round(seconds * 1000, 4),
+        "items": items,
+        "unit": unit,
+        "ms_per_item": round(seconds * 1000 / items, 4),
+        "items_per_second": round(items / seconds, 2) if seconds else None,
+    }
+
+
+def read_frames(video_path, max_frames):
+    cap = cv2.VideoCapture(video_path)
+    frames = []
+    try:
+        while max_frames is None or len(frames) < max_frames:
+            ret, frame = cap.read()
+            if not ret:
+                break
+            frames.append(frame)
+    finally:
+        cap.release()
+    return frames
+
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              cwd=offline_env.BASE_DIR, check=True).stdout.strip()
+    except Exception:
+        return None
+
+
+def run_benchmarks(app, videos, max_frames, repeat, batch_sizes, endpoints):
+    stages = {}
+
+    for video_path in videos:
+        name = os.path.splitext(os.path.basename(video_path))[0]
+        frame_count = len(read_frames(video_path, max_frames))
+        stages[f"video_decode.{name}"] = stage_result(
+            median_time(lambda: read_frames(video_path, max_frames), repeat), frame_count)
+
+    frames = [frame for video_path in videos for frame in read_frames(video_path, max_frames)]
+    jpegs = [app.encode_frame(frame) for frame in frames]
+    data_uris = ["data:image/jpeg;base64," + base64.b64encode(jpeg).decode("utf-8") for jpeg in jpegs]
+    print(f"Benchmarking with {len(frames)} frames from {len(videos)} videos")
+
+    stages["base64_decode"] = stage_result(
+        median_time(lambda: list(app.iter_base64_frames(data_uris)), repeat), len(frames))
+    stages["jpeg_decode"] = stage_result(
+        median_time(lambda: [app.decode_frame_payload(jpeg) for jpeg in jpegs], repeat), len(frames))
+    stages["preprocess_frame"] = stage_result(
+        median_time(lambda: [app.preprocess_frame(frame) for frame in frames], repeat), len(frames))
+
+    def preprocess_batches():
+        for start in range(0, len(frames), app.INFERENCE_BATCH_SIZE):
+            app.preprocess_frames(frames[start:start + app.INFERENCE_BATCH_SIZE])
+    stages["preprocess_batch"] = stage_result(median_time(preprocess_batches, repeat), len(frames))
+
+    # Each batch size runs on its own tensor so the timing covers inference only
+    for batch_size in batch_sizes:
+        tensor = app.preprocess_frames((frames * (batch_size // len(frames) + 1))[:batch_size]).copy()
+        app.inference_batch_size = batch_size
+        stages[f"inference.batch_{batch_size}"] = stage_result(
+            median_time(lambda: app.run_model(tensor), repeat), batch_size)
+    app.inference_batch_size = app.INFERENCE_BATCH_SIZE
+
+    predictions = [float(p) for p in np.random.default_rng(0).random(len(frames))]
+    stages["aggregate_predictions"] = stage_result(
+        median_time(lambda: app.aggregate_predictions(predictions), repeat), len(predictions))
+
+    # store_frame only queues the document, the writer drain covers the database insert
+    def store_frames():
+        app.recent_frame_hashes.clear()
+        for jpeg, prediction in zip(jpegs, predictions):
+            app.store_frame(jpeg, prediction)
+    stages["store_frame.enqueue"] = stage_result(median_time(store_frames, repeat), len(frames))
+
+    def store_and_drain():
+        app.db.frames.delete_many({})
+        store_frames()
+        app.frame_writer.shutdown()
+        app.frame_writer.start()
+    stages["store_frame.drain"] = stage_result(median_time(store_and_drain, repeat), len(frames))
+
+    if endpoints:
+        client = app.app.test_client()
+        payload = {"frames": data_uris, "batch_info": "benchmark", "dedup": False}
+        stages["endpoint.frames"] = stage_result(
+            median_time(lambda: client.post("/frames", json=payload), repeat), len(frames))
+        for video_path in videos:
+            name = os.path.splitext(os.path.basename(video_path))[0]
+            with open(video_path, "rb") as f:
+                video_bytes = f.read()
+            post_video = lambda: client.post("/", data={"file": (io.BytesIO(video_bytes), os.path.basename(video_path))})
+            stages[f"endpoint.video.{name}"] = stage_result(median_time(post_video, repeat), 1, unit="request")
+
+    return stages
+
+
+def stored_per_request(app, post):
+    """Frame documents and JPEG bytes that one request writes to the frames collection."""
+    # Earlier requests' frames are drained first, so they are not counted
+    app.frame_writer.shutdown()
+    app.frame_writer.start()
+    app.db.frames.delete_many({})
+    app.recent_frame_hashes.clear()
+    post()
+    app.frame_writer.shutdown()
+    app.frame_writer.start()
+    documents = list(app.db.frames.find({}))
+    return {"frames": len(documents), "bytes": sum(document.get("size", 0) for document in documents)}
+
+
+def storage_report(app, videos, frames_payload):
+    """Stored frames and bytes per request, storing every kept frame and with the retention policy."""
+    client = app.app.test_client()
+    requests = {"frames": lambda: client.post("/frames", json=frames_payload)}
+    for video_path in videos:
+        with open(video_path, "rb") as f:
+            video_bytes = f.read()
+        name = os.path.splitext(os.path.basename(video_path))[0]
+        requests[f"video.{name}"] = lambda video_bytes=video_bytes, filename=os.path.basename(video_path): client.post(
+            "/", data={"file": (io.BytesIO(video_bytes), filename)})
+
+    retention = app.frame_retention
+    report = {}
+    try:
+        for policy_name, policy in (("keep_all", None), ("retention", retention or app.FrameRetention(app.get_db))):
+            app.frame_retention = policy
+            report[policy_name] = {name: stored_per_request(app, post) for name, post in requests.items()}
+    finally:
+        app.frame_retention = retention
+    return report
+
+
+def compare(stages, baseline_path, tolerance):
+    """Print the change per stage against a saved run and return the stages slower than tolerance allows."""
+    with open(baseline_path) as f:
+        baseline = json.load(f)
+    regressions = []
+    print(f"\nComparison with {baseline_path} (commit {baseline['metadata'].get('git_commit')}):")
+    print(f"{'Stage':<28} {'Baseline':>12} {'Current':>12} {'Change':>9}")
+    for name, result in stages.items():
+        previous = baseline["stages"].get(name)
+        if previous is None:
+            print(f"{name:<28} {'-':>12} {result['ms_per_item']:>12.4f}")
+            continue
+        change = result["ms_per_item"] / previous["ms_per_item"] - 1 if previous["ms_per_item"] else 0.0
+        flag = "  REGRESSION" if change > tolerance else ""
+        print(f"{name:<28} {previous['ms_per_item']:>12.4f} {result['ms_per_item']:>12.4f} {change:>+8.1%}{flag}")
+        if change > tolerance:
+            regressions.append(name)
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Stage-level benchmark of the deepfake detection pipeline")
+    parser.add_argument("--videos", nargs="+", default=offline_env.SAMPLE_VIDEOS)
+    parser.add_argument("--max-frames", type=int, default=64, help="Frames read from each video")
+    parser.add_argument("--repeat", type=int, default=5, help="Timed runs per stage, the median is reported")
+    parser.add_argument("--batch-sizes", nargs="+", type=int, default=BATCH_SIZES)
+    parser.add_argument("--model", default=offline_env.STUB_MODEL_PATH, help="ONNX model to benchmark")
+    parser.add_argument("--mongo-latency-ms", type=float, default=0.0, help="Simulated round trip per database call")
+    parser.add_argument("--no-endpoints", action="store_true", help="Skip the end-to-end / and /frames runs")
+    parser.add_argument("--output", default="benchmark_results.json")
+    parser.add_argument("--compare", help="Saved results to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="Allowed slowdown per stage, 0.2 = 20%%")
+    args = parser.parse_args(argv)
+
+    app = offline_env.load_app(model_path=args.model, mongo_latency=args.mongo_latency_ms / 1000)
+    stages = run_benchmarks(app, args.videos, args.max_frames, args.repeat, args.batch_sizes, not args.no_endpoints)
+    storage = None
+    if not args.no_endpoints:
+        frames = [frame for video_path in args.videos for frame in read_frames(video_path, args.max_frames)]
+        data_uris = ["data:image/jpeg;base64," + base64.b64encode(app.encode_frame(frame)).decode("utf-8")
+                     for frame in frames]
+        storage = storage_report(app, args.videos, {"frames": data_uris, "batch_info": "benchmark", "dedup": False})
+
+    results = {
+        "metadata": {
+            "timestamp": datetime.now().isoformat(),
+            "git_commit": git_commit(),
+            "model": os.path.basename(args.model),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+            "numpy": np.__version__,
+            "opencv": cv2.__version__,
+            "onnxruntime": ort.__version__,
+            "session_profile": app.session_profile,
+            "repeat": args.repeat,
+            "max_frames": args.max_frames,
+        },
+        "stages": stages,
+        "storage": storage,
+    }
+    with open(args.output, "w") as f:
+        json.dump(results, f, indent=2)
+
+    print(f"\n{'Stage':<28} {'Median ms':>12} {'ms/item':>10} {'items/s':>10}")
+    for name, result in stages.items():
+        print(f"{name:<28} {result['median_ms']:>12.3f} {result['ms_per_item']:>10.4f} {result['items_per_second'] or 0:>10.1f}")
+    if storage:
+        print(f"\n{'Stored per request':<28} {'Keep all':>16} {'Retention':>16}")
+        for name, before in storage["keep_all"].items():
+            after = storage["retention"][name]
+            print(f"{name:<28} {before['frames']:>5} / {before['bytes'] / 1024:>6.0f} KB {after['frames']:>5} / {after['bytes'] / 1024:>6.0f} KB")
+    print(f"\nResults saved to {args.output}")
+
+    if args.compare:
+        regressions = compare(stages, args.compare, args.tolerance)
+        if regressions:
+            print(f"\n{len(regressions)} stage(s) slower than the {args.tolerance:.0%} tolerance: {', '.join(regressions)}")
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
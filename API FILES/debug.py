@@ -3,6 +3,7 @@ import io
 import numpy as np
 import cv2
 import onnxruntime as ort
+from preprocessing import preprocess_frame
 from flask import Flask, request, jsonify
 import logging
 
@@ -20,13 +21,6 @@ ort_session = ort.InferenceSession(onnx_model_path)
 
 app = Flask(__name__)
 
-def preprocess_frame(frame):
-    """Preprocess a single frame for model inference."""
-    frame = cv2.resize(frame, (224, 224))  # Resizing to match model input
-    frame = frame.transpose(2, 0, 1)  
-    frame = frame.astype(np.float32) / 255.0  # Normalizing the images
-    return np.expand_dims(frame, axis=0)
-
 def detect_deepfake(video_bytes, filename="unknown"):
     """Process a video and detect deepfake frames."""
     logger.info(f"Processing video: {filename}")
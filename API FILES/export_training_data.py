@@ -0,0 +1,374 @@
+import os
+import sys
+import json
+import base64
+import time
+import argparse
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timedelta, timezone
+import numpy as np
+import cv2
+import gridfs
+import pymongo
+from bson import ObjectId
+from preprocessing import INPUT_SIZE
+
+# Exports the frames users gave feedback on as a training set. The feedbacks are joined to
+# their frames inside Mongo and streamed through a batched cursor, the JPEGs are decoded and
+# resized in a process pool, and the pixels are written to fixed-size memory-mapped .npy
+# shards that training code can np.load(..., mmap_mode="r") without decoding anything:
+#
+#   python export_training_data.py --output training_data
+#
+# index.json in the output directory lists the shards and holds the watermark, so the next
+# run only exports feedback received since. Labels follow the training notebooks: 0 = fake,
+# 1 = real. Pixels are in the order the API feeds the model (BGR by default).
+
+INDEX_FILE = "index.json"
+LABELS = {"fake": 0, "real": 1}
+
+
+def feedback_label(row, flip_incorrect=False):
+    """Label of a joined feedback row, or None when the feedback does not say what the video was."""
+    correction = row.get("user_correction")
+    if isinstance(correction, str):
+        correction = correction.strip().lower()
+        deepfake = {"fake": True, "deepfake": True, "true": True, "real": False, "false": False}.get(correction)
+    elif isinstance(correction, bool):
+        deepfake = correction
+    elif row.get("was_correct", True):
+        deepfake = bool(row.get("prediction"))
+    elif flip_incorrect:
+        deepfake = not row.get("prediction")
+    else:
+        deepfake = None
+    if deepfake is None:
+        return None
+    return LABELS["fake"] if deepfake else LABELS["real"]
+
+
+def export_pipeline(after, until, flip_incorrect=False):
+    """Aggregation joining feedbacks received between the two ObjectIds to their frames, one row per frame."""
+    match = {"_id": {"$gt": after, "$lte": until}, "frame_ids.0": {"$exists": True}}
+    if not flip_incorrect:
+        # Without a verdict or a correction there is no label
+        match["$or"] = [{"was_correct": True}, {"user_correction": {"$ne": None}}]
+    return [
+        {"$match": match},
+        {"$sort": {"_id": 1}},
+        {"$unwind": "$frame_ids"},
+        {"$lookup": {"from": "frames", "localField": "frame_ids", "foreignField": "_id", "as": "frame"}},
+        {"$unwind": "$frame"},
+        {"$project": {
+            "_id": 0,
+            "feedback_id": "$_id",
+            "frame_id": "$frame._id",
+            "data": "$frame.data",
+            "gridfs_id": "$frame.gridfs_id",
+            "prediction": 1,
+            "was_correct": 1,
+            "user_correction": 1,
+        }},
+    ]
+
+
+def frame_bytes(row, fs):
+    """JPEG bytes of a joined row, embedded, in GridFS or (older frames) base64."""
+    if row.get("gridfs_id") is not None:
+        try:
+            return fs.get(row["gridfs_id"]).read()
+        except gridfs.errors.NoFile:
+            return None
+    data = row.get("data")
+    if data is None:
+        return None
+    if isinstance(data, str):
+        return base64.b64decode(data)
+    return bytes(data)
+
+
+# JPEG start-of-frame markers, the ones that carry the image size
+JPEG_SOF_MARKERS = frozenset(range(0xC0, 0xD0)) - {0xC4, 0xC8, 0xCC}
+# Scales the JPEG decoder can reduce by while decoding, largest first
+REDUCED_DECODE_FLAGS = ((8, cv2.IMREAD_REDUCED_COLOR_8), (4, cv2.IMREAD_REDUCED_COLOR_4),
+                        (2, cv2.IMREAD_REDUCED_COLOR_2))
+
+
+def jpeg_dimensions(payload):
+    """(width, height) from a JPEG's start-of-frame header, or None if it is not a readable JPEG."""
+    if payload[:2] != b"\xff\xd8":
+        return None
+    position = 2
+    while position + 4 <= len(payload):
+        if payload[position] != 0xFF:
+            return None
+        marker = payload[position + 1]
+        if marker == 0xFF:
+            position += 1
+            continue
+        if marker == 0x01 or 0xD0 <= marker <= 0xD9:
+            position += 2
+            continue
+        length = int.from_bytes(payload[position + 2:position + 4], "big")
+        if marker in JPEG_SOF_MARKERS:
+            if position + 9 > len(payload):
+                return None
+            height = int.from_bytes(payload[position + 5:position + 7], "big")
+            width = int.from_bytes(payload[position + 7:position + 9], "big")
+            return width, height
+        position += 2 + length
+    return None
+
+
+def decode_flag(payload, size):
+    """imdecode flag that decodes the JPEG at the largest reduction still at least size on its short side."""
+    dimensions = jpeg_dimensions(payload)
+    if dimensions is None:
+        return cv2.IMREAD_COLOR
+    short_side = min(dimensions)
+    for scale, flag in REDUCED_DECODE_FLAGS:
+        if -(-short_side // scale) >= size:
+            return flag
+    return cv2.IMREAD_COLOR
+
+
+def decode_frames(payloads, size, rgb=False):
+    """Decode and resize JPEGs into a (n, size, size, 3) uint8 array, runs in the worker processes.
+
+    Returns the array and a mask of the payloads that decoded.
+    """
+    images = np.zeros((len(payloads), size, size, 3), dtype=np.uint8)
+    ok = np.zeros(len(payloads), dtype=bool)
+    for i, payload in enumerate(payloads):
+        buffer = np.frombuffer(payload, dtype=np.uint8)
+        # Frames at least twice the target size are reduced inside the JPEG decoder, which is
+        # much faster and within a grey level of decoding in full and downscaling. The header
+        # says how far each frame can be reduced, so none is decoded twice
+        frame = cv2.imdecode(buffer, decode_flag(payload, size))
+        if frame is None:
+            continue
+        cv2.resize(frame, (size, size), dst=images[i], interpolation=cv2.INTER_AREA)
+        if rgb:
+            cv2.cvtColor(images[i], cv2.COLOR_BGR2RGB, dst=images[i])
+        ok[i] = True
+    return images, ok
+
+
+class ShardWriter:
+    """Writes images, labels and frame IDs into numbered .npy shards of shard_size frames.
+
+    The images go straight into a memory-mapped file, a shard that ends short is copied
+    into a file of its exact size when it is closed.
+    """
+
+    def __init__(self, output_dir, first_shard, shard_size, frame_size):
+        self.output_dir = output_dir
+        self.next_shard = first_shard
+        self.shard_size = shard_size
+        self.frame_size = frame_size
+        self.shards = []
+        self.images = None
+
+    def _path(self, shard, kind):
+        return os.path.join(self.output_dir, f"shard-{shard:05d}-{kind}.npy")
+
+    def _open(self):
+        shape = (self.shard_size, self.frame_size, self.frame_size, 3)
+        self.images = np.lib.format.open_memmap(self._path(self.next_shard, "images"), mode="w+",
+                                                dtype=np.uint8, shape=shape)
+        self.labels = np.empty(self.shard_size, dtype=np.uint8)
+        self.frame_ids = []
+        self.count = 0
+
+    def add(self, images, labels, frame_ids):
+        start = 0
+        while start < len(images):
+            if self.images is None:
+                self._open()
+            take = min(len(images) - start, self.shard_size - self.count)
+            self.images[self.count:self.count + take] = images[start:start + take]
+            self.labels[self.count:self.count + take] = labels[start:start + take]
+            self.frame_ids.extend(frame_ids[start:start + take])
+            self.count += take
+            start += take
+            if self.count == self.shard_size:
+                self._close_shard()
+
+    def _close_shard(self):
+        shard, count = self.next_shard, self.count
+        images_path = self._path(shard, "images")
+        self.images.flush()
+        if count < self.shard_size:
+            trimmed = np.lib.format.open_memmap(images_path + ".tmp", mode="w+", dtype=np.uint8,
+                                                shape=(count,) + self.images.shape[1:])
+            trimmed[:] = self.images[:count]
+            trimmed.flush()
+            del trimmed
+            os.replace(images_path + ".tmp", images_path)
+        self.images = None
+
+        np.save(self._path(shard, "labels"), self.labels[:count])
+        np.save(self._path(shard, "frame_ids"), np.array(self.frame_ids, dtype="U64"))
+        self.shards.append({
+            "shard": shard,
+            "frames": count,
+            "images": os.path.basename(images_path),
+            "labels": os.path.basename(self._path(shard, "labels")),
+            "frame_ids": os.path.basename(self._path(shard, "frame_ids")),
+            "label_counts": {name: int(np.count_nonzero(self.labels[:count] == value))
+                             for name, value in LABELS.items()},
+        })
+        self.next_shard += 1
+
+    def close(self):
+        if self.images is not None and self.count:
+            self._close_shard()
+        return self.shards
+
+
+def load_index(output_dir):
+    path = os.path.join(output_dir, INDEX_FILE)
+    if not os.path.exists(path):
+        return {"frame_size": None, "channel_order": None, "labels": LABELS, "watermark": None,
+                "frames": 0, "shards": [], "runs": []}
+    with open(path) as f:
+        return json.load(f)
+
+
+def save_index(output_dir, index):
+    """Write the index atomically, it is the commit point of a run."""
+    path = os.path.join(output_dir, INDEX_FILE)
+    with open(path + ".tmp", "w") as f:
+        json.dump(index, f, indent=2)
+    os.replace(path + ".tmp", path)
+
+
+def joined_chunks(cursor, db, chunk_size, flip_incorrect, stats):
+    """Group the joined rows into chunks of (payloads, labels, frame IDs), dropping unusable rows."""
+    fs = None
+    seen = set()
+    payloads, labels, frame_ids = [], [], []
+    for row in cursor:
+        stats["rows"] += 1
+        stats["feedbacks"].add(row["feedback_id"])
+        frame_id = str(row["frame_id"])
+        label = feedback_label(row, flip_incorrect)
+        # A frame several users gave feedback on is exported once per run
+        if label is None or frame_id in seen:
+            stats["skipped"] += 1
+            continue
+        if fs is None and row.get("gridfs_id") is not None:
+            fs = gridfs.GridFS(db)
+        payload = frame_bytes(row, fs)
+        if payload is None:
+            stats["missing"] += 1
+            continue
+        seen.add(frame_id)
+        payloads.append(payload)
+        labels.append(label)
+        frame_ids.append(frame_id)
+        if len(payloads) >= chunk_size:
+            yield payloads, labels, frame_ids
+            payloads, labels, frame_ids = [], [], []
+    if payloads:
+        yield payloads, labels, frame_ids
+
+
+def export(db, output_dir, shard_size=2048, frame_size=INPUT_SIZE, rgb=False, workers=None, chunk_size=64,
+           batch_size=256, settle_seconds=60, flip_incorrect=False, full=False):
+    """Export the feedback received since the last run into new shards and return the run summary."""
+    started = time.perf_counter()
+    os.makedirs(output_dir, exist_ok=True)
+    index = load_index(output_dir)
+    channel_order = "RGB" if rgb else "BGR"
+    if full or not index["shards"]:
+        index.update(frame_size=frame_size, channel_order=channel_order, watermark=None, frames=0, shards=[], runs=[])
+    elif (index["frame_size"], index["channel_order"]) != (frame_size, channel_order):
+        raise ValueError(f"{output_dir} holds {index['frame_size']}px {index['channel_order']} shards, "
+                         f"export with the same settings or use --full")
+
+    # Feedback from the last settle_seconds is left for the next run, so feedback inserted
+    # slightly out of ObjectId order, and frames still in the API's write queue, are not missed
+    after = ObjectId(index["watermark"]) if index["watermark"] else ObjectId("0" * 24)
+    until = ObjectId.from_datetime(datetime.now(timezone.utc) - timedelta(seconds=settle_seconds))
+    if until <= after:
+        until = after
+
+    cursor = db.feedbacks.aggregate(export_pipeline(after, until, flip_incorrect),
+                                    allowDiskUse=True, batchSize=batch_size)
+    stats = {"rows": 0, "feedbacks": set(), "skipped": 0, "missing": 0, "undecodable": 0}
+    first_shard = max((shard["shard"] for shard in index["shards"]), default=-1) + 1
+    writer = ShardWriter(output_dir, first_shard, shard_size, frame_size)
+    workers = workers or os.cpu_count() or 1
+
+    def write(job):
+        future, labels, frame_ids = job
+        images, ok = future.result()
+        stats["undecodable"] += int(len(ok) - ok.sum())
+        writer.add(images[ok], np.asarray(labels, dtype=np.uint8)[ok], [fid for fid, good in zip(frame_ids, ok) if good])
+
+    # The cursor and GridFS reads stay in this process, a bounded number of chunks are decoding at once
+    in_flight = deque()
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        for payloads, labels, frame_ids in joined_chunks(cursor, db, chunk_size, flip_incorrect, stats):
+            in_flight.append((pool.submit(decode_frames, payloads, frame_size, rgb), labels, frame_ids))
+            if len(in_flight) >= workers * 2:
+                write(in_flight.popleft())
+        while in_flight:
+            write(in_flight.popleft())
+    shards = writer.close()
+
+    exported = sum(shard["frames"] for shard in shards)
+    run = {
+        "timestamp": datetime.now().isoformat(),
+        "after": str(after),
+        "until": str(until),
+        "until_time": until.generation_time.isoformat(),
+        "feedbacks": len(stats["feedbacks"]),
+        "rows": stats["rows"],
+        "frames": exported,
+        "skipped": stats["skipped"],
+        "missing": stats["missing"],
+        "undecodable": stats["undecodable"],
+        "shards": [shard["shard"] for shard in shards],
+        "seconds": round(time.perf_counter() - started, 3),
+    }
+    index["shards"].extend(shards)
+    index["frames"] += exported
+    index["watermark"] = str(until)
+    index["runs"].append(run)
+    save_index(output_dir, index)
+    return run
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Export feedback frames into memory-mapped training shards")
+    parser.add_argument("--output", default="training_data", help="Directory for the shards and index.json")
+    parser.add_argument("--mongo-uri", default=os.environ.get("MONGO_URI"))
+    parser.add_argument("--database", default="deepfake_detector")
+    parser.add_argument("--shard-size", type=int, default=2048, help="Frames per shard")
+    parser.add_argument("--frame-size", type=int, default=INPUT_SIZE, help="Width and height of the exported frames")
+    parser.add_argument("--rgb", action="store_true", help="Write RGB pixels instead of the API's BGR order")
+    parser.add_argument("--workers", type=int, default=None, help="Decoding processes, defaults to the CPU count")
+    parser.add_argument("--chunk-size", type=int, default=64, help="Frames sent to a decoding process at a time")
+    parser.add_argument("--batch-size", type=int, default=256, help="Cursor batch size")
+    parser.add_argument("--settle-seconds", type=float, default=60,
+                        help="Leave feedback younger than this for the next run")
+    parser.add_argument("--flip-incorrect", action="store_true",
+                        help="Label frames of 'incorrect' feedback without a correction as the opposite of the prediction")
+    parser.add_argument("--full", action="store_true", help="Ignore the watermark and re-export everything")
+    args = parser.parse_args(argv)
+
+    db = pymongo.MongoClient(args.mongo_uri)[args.database]
+    run = export(db, args.output, shard_size=args.shard_size, frame_size=args.frame_size, rgb=args.rgb,
+                 workers=args.workers, chunk_size=args.chunk_size, batch_size=args.batch_size,
+                 settle_seconds=args.settle_seconds, flip_incorrect=args.flip_incorrect, full=args.full)
+    print(f"Exported {run['frames']} frames from {run['feedbacks']} feedbacks into {len(run['shards'])} shard(s) "
+          f"in {run['seconds']:.1f}s ({run['skipped']} skipped, {run['missing']} missing, "
+          f"{run['undecodable']} undecodable), watermark {run['until_time']}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
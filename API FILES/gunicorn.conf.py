@@ -0,0 +1,61 @@
+import os
+import math
+
+# Gunicorn settings for the API, picked up from the working directory by `gunicorn app:app`.
+#
+# The master imports the app once (preload_app) and forks one worker per CPU, so the
+# GIL-bound parts of a request (base64 and JPEG decoding, aggregation, JSON) run in parallel.
+# Each worker builds its own ONNX Runtime session in post_fork; the weights are memory-mapped
+# from the optimized model cache and shared by all workers.
+#
+# Gunicorn spreads requests over the workers, so with more than one the job and session
+# state is kept in Mongo (JOBS_MONGO, SESSIONS_MONGO), letting any worker answer
+# GET /jobs/<id> and add up the batches of a session.
+#
+# Overrides: GUNICORN_WORKERS (or WEB_CONCURRENCY), GUNICORN_THREADS, ORT_INTRA_OP_THREADS,
+# MODEL_SHARED_WEIGHTS, JOBS_MONGO, SESSIONS_MONGO.
+
+
+def available_cpus():
+    """CPUs this container may use, from the affinity mask and the cgroup CPU quota."""
+    cpus = len(os.sched_getaffinity(0)) if hasattr(os, "sched_getaffinity") else (os.cpu_count() or 1)
+    quota_files = [("/sys/fs/cgroup/cpu.max", None),
+                   ("/sys/fs/cgroup/cpu/cpu.cfs_quota_us", "/sys/fs/cgroup/cpu/cpu.cfs_period_us")]
+    for quota_path, period_path in quota_files:
+        try:
+            with open(quota_path) as f:
+                values = f.read().split()
+            if period_path:
+                with open(period_path) as f:
+                    values.append(f.read().strip())
+            quota, period = values[0], values[1]
+            if quota not in ("max", "-1"):
+                cpus = min(cpus, max(1, math.ceil(int(quota) / int(period))))
+            break
+        except (OSError, ValueError, IndexError):
+            continue
+    return max(1, cpus)
+
+
+cpus = available_cpus()
+workers = int(os.environ.get("GUNICORN_WORKERS") or os.environ.get("WEB_CONCURRENCY") or cpus)
+# Request threads mostly wait on uploads, the inference scheduler and Mongo
+threads = int(os.environ.get("GUNICORN_THREADS", 4))
+
+# The cores are split between the workers' ONNX Runtime sessions
+os.environ.setdefault("ORT_INTRA_OP_THREADS", str(max(1, cpus // workers)))
+os.environ.setdefault("MODEL_SHARED_WEIGHTS", "1" if workers > 1 else "0")
+# In-memory jobs and sessions would only be visible to the worker that created them
+os.environ.setdefault("JOBS_MONGO", "1" if workers > 1 else "0")
+os.environ.setdefault("SESSIONS_MONGO", "1" if workers > 1 else "0")
+os.environ["APP_PRELOAD"] = "1"
+
+bind = f":{os.environ.get('PORT', 8080)}"
+preload_app = True
+timeout = 0
+
+
+def post_fork(server, worker):
+    import app
+    app.start_worker()
+    server.log.info(f"Worker {worker.pid} started with {os.environ['ORT_INTRA_OP_THREADS']} inference threads")
@@ -0,0 +1,386 @@
+import os
+import sys
+import json
+import time
+import math
+import base64
+import random
+import argparse
+import threading
+from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+import cv2
+import offline_env
+
+# Load generator that replays extension traffic against the API. A "capture" is what the
+# extension sends for one analyzed video: its frames split into /frames batches the way
+# background.js does it, sent one after another with X-Request-ID headers. Some captures
+# can be sent as / video uploads instead (--video-ratio).
+#
+# By default the app runs in-process with the stub model and the in-memory database from
+# offline_env. --url drives a running server instead, with --server-pid to track its memory.
+#
+#   python loadtest.py --concurrency 1 2 4 8 --duration 30
+#   python loadtest.py --url http://127.0.0.1:8081 --rate 2 --concurrency 16
+
+# Same batching rules as background.js
+BATCH_THRESHOLD = 100
+MAX_FRAMES_PER_BATCH = 200
+EXTENSION_JPEG_QUALITY = 85
+
+
+def split_batches(frame_count):
+    """Return the (start, end) frame ranges the extension sends for a capture of frame_count frames."""
+    if frame_count <= BATCH_THRESHOLD:
+        return [(0, frame_count)]
+    batch_size = min(MAX_FRAMES_PER_BATCH, math.ceil(frame_count / 3))
+    return [(start, min(start + batch_size, frame_count)) for start in range(0, frame_count, batch_size)]
+
+
+def build_captures(videos, frames_per_capture, pool_size, seed=0):
+    """Build a pool of extension-style captures from the sample videos.
+
+    Each capture starts at a different offset and has one marker pixel changed, so no
+    two captures share frame hashes and the verdict cache and frame dedup only see
+    repeats within a capture, as with real traffic.
+    """
+    rng = random.Random(seed)
+    video_frames = []
+    for video_path in videos:
+        cap = cv2.VideoCapture(video_path)
+        frames = []
+        while True:
+            ret, frame = cap.read()
+            if not ret:
+                break
+            frames.append(frame)
+        cap.release()
+        video_frames.append((video_path, frames))
+
+    captures = []
+    for n in range(pool_size):
+        video_path, frames = video_frames[n % len(video_frames)]
+        offset = rng.randrange(len(frames))
+        height, width = frames[0].shape[:2]
+        data_uris = []
+        for i in range(frames_per_capture):
+            frame = frames[(offset + i) % len(frames)].copy()
+            frame[0, 0] = (n % 256, n // 256 % 256, i % 256)
+            ok, buffer = cv2.imencode('.jpg', frame, [int(cv2.IMWRITE_JPEG_QUALITY), EXTENSION_JPEG_QUALITY])
+            data_uris.append("data:image/jpeg;base64," + base64.b64encode(buffer).decode('utf-8'))
+
+        capture_id = f"loadtest-{n}"
+        base_request = {
+            "id": capture_id,
+            "timestamp": datetime.now().isoformat(),
+            "dimensions": f"{width}x{height}",
+            "frameCount": frames_per_capture,
+            "source": "loadtest",
+            "version": "1.2",
+            "facial_data": 0,
+        }
+        batches = split_batches(frames_per_capture)
+        requests_data = []
+        for batch_num, (start, end) in enumerate(batches, 1):
+            request_data = dict(base_request, frames=data_uris[start:end])
+            if len(batches) > 1:
+                request_data.update(batch=batch_num, totalBatches=len(batches))
+                request_id = f"{capture_id}-batch-{batch_num}"
+            else:
+                request_id = capture_id
+            # Serialized once up front so the client side costs as little as possible
+            requests_data.append((request_id, json.dumps(request_data).encode('utf-8'), end - start))
+
+        with open(video_path, 'rb') as f:
+            video_bytes = f.read()
+        captures.append({"batches": requests_data, "video": (os.path.basename(video_path), video_bytes)})
+    return captures
+
+
+class InProcessTarget:
+    """Sends requests through the Flask test client of an in-process app."""
+
+    def __init__(self, app_module):
+        self.app = app_module.app
+        self.local = threading.local()
+
+    def _client(self):
+        if not hasattr(self.local, 'client'):
+            self.local.client = self.app.test_client()
+        return self.local.client
+
+    def post_frames(self, request_id, body):
+        response = self._client().post('/frames', data=body, content_type='application/json',
+                                       headers={'X-Request-ID': request_id})
+        return response.status_code, response.get_json(silent=True)
+
+    def post_video(self, filename, video_bytes):
+        import io
+        response = self._client().post('/', data={'file': (io.BytesIO(video_bytes), filename)})
+        return response.status_code, response.get_json(silent=True)
+
+
+class HttpTarget:
+    """Sends requests to a running server over HTTP."""
+
+    def __init__(self, url, timeout=120):
+        import requests
+        self.url = url.rstrip('/')
+        self.timeout = timeout
+        self.sessions = threading.local()
+        self.requests = requests
+
+    def _session(self):
+        if not hasattr(self.sessions, 'session'):
+            self.sessions.session = self.requests.Session()
+        return self.sessions.session
+
+    def post_frames(self, request_id, body):
+        response = self._session().post(f"{self.url}/frames", data=body, timeout=self.timeout,
+                                        headers={'Content-Type': 'application/json', 'X-Request-ID': request_id})
+        try:
+            return response.status_code, response.json()
+        except ValueError:
+            return response.status_code, None
+
+    def post_video(self, filename, video_bytes):
+        response = self._session().post(f"{self.url}/", files={'file': (filename, video_bytes)}, timeout=self.timeout)
+        try:
+            return response.status_code, response.json()
+        except ValueError:
+            return response.status_code, None
+
+
+class MemorySampler:
+    """Samples the resident set size of a process in the background and keeps the high-water mark."""
+
+    def __init__(self, pid=None, interval=0.05):
+        self.path = f"/proc/{pid or 'self'}/status"
+        self.interval = interval
+        self.peak_kb = 0
+        self.stop_event = threading.Event()
+        self.thread = None
+
+    def _rss_kb(self):
+        try:
+            with open(self.path) as f:
+                for line in f:
+                    if line.startswith('VmRSS:'):
+                        return int(line.split()[1])
+        except OSError:
+            pass
+        # Without /proc the process-wide peak is the best available
+        import resource
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+    def _loop(self):
+        while not self.stop_event.wait(self.interval):
+            self.peak_kb = max(self.peak_kb, self._rss_kb())
+
+    def start(self):
+        self.peak_kb = self._rss_kb()
+        self.thread = threading.Thread(target=self._loop, name="memory-sampler", daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.stop_event.set()
+        self.thread.join()
+        return round(self.peak_kb / 1024, 1)
+
+
+class LoadRun:
+    """Collects the per-request and per-capture results of one load level."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.request_latencies = []
+        self.success_latencies = []
+        self.capture_latencies = []
+        self.requests = 0
+        self.errors = 0
+        self.frames = 0
+        self.status_counts = {}
+
+    def record_request(self, latency, status, body, frame_count):
+        error = status >= 400 or body is None or 'error' in body
+        with self.lock:
+            self.request_latencies.append(latency)
+            self.requests += 1
+            self.errors += error
+            if not error:
+                self.frames += frame_count
+                self.success_latencies.append(latency)
+            self.status_counts[status] = self.status_counts.get(status, 0) + 1
+        return not error
+
+    def record_capture(self, latency):
+        with self.lock:
+            self.capture_latencies.append(latency)
+
+    def summary(self, elapsed):
+        def percentiles(latencies):
+            if not latencies:
+                return {"p50": None, "p95": None, "p99": None}
+            p50, p95, p99 = np.percentile(np.array(latencies) * 1000, [50, 95, 99])
+            return {"p50": round(p50, 1), "p95": round(p95, 1), "p99": round(p99, 1)}
+
+        return {
+            "elapsed_s": round(elapsed, 2),
+            "captures": len(self.capture_latencies),
+            "requests": self.requests,
+            "frames": self.frames,
+            "requests_per_second": round(self.requests / elapsed, 2),
+            "frames_per_second": round(self.frames / elapsed, 1),
+            "error_rate": round(self.errors / self.requests, 4) if self.requests else 0.0,
+            "status_counts": {str(status): count for status, count in sorted(self.status_counts.items())},
+            "request_latency_ms": percentiles(self.request_latencies),
+            "success_latency_ms": percentiles(self.success_latencies),
+            "capture_latency_ms": percentiles(self.capture_latencies),
+        }
+
+
+def send_capture(target, capture, use_video, run, started_at):
+    """Send one capture and record it. Latencies count from started_at, the scheduled arrival time.
+
+    Returns the server's retry_after hint when the capture was rejected with a 429, else None.
+    """
+    request_start = started_at
+    retry_after = None
+    if use_video:
+        filename, video_bytes = capture["video"]
+        try:
+            status, body = target.post_video(filename, video_bytes)
+        except Exception:
+            status, body = 599, None
+        frame_count = (body or {}).get('frames_analyzed', 0)
+        run.record_request(time.perf_counter() - request_start, status, body, frame_count)
+        if status == 429:
+            retry_after = (body or {}).get('retry_after', 1)
+    else:
+        # Batches go one after another, like the extension waiting on each response
+        for request_id, request_body, frame_count in capture["batches"]:
+            try:
+                status, body = target.post_frames(request_id, request_body)
+            except Exception:
+                status, body = 599, None
+            ok = run.record_request(time.perf_counter() - request_start, status, body, frame_count)
+            request_start = time.perf_counter()
+            if not ok:
+                if status == 429:
+                    retry_after = (body or {}).get('retry_after', 1)
+                break
+    run.record_capture(time.perf_counter() - started_at)
+    return retry_after
+
+
+def run_level(target, captures, concurrency, duration, rate, video_ratio, server_pid, seed):
+    """Run one load level and return its summary.
+
+    Without a rate, concurrency workers send captures back to back (closed loop). With a
+    rate, captures arrive as a Poisson process and wait for one of concurrency workers
+    (open loop), and their latency includes that wait.
+    """
+    rng = random.Random(seed)
+    run = LoadRun()
+    memory = MemorySampler(server_pid)
+    memory.start()
+    start = time.perf_counter()
+    deadline = start + duration
+
+    def pick():
+        return captures[rng.randrange(len(captures))], rng.random() < video_ratio
+
+    if rate:
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            next_arrival = start
+            while next_arrival < deadline:
+                time.sleep(max(0.0, next_arrival - time.perf_counter()))
+                capture, use_video = pick()
+                executor.submit(send_capture, target, capture, use_video, run, next_arrival)
+                next_arrival += rng.expovariate(rate)
+    else:
+        def worker():
+            while time.perf_counter() < deadline:
+                capture, use_video = pick()
+                retry_after = send_capture(target, capture, use_video, run, time.perf_counter())
+                # Rejected clients back off as told, instead of hammering a saturated server
+                if retry_after:
+                    time.sleep(max(0.0, min(retry_after, deadline - time.perf_counter())))
+        threads = [threading.Thread(target=worker, name=f"load-{n}") for n in range(concurrency)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+    summary = run.summary(time.perf_counter() - start)
+    summary["peak_rss_mb"] = memory.stop()
+    return summary
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Replay extension traffic against the deepfake detection API")
+    parser.add_argument("--url", help="Server to load, the app runs in-process when omitted")
+    parser.add_argument("--server-pid", type=int, help="Server process to track memory for (with --url)")
+    parser.add_argument("--concurrency", nargs="+", type=int, default=[1, 2, 4, 8],
+                        help="Concurrency levels to sweep")
+    parser.add_argument("--rate", type=float, default=None, help="Capture arrivals per second (open loop)")
+    parser.add_argument("--duration", type=float, default=20.0, help="Seconds per level")
+    parser.add_argument("--frames-per-capture", type=int, default=150,
+                        help="Frames per capture, over 100 are sent in batches like the extension")
+    parser.add_argument("--video-ratio", type=float, default=0.0, help="Fraction of captures sent as / uploads")
+    parser.add_argument("--pool-size", type=int, default=8, help="Distinct captures to build and replay")
+    parser.add_argument("--videos", nargs="+", default=offline_env.SAMPLE_VIDEOS)
+    parser.add_argument("--mongo-latency-ms", type=float, default=1.0,
+                        help="Simulated database round trip (in-process only)")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", default="loadtest_results.json")
+    args = parser.parse_args(argv)
+
+    if args.url:
+        target = HttpTarget(args.url)
+        server_pid = args.server_pid
+    else:
+        target = InProcessTarget(offline_env.load_app(mongo_latency=args.mongo_latency_ms / 1000))
+        server_pid = None
+
+    print(f"Building {args.pool_size} captures of {args.frames_per_capture} frames "
+          f"({len(split_batches(args.frames_per_capture))} request(s) each)")
+    captures = build_captures(args.videos, args.frames_per_capture, args.pool_size, args.seed)
+
+    levels = []
+    for concurrency in args.concurrency:
+        print(f"Running concurrency {concurrency} for {args.duration:.0f}s"
+              + (f" at {args.rate} captures/s" if args.rate else ""))
+        summary = run_level(target, captures, concurrency, args.duration, args.rate,
+                            args.video_ratio, server_pid, args.seed + concurrency)
+        summary["concurrency"] = concurrency
+        levels.append(summary)
+
+    print(f"\n{'Conc':>5} {'req/s':>8} {'frames/s':>9} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'errors':>8} {'peak MB':>8}")
+    for level in levels:
+        latency = level["success_latency_ms"]
+        print(f"{level['concurrency']:>5} {level['requests_per_second']:>8.2f} {level['frames_per_second']:>9.1f} "
+              f"{latency['p50'] or 0:>9.1f} {latency['p95'] or 0:>9.1f} {latency['p99'] or 0:>9.1f} "
+              f"{level['error_rate']:>8.2%} {level['peak_rss_mb'] or 0:>8.1f}")
+
+    results = {
+        "metadata": {
+            "timestamp": datetime.now().isoformat(),
+            "target": args.url or "in-process",
+            "rate": args.rate,
+            "duration_s": args.duration,
+            "frames_per_capture": args.frames_per_capture,
+            "video_ratio": args.video_ratio,
+            "cpu_count": os.cpu_count(),
+        },
+        "levels": levels,
+    }
+    with open(args.output, "w") as f:
+        json.dump(results, f, indent=2)
+    print(f"\nResults saved to {args.output}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
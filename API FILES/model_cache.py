@@ -0,0 +1,64 @@
+import os
+import shutil
+import tempfile
+import platform
+import onnxruntime as ort
+
+# Cache of optimized model graphs, so a boot loads an already optimized graph instead of
+# running the graph optimizers again. Only the hardware-independent levels (up to "extended")
+# are serialized; the layout optimizations of "all" depend on the CPU and are reapplied,
+# cheaply, when the cached graph is loaded.
+#
+# With external_data the weights are written to a separate .data file. ONNX Runtime memory
+# maps that file, so every process serving the model shares one copy of the weights in the
+# page cache, as long as the sessions run with prepacking disabled.
+
+SAVED_OPTIMIZATION_LEVELS = {
+    "basic": ("basic", ort.GraphOptimizationLevel.ORT_ENABLE_BASIC),
+    "extended": ("extended", ort.GraphOptimizationLevel.ORT_ENABLE_EXTENDED),
+    "all": ("extended", ort.GraphOptimizationLevel.ORT_ENABLE_EXTENDED),
+}
+
+
+def optimized_model_filepath(model_path, cache_dir, graph_optimization="all", external_data=False):
+    """Return where the optimized graph of model_path is cached, or None for levels with nothing to save.
+
+    The name changes with the model file, the ONNX Runtime version and the CPU architecture,
+    so a new model or runtime never picks up a stale graph.
+    """
+    if graph_optimization not in SAVED_OPTIMIZATION_LEVELS:
+        return None
+    saved_level, _ = SAVED_OPTIMIZATION_LEVELS[graph_optimization]
+    stat = os.stat(model_path)
+    stem = os.path.splitext(os.path.basename(model_path))[0]
+    layout = ".external" if external_data else ""
+    name = f"{stem}.{stat.st_size}-{stat.st_mtime_ns}.ort-{ort.__version__}.{platform.machine()}.{saved_level}{layout}.onnx"
+    return os.path.join(cache_dir, name)
+
+
+def build_optimized_model(model_path, cache_dir, graph_optimization="all", options=None, external_data=False):
+    """Optimize model_path and write the graph into cache_dir, returning the cached path.
+
+    The files are written into a temporary directory and moved into place weights first,
+    so concurrent boots never read a partly written model.
+    """
+    cached_path = optimized_model_filepath(model_path, cache_dir, graph_optimization, external_data)
+    if cached_path is None:
+        raise ValueError(f"Graph optimization level '{graph_optimization}' has nothing to cache")
+    os.makedirs(cache_dir, exist_ok=True)
+
+    options = options or ort.SessionOptions()
+    options.graph_optimization_level = SAVED_OPTIMIZATION_LEVELS[graph_optimization][1]
+    build_dir = tempfile.mkdtemp(prefix=".build-", dir=cache_dir)
+    try:
+        options.optimized_model_filepath = os.path.join(build_dir, os.path.basename(cached_path))
+        if external_data:
+            data_name = os.path.splitext(os.path.basename(cached_path))[0] + ".data"
+            options.add_session_config_entry("session.optimized_model_external_initializers_file_name", data_name)
+            options.add_session_config_entry("session.optimized_model_external_initializers_min_size_in_bytes", "1024")
+        ort.InferenceSession(model_path, sess_options=options, providers=["CPUExecutionProvider"])
+        for name in sorted(os.listdir(build_dir), key=lambda name: name.endswith(".onnx")):
+            os.replace(os.path.join(build_dir, name), os.path.join(cache_dir, name))
+    finally:
+        shutil.rmtree(build_dir, ignore_errors=True)
+    return cached_path
@@ -0,0 +1,238 @@
+import os
+import sys
+import time
+import argparse
+import numpy as np
+import cv2
+import onnxruntime as ort
+from preprocessing import PreprocessEngine, preprocess_frame
+
+# Sample videos used for calibration and for the accuracy check
+SAMPLE_VIDEOS = ["fake_23.mp4", "real_1.mp4"]
+
+# Same decision rule as the API: frames below the threshold are deepfake frames,
+# and a video is a deepfake when more than half of its frames are
+FRAME_THRESHOLD = 0.8
+
+
+def read_video_frames(video_path, max_frames=None, stride=1):
+    """Read frames from a video, keeping every stride-th frame up to max_frames."""
+    cap = cv2.VideoCapture(video_path)
+    if not cap.isOpened():
+        raise IOError(f"Cannot read video file: {video_path}")
+    frames = []
+    index = 0
+    try:
+        while max_frames is None or len(frames) < max_frames:
+            ret, frame = cap.read()
+            if not ret:
+                break
+            if index % stride == 0:
+                frames.append(frame)
+            index += 1
+    finally:
+        cap.release()
+    return frames
+
+
+class VideoCalibrationReader:
+    """Feeds preprocessed frames from the sample videos to the static quantization calibrator."""
+
+    def __init__(self, input_name, video_paths, frames_per_video, batch_size=8):
+        from onnxruntime.quantization import CalibrationDataReader  # noqa: F401, checks the extra is installed
+        frames = []
+        for video_path in video_paths:
+            frames.extend(read_video_frames(video_path, max_frames=frames_per_video, stride=5))
+        tensors = np.concatenate([preprocess_frame(frame) for frame in frames], axis=0)
+        self.batches = iter([{input_name: tensors[i:i + batch_size]} for i in range(0, len(tensors), batch_size)])
+
+    def get_next(self):
+        return next(self.batches, None)
+
+
+def quantize(args):
+    """Create an INT8 copy of the FP32 model."""
+    from onnxruntime.quantization import quantize_dynamic, quantize_static, QuantType, QuantFormat
+    
+    if args.mode == "dynamic":
+        # Weights are quantized ahead of time, activations at run time, no calibration needed
+        quantize_dynamic(args.input, args.output, weight_type=QuantType.QInt8)
+    else:
+        # Activation ranges are calibrated on frames from the sample videos
+        input_name = ort.InferenceSession(args.input, providers=["CPUExecutionProvider"]).get_inputs()[0].name
+        reader = VideoCalibrationReader(input_name, args.videos, args.calibration_frames)
+        quantize_static(args.input, args.output, reader, quant_format=QuantFormat.QDQ,
+                        activation_type=QuantType.QUInt8, weight_type=QuantType.QInt8, per_channel=True)
+    
+    print(f"Wrote {args.mode} INT8 model to {args.output} "
+          f"({os.path.getsize(args.input) / 1e6:.1f} MB -> {os.path.getsize(args.output) / 1e6:.1f} MB)")
+
+
+def uint8_input(args):
+    """Wrap a float model so it takes raw uint8 pixels and does the 0-1 scaling inside the graph."""
+    try:
+        import onnx
+        from onnx import helper, TensorProto
+    except ImportError:
+        print("The onnx package is required for uint8-input: pip install onnx")
+        return 1
+    
+    model = onnx.load(args.input)
+    graph = model.graph
+    original_input = graph.input[0]
+    float_name = f"{original_input.name}_float"
+    
+    # Point every consumer of the float input at the scaled tensor instead
+    for node in graph.node:
+        for i, name in enumerate(node.input):
+            if name == original_input.name:
+                node.input[i] = float_name
+    
+    dims = [dim.dim_param or dim.dim_value for dim in original_input.type.tensor_type.shape.dim]
+    uint8_input_info = helper.make_tensor_value_info(original_input.name, TensorProto.UINT8, dims)
+    scale = helper.make_tensor(f"{original_input.name}_scale", TensorProto.FLOAT, [], [255.0])
+    graph.initializer.append(scale)
+    scaling_nodes = [
+        helper.make_node("Cast", [original_input.name], [f"{original_input.name}_cast"], to=TensorProto.FLOAT),
+        helper.make_node("Div", [f"{original_input.name}_cast", scale.name], [float_name]),
+    ]
+    
+    graph.input.remove(original_input)
+    graph.input.insert(0, uint8_input_info)
+    nodes = scaling_nodes + list(graph.node)
+    del graph.node[:]
+    graph.node.extend(nodes)
+    
+    onnx.checker.check_model(model)
+    onnx.save(model, args.output)
+    print(f"Wrote uint8-input model to {args.output}, point ONNX_MODEL_PATH at it to serve it")
+    return 0
+
+
+def predict_video(session, frames, batch_size):
+    """Run a session over frames, returning per-frame predictions and the average seconds per frame."""
+    input_name = session.get_inputs()[0].name
+    fixed_batch = session.get_inputs()[0].shape[0]
+    if isinstance(fixed_batch, int) and fixed_batch > 0:
+        batch_size = fixed_batch
+    engine = PreprocessEngine(dtype=np.uint8 if session.get_inputs()[0].type == 'tensor(uint8)' else np.float32)
+    
+    predictions = []
+    start_time = time.perf_counter()
+    for start in range(0, len(frames), batch_size):
+        batch = engine.preprocess_batch(frames[start:start + batch_size])
+        count = len(batch)
+        if isinstance(fixed_batch, int) and fixed_batch > count:
+            batch = np.concatenate([batch, np.zeros((fixed_batch - count,) + batch.shape[1:], dtype=batch.dtype)])
+        output = session.run(None, {input_name: batch})
+        predictions.extend(np.asarray(output[0]).reshape(len(batch), -1)[:count, 0].tolist())
+    elapsed = time.perf_counter() - start_time
+    return np.array(predictions), elapsed / max(1, len(frames))
+
+
+def verdict(predictions):
+    """Apply the API's decision rule to a set of frame predictions."""
+    deepfake_ratio = float(np.mean(predictions < FRAME_THRESHOLD))
+    return deepfake_ratio > 0.5, deepfake_ratio
+
+
+def check(args):
+    """Compare INT8 and FP32 predictions and verdicts on the sample videos, failing if the gate is not met."""
+    sessions = {}
+    for name, path in (("fp32", args.fp32), ("int8", args.int8)):
+        options = ort.SessionOptions()
+        options.intra_op_num_threads = args.threads
+        sessions[name] = ort.InferenceSession(path, sess_options=options, providers=["CPUExecutionProvider"])
+    
+    failures = []
+    for video_path in args.videos:
+        frames = read_video_frames(video_path, max_frames=args.max_frames)
+        fp32_predictions, fp32_time = predict_video(sessions["fp32"], frames, args.batch_size)
+        int8_predictions, int8_time = predict_video(sessions["int8"], frames, args.batch_size)
+        
+        abs_diff = np.abs(fp32_predictions - int8_predictions)
+        agreement = float(np.mean((fp32_predictions < FRAME_THRESHOLD) == (int8_predictions < FRAME_THRESHOLD)))
+        fp32_verdict, fp32_ratio = verdict(fp32_predictions)
+        int8_verdict, int8_ratio = verdict(int8_predictions)
+        
+        print(f"\n{video_path}: {len(frames)} frames")
+        print(f"  Prediction diff - Mean: {abs_diff.mean():.4f}, Max: {abs_diff.max():.4f}")
+        print(f"  Frame label agreement: {agreement * 100:.2f}%")
+        print(f"  Verdict - FP32: {'DEEPFAKE' if fp32_verdict else 'AUTHENTIC'} (ratio {fp32_ratio:.4f}), "
+              f"INT8: {'DEEPFAKE' if int8_verdict else 'AUTHENTIC'} (ratio {int8_ratio:.4f})")
+        print(f"  Latency per frame - FP32: {fp32_time * 1000:.2f} ms, INT8: {int8_time * 1000:.2f} ms "
+              f"({fp32_time / int8_time:.2f}x)")
+        
+        if fp32_verdict != int8_verdict:
+            failures.append(f"{video_path}: verdict changed")
+        if agreement < args.min_agreement:
+            failures.append(f"{video_path}: frame agreement {agreement:.4f} below {args.min_agreement}")
+        if abs_diff.max() > args.max_diff:
+            failures.append(f"{video_path}: max prediction diff {abs_diff.max():.4f} above {args.max_diff}")
+    
+    print(f"\nModel size - FP32: {os.path.getsize(args.fp32) / 1e6:.1f} MB, INT8: {os.path.getsize(args.int8) / 1e6:.1f} MB")
+    if failures:
+        print("Accuracy gate FAILED:")
+        for failure in failures:
+            print(f"  {failure}")
+        return 1
+    print("Accuracy gate passed")
+    return 0
+
+
+def optimize(args):
+    """Cache the optimized graphs of the models, so the API skips graph optimization at boot."""
+    import model_cache
+    for model_path in args.models:
+        if not os.path.exists(model_path):
+            print(f"Skipping {model_path}: not found")
+            continue
+        started = time.perf_counter()
+        cached_path = model_cache.build_optimized_model(model_path, args.cache_dir, args.graph_optimization,
+                                                        external_data=args.external_data)
+        print(f"Wrote {cached_path} ({time.perf_counter() - started:.2f}s)")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Model tools for the deepfake detection API")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    
+    quantize_parser = subparsers.add_parser("quantize", help="Create an INT8 model")
+    quantize_parser.add_argument("--input", default="FinalModel.onnx")
+    quantize_parser.add_argument("--output", default="FinalModel.int8.onnx")
+    quantize_parser.add_argument("--mode", choices=["dynamic", "static"], default="static")
+    quantize_parser.add_argument("--videos", nargs="+", default=SAMPLE_VIDEOS, help="Calibration videos (static mode)")
+    quantize_parser.add_argument("--calibration-frames", type=int, default=100, help="Frames per calibration video")
+    quantize_parser.set_defaults(func=quantize)
+    
+    check_parser = subparsers.add_parser("check", help="Compare INT8 against FP32 on the sample videos")
+    check_parser.add_argument("--fp32", default="FinalModel.onnx")
+    check_parser.add_argument("--int8", default="FinalModel.int8.onnx")
+    check_parser.add_argument("--videos", nargs="+", default=SAMPLE_VIDEOS)
+    check_parser.add_argument("--max-frames", type=int, default=None)
+    check_parser.add_argument("--batch-size", type=int, default=32)
+    check_parser.add_argument("--threads", type=int, default=os.cpu_count() or 1)
+    check_parser.add_argument("--min-agreement", type=float, default=0.98, help="Minimum fraction of frames with the same label")
+    check_parser.add_argument("--max-diff", type=float, default=0.1, help="Maximum per-frame prediction difference")
+    check_parser.set_defaults(func=check)
+    
+    uint8_parser = subparsers.add_parser("uint8-input", help="Move the 0-1 input scaling into the graph")
+    uint8_parser.add_argument("--input", default="FinalModel.onnx")
+    uint8_parser.add_argument("--output", default="FinalModel.uint8.onnx")
+    uint8_parser.set_defaults(func=uint8_input)
+    
+    optimize_parser = subparsers.add_parser("optimize", help="Cache the optimized model graphs for faster boots")
+    optimize_parser.add_argument("--models", nargs="+", default=["FinalModel.onnx", "FinalModel.int8.onnx"])
+    optimize_parser.add_argument("--cache-dir", default=os.environ.get("ORT_OPTIMIZED_MODEL_DIR", "ort_cache"))
+    optimize_parser.add_argument("--graph-optimization", choices=["basic", "extended", "all"], default="all",
+                                 help="Level the API runs with (ORT_GRAPH_OPTIMIZATION)")
+    optimize_parser.add_argument("--external-data", action="store_true",
+                                 help="Write the weights to a separate file, as MODEL_SHARED_WEIGHTS=1 loads them")
+    optimize_parser.set_defaults(func=optimize)
+    
+    args = parser.parse_args(argv)
+    return args.func(args) or 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,274 @@
+import os
+import re
+import copy
+import time
+import threading
+import pymongo
+from pymongo.results import InsertOneResult, InsertManyResult, UpdateResult, DeleteResult
+
+# Offline stand-ins for the benchmark and load-testing tools: a small ONNX model with the
+# same input and output contract as FinalModel.onnx, and an in-memory MongoDB database
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+STUB_MODEL_PATH = os.path.join(BASE_DIR, "stub_model.onnx")
+SAMPLE_VIDEOS = [os.path.join(BASE_DIR, "fake_23.mp4"), os.path.join(BASE_DIR, "real_1.mp4")]
+
+
+def write_stub_model(path=STUB_MODEL_PATH):
+    """Write the stub model: a strided conv, global pooling and a sigmoid score per frame.
+
+    Needs the onnx package, which the API itself does not. The generated file is
+    committed, so this only has to run when the stub changes.
+    """
+    import numpy as np
+    import onnx
+    from onnx import helper, numpy_helper, TensorProto
+
+    rng = np.random.default_rng(0)
+    conv_weight = numpy_helper.from_array(rng.normal(0, 0.1, (8, 3, 3, 3)).astype(np.float32), "conv_weight")
+    conv_bias = numpy_helper.from_array(np.zeros(8, dtype=np.float32), "conv_bias")
+    fc_weight = numpy_helper.from_array(rng.normal(0, 0.5, (8, 1)).astype(np.float32), "fc_weight")
+    fc_bias = numpy_helper.from_array(np.array([1.0], dtype=np.float32), "fc_bias")
+
+    nodes = [
+        helper.make_node("Conv", ["input.1", "conv_weight", "conv_bias"], ["conv"], strides=[2, 2], pads=[1, 1, 1, 1]),
+        helper.make_node("Relu", ["conv"], ["relu"]),
+        helper.make_node("GlobalAveragePool", ["relu"], ["pool"]),
+        helper.make_node("Flatten", ["pool"], ["flat"]),
+        helper.make_node("Gemm", ["flat", "fc_weight", "fc_bias"], ["logit"]),
+        helper.make_node("Sigmoid", ["logit"], ["output"]),
+    ]
+    graph = helper.make_graph(
+        nodes, "stub_deepfake_detector",
+        [helper.make_tensor_value_info("input.1", TensorProto.FLOAT, ["N", 3, 224, 224])],
+        [helper.make_tensor_value_info("output", TensorProto.FLOAT, ["N", 1])],
+        initializer=[conv_weight, conv_bias, fc_weight, fc_bias],
+    )
+    model = helper.make_model(graph, opset_imports=[helper.make_opsetid("", 13)])
+    model.ir_version = 8
+    onnx.checker.check_model(model)
+    onnx.save(model, path)
+    return path
+
+
+def _get_field(document, path):
+    value = document
+    for part in path.split("."):
+        if not isinstance(value, dict) or part not in value:
+            return None, False
+        value = value[part]
+    return value, True
+
+
+def _matches(document, query):
+    """Match a document against the small subset of the query language the API uses."""
+    for key, condition in (query or {}).items():
+        if key == "$or":
+            if not any(_matches(document, sub_query) for sub_query in condition):
+                return False
+            continue
+        value, present = _get_field(document, key)
+        if isinstance(condition, dict) and any(op.startswith("$") for op in condition):
+            for op, operand in condition.items():
+                if op == "$in" and not (present and value in operand):
+                    return False
+                if op == "$nin" and present and value in operand:
+                    return False
+                if op == "$exists" and present != bool(operand):
+                    return False
+                if op == "$ne" and present and value == operand:
+                    return False
+                if op in ("$lt", "$lte", "$gt", "$gte"):
+                    if not present or value is None:
+                        return False
+                    if op == "$lt" and not value < operand:
+                        return False
+                    if op == "$lte" and not value <= operand:
+                        return False
+                    if op == "$gt" and not value > operand:
+                        return False
+                    if op == "$gte" and not value >= operand:
+                        return False
+                if op == "$regex" and not (present and re.search(operand, str(value))):
+                    return False
+        elif not present or value != condition:
+            return False
+    return True
+
+
+def _set_field(document, path, value):
+    *parents, field = path.split(".")
+    for part in parents:
+        document = document.setdefault(part, {})
+    document[field] = value
+
+
+def _apply_update(document, update):
+    for field, value in update.get("$set", {}).items():
+        _set_field(document, field, value)
+    for field in update.get("$unset", {}):
+        document.pop(field, None)
+    for field, value in update.get("$setOnInsert", {}).items():
+        document.setdefault(field, value)
+    for field, value in update.get("$inc", {}).items():
+        document[field] = document.get(field, 0) + value
+
+
+class InMemoryCollection:
+    """Thread-safe in-memory stand-in for a pymongo collection.
+
+    latency is slept once per call to emulate the network round trip to Mongo.
+    """
+
+    def __init__(self, name, latency=0.0):
+        self.name = name
+        self.latency = latency
+        self.documents = {}
+        self.indexes = []
+        self.lock = threading.Lock()
+        self.calls = 0
+
+    def _round_trip(self):
+        self.calls += 1
+        if self.latency:
+            time.sleep(self.latency)
+
+    def _insert(self, document):
+        document = copy.deepcopy(document)
+        document.setdefault("_id", f"{self.name}-{len(self.documents)}-{time.monotonic_ns()}")
+        if document["_id"] in self.documents:
+            return None
+        self.documents[document["_id"]] = document
+        return document["_id"]
+
+    def insert_one(self, document):
+        self._round_trip()
+        with self.lock:
+            inserted_id = self._insert(document)
+        if inserted_id is None:
+            raise pymongo.errors.DuplicateKeyError(f"E11000 duplicate key {document['_id']}", 11000)
+        document.setdefault("_id", inserted_id)
+        return InsertOneResult(inserted_id, True)
+
+    def insert_many(self, documents, ordered=True):
+        self._round_trip()
+        inserted_ids = []
+        write_errors = []
+        with self.lock:
+            for index, document in enumerate(documents):
+                inserted_id = self._insert(document)
+                if inserted_id is None:
+                    write_errors.append({"index": index, "code": 11000, "errmsg": f"E11000 duplicate key {document['_id']}"})
+                    if ordered:
+                        break
+                else:
+                    inserted_ids.append(inserted_id)
+        if write_errors:
+            raise pymongo.errors.BulkWriteError({"writeErrors": write_errors, "nInserted": len(inserted_ids)})
+        return InsertManyResult(inserted_ids, True)
+
+    def find(self, query=None, projection=None, sort=None, limit=0, batch_size=None):
+        self._round_trip()
+        with self.lock:
+            documents = [copy.deepcopy(document) for document in self.documents.values() if _matches(document, query)]
+        for field, direction in sort or []:
+            documents.sort(key=lambda document: (_get_field(document, field)[0] is None, _get_field(document, field)[0]),
+                           reverse=direction < 0)
+        return iter(documents[:limit] if limit else documents)
+
+    def find_one(self, query=None, projection=None):
+        return next(self.find(query), None)
+
+    def count_documents(self, query=None):
+        return sum(1 for _ in self.find(query))
+
+    def estimated_document_count(self):
+        return len(self.documents)
+
+    def replace_one(self, query, replacement, upsert=False):
+        self._round_trip()
+        with self.lock:
+            for key, document in self.documents.items():
+                if _matches(document, query):
+                    self.documents[key] = dict(copy.deepcopy(replacement), _id=key)
+                    return UpdateResult({"n": 1, "nModified": 1}, True)
+            if upsert:
+                self._insert(dict(copy.deepcopy(replacement), _id=query.get("_id")))
+                return UpdateResult({"n": 1, "nModified": 0, "upserted": query.get("_id")}, True)
+        return UpdateResult({"n": 0, "nModified": 0}, True)
+
+    def update_one(self, query, update, upsert=False):
+        return self._update(query, update, upsert, many=False)
+
+    def update_many(self, query, update, upsert=False):
+        return self._update(query, update, upsert, many=True)
+
+    def _update(self, query, update, upsert, many):
+        self._round_trip()
+        modified = 0
+        with self.lock:
+            for document in self.documents.values():
+                if _matches(document, query):
+                    _apply_update(document, update)
+                    modified += 1
+                    if not many:
+                        break
+            if not modified and upsert:
+                document = {key: value for key, value in query.items() if not isinstance(value, dict)}
+                _apply_update(document, update)
+                self._insert(document)
+        return UpdateResult({"n": modified, "nModified": modified}, True)
+
+    def delete_many(self, query):
+        self._round_trip()
+        with self.lock:
+            keys = [key for key, document in self.documents.items() if _matches(document, query)]
+            for key in keys:
+                del self.documents[key]
+        return DeleteResult({"n": len(keys)}, True)
+
+    def create_index(self, keys, **kwargs):
+        self.indexes.append((keys, kwargs))
+        return str(keys)
+
+
+class InMemoryDatabase:
+    """In-memory stand-in for a pymongo database, collections are created on first use."""
+
+    def __init__(self, latency=0.0):
+        self.latency = latency
+        self.collections = {}
+        self.lock = threading.Lock()
+
+    def __getitem__(self, name):
+        with self.lock:
+            if name not in self.collections:
+                self.collections[name] = InMemoryCollection(name, self.latency)
+            return self.collections[name]
+
+    def __getattr__(self, name):
+        if name.startswith("_"):
+            raise AttributeError(name)
+        return self[name]
+
+
+def load_app(model_path=STUB_MODEL_PATH, mongo_latency=0.0, **env):
+    """Import app.py against the stub model and an in-memory database.
+
+    Extra keyword arguments are set as environment variables before the import,
+    e.g. load_app(VERDICT_CACHE="0"). The verdict cache is off unless asked for,
+    so repeated runs measure the full pipeline.
+    """
+    os.environ["ONNX_MODEL_PATH"] = model_path
+    os.environ.setdefault("VERDICT_CACHE", "0")
+    for name, value in env.items():
+        os.environ[name] = str(value)
+
+    import app
+    app.db = InMemoryDatabase(latency=mongo_latency)
+    app.wait_for_model()
+    return app
+
+
+if __name__ == "__main__":
+    print(f"Wrote {write_stub_model()}")
@@ -0,0 +1,66 @@
+import threading
+import numpy as np
+import cv2
+
+# Model input resolution
+INPUT_SIZE = 224
+
+
+def _write_frame(frame, resized, out):
+    """Resize a BGR frame into resized, then write it to out as CHW in a single pass.
+
+    Float outputs are scaled to 0-1 during the same pass, uint8 outputs keep the raw pixels.
+    """
+    cv2.resize(frame, (INPUT_SIZE, INPUT_SIZE), dst=resized)
+    chw = resized.transpose(2, 0, 1)  # View only, the copy happens in the ufunc below
+    if out.dtype == np.uint8:
+        np.copyto(out, chw)
+    else:
+        np.divide(chw, out.dtype.type(255.0), out=out, casting='unsafe')
+
+
+class PreprocessEngine:
+    """Preprocesses batches of frames into reusable N x 3 x 224 x 224 buffers.
+
+    Every thread gets its own batch and resize buffers, which grow to the largest
+    batch seen and are then reused, so the hot loop allocates nothing per frame.
+    preprocess_batch returns a view of the thread's buffer that stays valid until
+    the same thread calls it again.
+
+    With max_batch set the batch buffer never grows past max_batch frames; a larger
+    batch gets a one-off array, so one big request does not pin its size in every thread.
+
+    With dtype=np.uint8 the raw pixels are passed through for models that do the
+    0-1 scaling in the graph (see model_tools.py uint8-input).
+    """
+
+    def __init__(self, dtype=np.float32, max_batch=None):
+        self.dtype = np.dtype(dtype)
+        self.max_batch = max_batch
+        self.local = threading.local()
+
+    def _buffers(self, count):
+        if getattr(self.local, 'resized', None) is None:
+            self.local.resized = np.empty((INPUT_SIZE, INPUT_SIZE, 3), dtype=np.uint8)
+        if self.max_batch is not None and count > self.max_batch:
+            return np.empty((count, 3, INPUT_SIZE, INPUT_SIZE), dtype=self.dtype), self.local.resized
+        batch = getattr(self.local, 'batch', None)
+        if batch is None or len(batch) < count:
+            size = count if self.max_batch is None else self.max_batch
+            batch = np.empty((size, 3, INPUT_SIZE, INPUT_SIZE), dtype=self.dtype)
+            self.local.batch = batch
+        return batch, self.local.resized
+
+    def preprocess_batch(self, frames):
+        """Preprocess a list of frames into the thread's reusable batch buffer."""
+        batch, resized = self._buffers(len(frames))
+        for i, frame in enumerate(frames):
+            _write_frame(frame, resized, batch[i])
+        return batch[:len(frames)]
+
+
+def preprocess_frame(frame, dtype=np.float32):
+    """Preprocess a single frame into a new 1 x 3 x 224 x 224 array for model inference."""
+    out = np.empty((1, 3, INPUT_SIZE, INPUT_SIZE), dtype=dtype)
+    _write_frame(frame, np.empty((INPUT_SIZE, INPUT_SIZE, 3), dtype=np.uint8), out[0])
+    return out
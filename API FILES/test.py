@@ -1,5 +1,6 @@
 import requests
 import json
+import sys
 import time
 
 #  Current running port
@@ -9,14 +10,23 @@ API_URL = "http://127.0.0.1:8081"
 #TEST_FAKE_VIDEO = "fake_23.mp4"
 TEST_REAL_VIDEO = "fake_23.mp4"  
 
-def test_video(video_path):
+# Videos and frame sampling options compared by --sampling
+SAMPLING_VIDEOS = ["fake_23.mp4", "real_1.mp4"]
+SAMPLING_OPTIONS = [
+    {"sampling": "all"},
+    {"sampling": "stride", "stride": "5"},
+    {"sampling": "uniform", "frame_budget": "32"},
+    {"sampling": "keyframe"},
+]
+
+def test_video(video_path, options=None):
     print(f"\nTesting video: {video_path}")
     start_time = time.time()
     
     with open(video_path, "rb") as video_file:
         files = {"file": video_file}
         try:
-            response = requests.post(API_URL, files=files, timeout=300)
+            response = requests.post(API_URL, files=files, data=options or {}, timeout=300)
             
             # Printing response status
             print(f"Response status code: {response.status_code}")
@@ -43,9 +53,51 @@ def test_video(video_path):
             print(f"Test FAILED: {str(e)}")
             return None
 
+def compare_sampling():
+    """Time each sampling mode against full analysis and check whether the verdict changes."""
+    rows = []
+    for video_path in SAMPLING_VIDEOS:
+        baseline = None
+        for options in SAMPLING_OPTIONS:
+            start_time = time.time()
+            result = test_video(video_path, options)
+            elapsed_time = time.time() - start_time
+            if result is None:
+                continue
+            if baseline is None:
+                baseline = (elapsed_time, result['deepfake'])
+            rows.append((video_path, options, elapsed_time, baseline[0] / elapsed_time,
+                         result['frames_analyzed'], result['deepfake'] == baseline[1]))
+    
+    print("\nSampling comparison:")
+    for video_path, options, elapsed_time, speedup, frames, same_verdict in rows:
+        print(f"  {video_path:<12} {json.dumps(options):<45} {elapsed_time:6.2f}s "
+              f"{speedup:5.2f}x  {frames:4d} frames  verdict {'unchanged' if same_verdict else 'CHANGED'}")
+
+def check_idle_admission(video_path=TEST_REAL_VIDEO):
+    """Check that an idle server admits a video larger than its frame budget.
+
+    Run the server with a budget below the video's frame count, e.g. ADMISSION_MAX_FRAMES=100
+    for the 325 frames of fake_23.mp4, and nothing else in flight.
+    """
+    with open(video_path, "rb") as video_file:
+        response = requests.post(API_URL, files={"file": video_file}, timeout=300)
+    result = response.json()
+    admitted = response.status_code != 429 and "error" not in result
+    print(f"Oversized request on an idle server: status {response.status_code}, "
+          f"{'admitted' if admitted else 'REJECTED'} ({result.get('frames_analyzed', result.get('error'))})")
+    return admitted
+
 if __name__ == "__main__":
     print(f"Testing API endpoint at {API_URL}")
     
+    if "--sampling" in sys.argv:
+        compare_sampling()
+        sys.exit(0)
+    
+    if "--admission" in sys.argv:
+        sys.exit(0 if check_idle_admission() else 1)
+    
     try:
         real_result = test_video(TEST_REAL_VIDEO)
     except FileNotFoundError:
@@ -495,6 +495,36 @@ function analyzeFrames(tabId, frames, metadata) {
       return;
     }
     
+    // Using the server's cumulative session verdict when available, it covers every batch with the same rules as a single request
+    const sessionResult = results.reduce((latest, result) => {
+      const session = result.session;
+      return session && (!latest || session.batches >= latest.batches) ? session : latest;
+    }, null);
+
+    // A partial session (another server worker, an evicted entry or a restart) covers only some frames, so the client merge is used instead
+    if (sessionResult && sessionResult.complete && sessionResult.batches === results.length) {
+      console.log(`Using server session ${sessionResult.id}: ${sessionResult.deepfake_frames}/${sessionResult.frames_analyzed} deepfake frames over ${sessionResult.batches} batches`);
+
+      showAnalysisResult(tabId, {
+        deepfake: sessionResult.deepfake,
+        confidence: sessionResult.confidence,
+        frames_analyzed: sessionResult.frames_analyzed,
+        deepfake_frames: sessionResult.deepfake_frames,
+        timestamp: metadata.timestamp,
+        requestId: metadata.randomId,
+        framesSent: metadata.frameCount || frames.length,
+        frameTimes: metadata.capturePositions || [],
+        batches: sessionResult.batches,
+        frameIds: results.flatMap(result => result.frameIds || [])
+      }, metadata);
+      return;
+    }
+
+    if (sessionResult) {
+      console.warn(`Ignoring incomplete server session ${sessionResult.id}: ${sessionResult.batches} of ${results.length} batches`);
+    }
+
+    // Falling back to merging on the client for servers without sessions
     // Calculating combined metrics
     let totalFramesAnalyzed = 0;
     let totalDeepfakeFrames = 0;